@@ -4,28 +4,134 @@ a few basic commands, but in most cases it delegates commands to a "mode" so
 that the bot can be switched among different running modes without restarting.
 """
 
+import collections
 import os
 import re
 import importlib
 from twisted.internet import defer, protocol, reactor
 from twisted.python import log
 from twisted.words.protocols import irc
-from pycon_bot import settings
+from pycon_bot import settings, stats
+from pycon_bot.outbox import Outbox
+from pycon_bot.timers import TimerService
+from pycon_bot.utils.text import seconds_to_text
+
+
+class ChannelContext(object):
+    """The bot, as seen by the mode running in one channel.
+
+    Every channel the bot is in has its own mode, state handler and timer,
+    so that meetings in different channels can run side by side without
+    tripping over each other. Everything else belongs to the bot, and is
+    passed through to it.
+    """
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
 
-class PyConBot(irc.IRCClient):
-    def __init__(self):
         # mode and state handler
         from pycon_bot.modes.base import SkeletonMode
         self.mode = SkeletonMode(self)
         self.state_handler = None
+
+        # the timers running, if any, and those stopped while we were
+        # disconnected
+        self.timers = TimerService(client.clock)
+        self._suspended = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __repr__(self):
+        return '<ChannelContext: %s, %s>' % (self.channel,
+                                              type(self.mode).__module__)
+
+    def set_timer(self, channel, seconds, message='Time has ended.',
+                        callback=None, callback_kwargs={}, name='main',
+                        warnings=()):
+        """Set a timer. By default, simply say `message` after
+        `seconds` have elapsed.
+
+        Additionally, if a callback is provided, run it. Any number of
+        timers may run at once, so long as they have different names;
+        setting a timer replaces any other of the same name. If
+        `warnings` are given, say how long is left when there are that
+        many seconds to go.
+        """
+        seconds = int(seconds)
+
+        def warn(seconds_left):
+            self.msg(channel, "=== %s left ===" % seconds_to_text(seconds_left))
+
+        # The callback is passed along as an argument, rather than wrapped
+        # up in a closure, so that a reloaded mode can swap in its own.
+        self.timers.start(name, seconds, self._time_up, channel, message,
+                          callback, callback_kwargs,
+                          warnings=warnings, on_warning=warn)
         
+    def _time_up(self, channel, message, callback, callback_kwargs):
+        if message:
+            self.msg(channel, "=== %s ===" % message)
+        if callback and callable(callback):
+            callback(**callback_kwargs)
+
+    def clear_timer(self, name='main'):
+        """Clear an already-set timer, and return it."""
+        return self.timers.cancel(name)
+
+    def suspend(self):
+        """Stop the clocks while we're cut off from the channel, so that
+        nothing runs out while nobody can hear about it.
+        """
+        self._suspended = self.timers.pause_all()
+
+    def resume(self):
+        """Start the clocks stopped by `suspend` again, with the time they
+        had left. Return True if there were any.
+        """
+        suspended, self._suspended = self._suspended, []
+        for name in suspended:
+            if self.timers.active(name):
+                self.timers.resume(name)
+        return bool(suspended)
+
+
+class PyConBot(irc.IRCClient):
+    def __init__(self):
+        # each channel's mode, state handler and timer
+        self.contexts = {}
+
         # variables storing superuser information
         self.potential_superusers = settings.IRC_SUPERUSERS
         self.superusers = set()
         self._namescallback = {}
-        
-        # the timer running, if any
-        self.timer = None
+
+        # when each superuser was last verified with NickServ, whom we're
+        # still waiting to hear about (by lower-cased nick, with the nick
+        # we asked about and when), and any commands they gave us in the
+        # meantime; plus the services account of anyone the server
+        # has told us about directly (see irc_ACCOUNT)
+        self.clock = reactor
+        self.capabilities = set()
+        self.accounts = {}
+        self._verified = {}
+        self._acc_pending = {}
+        self._held_commands = {}
+
+        # who is in each channel we're in, kept up to date as people
+        # come and go, so that we needn't ask the server
+        self.rosters = {}
+
+        # how many channel lines were passed to a state handler, and how
+        # many its message filter turned away
+        self.dispatch_stats = collections.Counter()
+
+        # how long commands and state handlers take to run
+        self.timings = stats.timings
+
+        # outgoing lines wait here so that we don't get kicked for flooding
+        self.outbox = Outbox(self._send_line)
         
     #
     # "Public" API - stuff to be called by drivers.
@@ -35,43 +141,45 @@ class PyConBot(irc.IRCClient):
     def nickname(self):
         return self.factory.nickname
 
-    def set_timer(self, channel, seconds, message='Time has ended.',
-                        callback=None, callback_kwargs={}):
-        """Set a timer. By default, simply say `message` after
-        `seconds` have elapsed.
+    def context(self, channel):
+        """Return the `ChannelContext` for the given channel."""
+        key = channel.lower()
+        if key not in self.contexts:
+            self.contexts[key] = ChannelContext(self, channel)
+        return self.contexts[key]
+
+    @property
+    def watchdog(self):
+        """The `pycon_bot.stats.StallWatchdog` keeping an eye on the
+        reactor, if there is one."""
+        return self.factory.watchdog
+
+    @property
+    def log_target(self):
+        """The `pycon_bot.log.ILogTarget` that channel transcripts go to,
+        or None if they aren't kept."""
+        return self.factory.log_target
+
+    @property
+    def journal(self):
+        """The `pycon_bot.journal.Journal` decisions are written through,
+        or None to send them straight to the PyCon website."""
+        return self.factory.journal
 
-        Additionally, if a callback is provided, run it.
-        """
-        seconds = int(seconds)
-        
-        def say_time(channel):
-            self.timer = None
-            if message:
-                self.msg(channel, "=== %s ===" % message)
-            if callback and callable(callback):
-                callback(**callback_kwargs)
-        
-        self.clear_timer()
-        self.timer = reactor.callLater(seconds, say_time, channel)
-        
-    def clear_timer(self):
-        """Clear an already-set timer, and return it."""
-        
-        # get the timer so I can get data out of it, in case
-        # I need to re-instutite the timer       
-        if self.timer:
-            self.timer.cancel()
-            self.timer = None        
-                    
     def names(self, channel):
         """List names in the channel.
 
-        Returns a deferred. Because THIS IS TWISTED!
+        Returns a deferred. Because THIS IS TWISTED! It has usually fired
+        already, since we keep track of who's in the channels we're in;
+        we only have to ask the server if we haven't heard yet.
         """
         channel = channel.lower()
+        if channel in self.rosters:
+            return defer.succeed(sorted(self.rosters[channel]))
         d = defer.Deferred()
+        if channel not in self._namescallback:
+            self.sendLine("NAMES %s" % channel)
         self._namescallback.setdefault(channel, [[], []])[0].append(d)
-        self.sendLine("NAMES %s" % channel)
         return d
 
 
@@ -81,18 +189,71 @@ class PyConBot(irc.IRCClient):
 
     # Auth.
 
-    def check_auth(self):
+    def check_auth(self, usernames=None):
         """
-        Check that everyone in set as a superuser in the env is actually
-        logged in (and not spoofing) by asking NickServ. This resets the
-        superuser list each time it's called.
+        Check that everyone in set as a superuser in the env (or just the
+        given users) is actually logged in (and not spoofing) by asking
+        NickServ. Users verified within the last IRC_AUTH_TTL seconds,
+        users we're already waiting to hear about, and users whose account
+        the server has told us about directly aren't asked about again.
+        If NickServ hasn't answered within IRC_ACC_TIMEOUT seconds, we ask
+        again, and forget any commands held while we waited.
 
         NickServ will respond by sending a NOTICE (*not* a PRIVMSG), which
         gets picked up by the callback below, see that.
         """
-        for username in self.potential_superusers:
+        if usernames is None:
+            usernames = self.potential_superusers
+        now = self.clock.seconds()
+        for username in usernames:
+            if (not username or username not in self.potential_superusers or
+                    username in self.accounts or self.is_superuser(username)):
+                continue
+            pending = self._acc_pending.get(username.lower())
+            if pending is not None:
+                if now - pending[1] < settings.IRC_ACC_TIMEOUT:
+                    continue
+                self._held_commands.pop(username, None)
+            self._acc_pending[username.lower()] = (username, now)
             self.msg('NickServ', 'ACC %s' % username)
 
+    def is_superuser(self, username):
+        """Return True if the user is a superuser, and we've verified that
+        recently enough to trust it."""
+        if username not in self.superusers:
+            return False
+        age = self.clock.seconds() - self._verified.get(username, 0)
+        return age < settings.IRC_AUTH_TTL
+
+    def _verify(self, username, forever=False):
+        """Mark a user as a verified superuser, and run any commands they
+        gave while we were checking."""
+        self.superusers.add(username)
+        self._verified[username] = (float('inf') if forever
+                                    else self.clock.seconds())
+        for channel, command, args in self._held_commands.pop(username, []):
+            self._run_command(self.context(channel), command, 'chair',
+                              username, channel, args)
+
+    def _unverify(self, username):
+        """Forget everything we know about whether a user is a superuser."""
+        self.superusers.discard(username)
+        self._verified.pop(username, None)
+        self._held_commands.pop(username, None)
+
+    def _account_changed(self, nick, account):
+        """The server told us which services account `nick` is logged in to
+        (`*` for none); that's as good as asking NickServ, and we'll hear
+        if it changes, so it never expires."""
+        if account == '*':
+            self.accounts.pop(nick, None)
+        else:
+            self.accounts[nick] = account
+        if account in self.potential_superusers:
+            self._verify(nick, forever=True)
+        else:
+            self._unverify(nick)
+
     def noticed(self, user, channel, message):
         # Only pay attention to ACC responses from NickServ
         user = user.split('!')[0]
@@ -108,37 +269,111 @@ class PyConBot(irc.IRCClient):
         # Now add or remove superusers depending on the response. A code of "3"
         # means the user's identiied with services, so if they're in the
         # allowed SUs and NickServ gives us a "3", then that user is auth'd.
+        # NickServ may not answer with the nick just as we asked about it.
+        pending = self._acc_pending.pop(username.lower(), None)
+        if pending is not None:
+            username = pending[0]
         if username in self.potential_superusers and status == '3':
-            self.superusers.add(username)
-        elif username in self.superusers and status != '3':
-            self.superusers.discard(username)
+            self._verify(username)
+        else:
+            self._unverify(username)
+
+    # IRCv3 capabilities. Where the network supports them, account-notify
+    # and extended-join tell us who is logged in to which account as it
+    # happens, and we needn't ask NickServ at all.
+
+    def irc_CAP(self, prefix, params):
+        if len(params) >= 3 and params[1] == 'ACK':
+            self.capabilities.update(params[2].split())
+
+    def irc_ACCOUNT(self, prefix, params):
+        self._account_changed(prefix.split('!')[0], params[0])
+
+    def irc_JOIN(self, prefix, params):
+        # With extended-join, the account and real name follow the channel.
+        if 'extended-join' in self.capabilities and len(params) >= 3:
+            nick = prefix.split('!')[0]
+            if nick != self.nickname:
+                self._account_changed(nick, params[1])
+            params = params[:1]
+        irc.IRCClient.irc_JOIN(self, prefix, params)
 
     # Support functions for the NAMES command.
 
     def irc_RPL_NAMREPLY(self, prefix, params):
+        # The server sends the names in a channel when we join it, as well
+        # as when we ask; either way, they seed the channel's roster.
         channel = params[2].lower()
-        if channel not in self._namescallback:
-            return
-        nicklist = [name.strip('@+') for name in params[3].split(' ')]
-        self._namescallback[channel][1] += nicklist
+        nicklist = [name.strip('@+') for name in params[3].split(' ') if name]
+        self._namescallback.setdefault(channel, [[], []])[1] += nicklist
 
     def irc_RPL_ENDOFNAMES(self, prefix, params):
         channel = params[1].lower()
         if channel not in self._namescallback:
             return
-        callbacks, namelist = self._namescallback[channel]
+        callbacks, namelist = self._namescallback.pop(channel)
+        self.rosters[channel] = set(namelist)
         for cb in callbacks:
-            cb.callback(namelist)
-        del self._namescallback[channel]
+            cb.callback(sorted(self.rosters[channel]))
+
+    # Keeping the rosters up to date.
+
+    def userLeft(self, user, channel):
+        self.rosters.get(channel.lower(), set()).discard(user)
+
+    def userQuit(self, user, quitMessage):
+        for roster in self.rosters.values():
+            roster.discard(user)
+        self.accounts.pop(user, None)
+        self._unverify(user)
+
+    def userKicked(self, kickee, channel, kicker, message):
+        self.userLeft(kickee, channel)
+
+    def userRenamed(self, oldname, newname):
+        for roster in self.rosters.values():
+            if oldname in roster:
+                roster.discard(oldname)
+                roster.add(newname)
+
+        # Whoever has the new nick needs checking afresh; but if we know
+        # their account, it came with them.
+        self._unverify(oldname)
+        if oldname in self.accounts:
+            self._account_changed(newname, self.accounts.pop(oldname))
+        else:
+            self.check_auth([newname])
+
+    def left(self, channel):
+        self.rosters.pop(channel.lower(), None)
+
+    def kickedFrom(self, channel, kicker, message):
+        self.left(channel)
+
+    def nickChanged(self, nick):
+        self.userRenamed(self.nickname, nick)
+
+        # IRCClient is an old-style class, so once we've signed on (and
+        # irc_RPL_WELCOME has set it) our nickname lives on the instance,
+        # hiding the property; keep both it and the factory's up to date.
+        self.nickname = self.factory.nickname = nick
 
     # Twisted callbacks and such.
 
     def signedOn(self):
+        self.factory.resetDelay()
+        if settings.IRC_ACCOUNT_NOTIFY:
+            self.sendLine('CAP REQ :account-notify extended-join')
         for channel in self.factory.channels:
             self.join(channel)
 
     def joined(self, channel):
         log.msg('Joined %s' % channel)
+        if self.context(channel).resume():
+            self.msg(channel, 'Sorry about that; I lost my connection. '
+                              'Picking up where we left off.')
+            self.check_auth()
+            return
         self.msg(channel, 'Hello, denizens of %s!' % channel)
         self.msg(channel, ' '.join((
             'To contribute to me:',
@@ -150,14 +385,18 @@ class PyConBot(irc.IRCClient):
         """When a new user joins the channel, take appropriate action,
         and also ask the node what, if anything, it wants to do."""
         
+        if channel.lower() in self.rosters:
+            self.rosters[channel.lower()].add(user)
+
         # is this a potential superuser? if so, we
-        # need to refresh the superuser list
+        # need to check up on them
         if user in self.potential_superusers:
-            self.check_auth()
+            self.check_auth([user])
         
         # now ship us off to the mode
-        if hasattr(self.mode, 'event_user_joined'):
-            self.mode.event_user_joined(user, channel)
+        mode = self.context(channel).mode
+        if hasattr(mode, 'event_user_joined'):
+            mode.event_user_joined(user, channel)
 
     def privmsg(self, user, channel, message):
         """Called whenever a message is recived.
@@ -177,52 +416,137 @@ class PyConBot(irc.IRCClient):
         if not channel.startswith('#'):
             command_parts = message.split()
             command, args = command_parts[0], command_parts[1:]
-            self.mode.exec_command(command, 'private', user, channel, *args)
+            context = self._private_context(user, args)
+            self._run_command(context, command, 'private', user, channel,
+                              args)
             return
+
+        context = self.context(channel)
         
         # Modes can define a log_message function which'll be called for each
         # message, command or not. This lets modes do logging.
-        if hasattr(self.mode, 'log_message'):
-            self.mode.log_message(user, channel, message)
+        if hasattr(context.mode, 'log_message'):
+            context.mode.log_message(user, channel, message)
 
         # Some times - voting - we want to record every command. In those cases,
         # the botmode will set state_handler and we'll call that. Othwewise,
         # we only care about ,-prefixed commands.
         if not message.startswith(','):
-            if self.state_handler:
+            if context.state_handler:
                 user_message = message.lower().strip()
                 if not user_message:
                     return
-                self.state_handler(user, channel, user_message)
+                handler = context.state_handler
+                accept = getattr(handler, 'message_filter', None)
+                if accept is not None and not accept(user_message):
+                    self.dispatch_stats['filtered'] += 1
+                    return
+                self.dispatch_stats['handled'] += 1
+                with self.timings.timed('handler %s' % handler.__name__):
+                    handler(user, channel, user_message)
             return
 
-        # only accept commands from superusers
-        if user not in self.superusers:
+        message = message[1:]
+        command_parts = message.split()
+        command, command_args = command_parts[0], command_parts[1:]
+
+        # only accept commands from superusers; if it's been a while since
+        # we checked on this one, hold on to the command until we have
+        if not self.is_superuser(user):
+            if user in self.superusers:
+                self.check_auth([user])
+                self._held_commands.setdefault(user, []).append(
+                    (channel, command, command_args),
+                )
             return
 
         # find the appropriate callback on the mode
         # (or one of its superclasses)
-        message = message[1:]
-        command_parts = message.split()
-        command, command_args = command_parts[0], command_parts[1:]
-        self.mode.exec_command(command, 'chair', user, channel, *command_args)
+        self._run_command(context, command, 'chair', user, channel,
+                          command_args)
+
+    def _run_command(self, context, command, command_type, user, channel,
+                     args):
+        """Run a command on a channel's mode, timing it."""
+        name = (',' if command_type == 'chair' else '') + command
+        with self.timings.timed('%s %s' % (command_type, name)):
+            context.mode.exec_command(command, command_type, user, channel,
+                                      *args)
+
+    def _private_context(self, user, args):
+        """Work out which channel's mode a private command is meant for.
+
+        One of our channels may be named as the first argument (which is
+        then removed from `args`); otherwise, it's the first of our
+        channels that the user is in. Anything else starting with '#' (say,
+        a talk number) is left for the command.
+        """
+        if args and args[0].startswith('#'):
+            channels = set(channel.lower() for channel in self.factory.channels)
+            if args[0].lower() in channels or args[0].lower() in self.contexts:
+                return self.context(args.pop(0))
+        for channel in self.factory.channels:
+            if user in self.rosters.get(channel.lower(), ()):
+                return self.context(channel)
+        return self.context(self.factory.channels[0])
 
     def msg(self, channel, message):
         # Make sure things I say go into the transcript, too.
-        if channel.startswith('#') and hasattr(self.mode, 'log_message'):
-            self.mode.log_message(self.nickname, channel, message)
+        if channel.startswith('#'):
+            mode = self.context(channel).mode
+            if hasattr(mode, 'log_message'):
+                mode.log_message(self.nickname, channel, message)
+        self.outbox.put(channel, message)
+
+    def _send_line(self, channel, message):
         irc.IRCClient.msg(self, channel, message)  # scumbag old-style class
 
-class PyConBotFactory(protocol.ClientFactory):
+    def connectionLost(self, reason):
+        for context in self.contexts.values():
+            context.suspend()
+        self.outbox.clear()
+        self.rosters.clear()
+        self._acc_pending.clear()
+        irc.IRCClient.connectionLost(self, reason)
+
+class PyConBotFactory(protocol.ReconnectingClientFactory):
+    """Connects the bot, and reconnects it (backing off exponentially) if
+    the connection is lost or can't be made.
+
+    Each channel's context, and with it any meeting in progress, belongs
+    to the factory, and is handed on to each new connection; so are the
+    superusers, though they are asked to verify themselves again.
+    """
     protocol = PyConBot
+    initialDelay = delay = settings.IRC_RECONNECT_INITIAL_DELAY
+    maxDelay = settings.IRC_RECONNECT_MAX_DELAY
 
-    def __init__(self, channels, nickname):
+    def __init__(self, channels, nickname, journal=None, watchdog=None,
+                 log_target=None):
         self.channels = channels
         self.nickname = nickname
+        self.journal = journal
+        self.watchdog = watchdog
+        self.log_target = log_target
+        self.contexts = {}
+        self.superusers = set()
+
+    def buildProtocol(self, addr):
+        bot = protocol.ReconnectingClientFactory.buildProtocol(self, addr)
+        bot.contexts = self.contexts
+        bot.superusers = self.superusers
+        for context in self.contexts.values():
+            context.client = bot
+        return bot
 
     def clientConnectionLost(self, connector, reason):
         log.msg("Lost connection: %s" % reason)
-        connector.connect()
+        protocol.ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason,
+        )
 
     def clientConnectionFailed(self, connector, reason):
         log.msg("Connection failed: %s" % reason)
+        protocol.ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason,
+        )
@@ -0,0 +1,198 @@
+"""
+A write-ahead journal for decisions bound for the PyCon website.
+
+Decisions are appended to a local file, and synced to disk in batches,
+before anything is sent over the network; so the chair never waits on
+the site, and nothing is lost if the site is down (or the bot falls over).
+In the background, the journal sends its writes to the site one at a
+time, in the order they were made, and records each one as done once the
+site has taken it.
+
+Every journaled write sets fields outright, so sending one twice (say,
+because the bot died between sending it and recording that it was sent)
+does no harm.
+"""
+from pycon_bot import settings
+from pycon_bot.utils.api import AsyncAPI
+from pycon_bot.utils.exceptions import APIError, AuthenticationError
+from twisted.internet import defer
+from twisted.python import log
+import json
+import os
+
+
+class Journal(object):
+    """An append-only, file-backed log of writes to the PyCon website.
+
+    The file holds one JSON record per line: either a write,
+    ``{"seq": 3, "endpoint": ..., "body": ...}``, or an acknowledgement
+    that the site has taken one, ``{"ack": 3}``.
+    """
+
+    def __init__(self, path, api=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.path = path
+        self.clock = clock
+
+        # The journal keeps its writes until the site takes them, so it
+        # would rather hear that the site is down than have the API
+        # client queue them up a second time.
+        self.api = api or AsyncAPI(queue_writes=False)
+
+        # Writes not yet taken by the site, oldest first.
+        self.pending = []
+        self.seq = 0
+
+        self._sync_call = None
+        self._retry_call = None
+        self._waiting = []
+        self._draining = False
+
+        self._load()
+        self._file = open(self.path, 'a')
+
+    def __repr__(self):
+        return '<Journal: %s, %d pending>' % (self.path, len(self.pending))
+
+    def post(self, endpoint, body):
+        """Journal a write to the given API endpoint. Return a Deferred that
+        fires with the write's sequence number once it is safely on disk;
+        it is sent to the site after that, in the background.
+        """
+        self.seq += 1
+        record = {'seq': self.seq, 'endpoint': endpoint, 'body': body}
+        self.pending.append(record)
+        self._append(record)
+
+        d = defer.Deferred()
+        d.addCallback(lambda _: record['seq'])
+        self._waiting.append(d)
+        return d
+
+    def sync(self):
+        """Write everything journaled so far to disk, then start sending
+        anything outstanding to the site.
+        """
+        if self._sync_call is not None and self._sync_call.active():
+            self._sync_call.cancel()
+        self._sync_call = None
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+        self.drain()
+
+    def drain(self):
+        """Send the oldest outstanding write to the site, and keep going
+        until there are none left or the site stops taking them.
+        """
+        if self._draining or not self.pending:
+            return
+        if self._retry_call is not None and self._retry_call.active():
+            self._retry_call.cancel()
+        self._retry_call = None
+
+        self._draining = True
+        record = self.pending[0]
+        d = self.api.post(record['endpoint'], record['body'],
+                          idempotent=True)
+        d.addCallbacks(self._sent, self._not_sent,
+                       callbackArgs=(record,), errbackArgs=(record,))
+
+    def close(self):
+        """Sync the journal and stop sending writes to the site. Anything
+        still outstanding is sent when the journal is next opened.
+        """
+        for call in (self._sync_call, self._retry_call):
+            if call is not None and call.active():
+                call.cancel()
+        self._sync_call = self._retry_call = None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _sent(self, result, record):
+        """The site took a write; record that, and move on to the next."""
+        self._draining = False
+        self.pending.remove(record)
+        if self.pending:
+            self._append({'ack': record['seq']})
+        else:
+            # Nothing is outstanding, so the journal has nothing worth
+            # keeping; start the file over rather than let it grow.
+            self._compact()
+        self.drain()
+
+    def _not_sent(self, failure, record):
+        """The site did not take a write. If it refused it outright, give
+        up on it; otherwise (the site is down or broken, or wouldn't take
+        our credentials, which may be down to its clock or ours) try again
+        in a little while.
+        """
+        self._draining = False
+        if failure.check(APIError) and not failure.check(AuthenticationError):
+            log.err(failure, 'The PyCon website refused journaled write '
+                             '#%d to %s' % (record['seq'], record['endpoint']))
+            return self._sent(None, record)
+
+        log.msg('Could not send journaled write #%d (%s); %d pending.' % (
+            record['seq'], failure.getErrorMessage(), len(self.pending),
+        ))
+        self._retry_call = self.clock.callLater(
+            settings.JOURNAL_RETRY_SECONDS, self.drain,
+        )
+
+    def _append(self, record):
+        """Append a record to the journal file, and make sure it gets
+        synced to disk soon.
+        """
+        self._file.write(json.dumps(record) + '\n')
+        if self._sync_call is None:
+            self._sync_call = self.clock.callLater(
+                settings.JOURNAL_SYNC_SECONDS, self.sync,
+            )
+
+    def _load(self):
+        """Read back any writes still outstanding from a previous run."""
+        if not os.path.exists(self.path):
+            return
+
+        outstanding = {}
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short when we last went down; the write it
+                    # held was never acknowledged to anyone.
+                    continue
+                if 'ack' in record:
+                    outstanding.pop(record['ack'], None)
+                else:
+                    outstanding[record['seq']] = record
+                self.seq = max(self.seq, record.get('seq', record.get('ack')))
+
+        self.pending = [outstanding[seq] for seq in sorted(outstanding)]
+        self._rewrite()
+
+    def _compact(self):
+        """Replace the journal file with one holding only outstanding
+        writes.
+        """
+        self.sync()
+        self._file.close()
+        self._rewrite()
+        self._file = open(self.path, 'a')
+
+    def _rewrite(self):
+        """Atomically rewrite the journal file with the pending writes."""
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as journal:
+            for record in self.pending:
+                journal.write(json.dumps(record) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(temp, self.path)
@@ -1,8 +1,13 @@
 from datetime import datetime
 from json import JSONEncoder
+from json.encoder import encode_basestring_ascii as encode_string
+import os
+import zlib
 
 import treq
+from pycon_bot import settings
 from twisted.internet import defer, task, reactor
+from twisted.python import failure, log
 from zope import interface
 
 
@@ -28,54 +33,462 @@ class ILogTarget(interface.Interface):
 
         """
 
-@interface.implementer(ILogTarget)
+
+class IGroupLogTarget(ILogTarget):
+    """
+    A target for IRC logs that can take a line related to several
+    proposals at once (say, all the talks in a thunderdome group) and
+    keep it once, rather than once for each proposal.
+    """
+    def log_group(proposals, nickname, message):
+        """Logs a channel message related to each of a list of proposals.
+        """
+
+
+def log_for(target, proposals, nickname, message):
+    """Logs a channel message related to each of the given proposals: once,
+    if the target can take them all together, and otherwise once for each.
+    """
+    if IGroupLogTarget.providedBy(target):
+        target.log_group(list(proposals), nickname, message)
+    else:
+        for proposal in proposals:
+            target.log(proposal, nickname, message)
+
+# How each logged line is encoded. Only the strings need escaping, so the
+# rest of the JSON object is filled in directly rather than going through
+# the (much slower, per object) general-purpose encoder.
+LINE_TEMPLATE = ('{"proposal": %s, "user": %s, "line": %s, '
+                 '"timestamp": "%s"}')
+
+
+# Stands in for an argument that should be taken from the settings, where
+# None means something else.
+_SETTING = object()
+
+# How many lines at a time are fed to the compressor.
+COMPRESS_CHUNK_LINES = 64
+
+
+class LogStats(object):
+    """Counters for the lines that have passed through a log target."""
+
+    def __init__(self):
+        self.logged = 0
+        self.flushed = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return '<LogStats: %d logged, %d flushed, %d retried, %d dropped>' % (
+            self.logged, self.flushed, self.retried, self.dropped,
+        )
+
+
+@interface.implementer(IGroupLogTarget)
 class PyConSiteLogTarget(object):
     """A log target that logs to the PyCon site.
+
+    Messages are sent in batches, bounded in both lines and bytes, so that
+    a busy channel never makes for an enormous request; and only one batch
+    is sent at a time. A batch goes as soon as there's a full one, or once
+    its oldest message has waited long enough.
+
+    A batch the site doesn't take is put back at the front of the buffer
+    (to go out with newer messages, up to the batch limits) and tried
+    again later, backing off while the site is down. Meanwhile, at most
+    `max_buffered` messages are held in memory; the rest are spilled to
+    a file, if there is one, and read back as there is room. The file is
+    LOG_SPILL_PATH unless another is given; give None for no file at all.
+
+    If the site takes lines about several proposals at once (with a list
+    of them as the ``proposal``), `grouped` should be set; otherwise lines
+    for a group of proposals are sent once for each.
     """
     _utcnow = staticmethod(datetime.utcnow)
     _post = staticmethod(treq.post)
 
-    def __init__(self, host, auth_key):
+    def __init__(self, host, auth_key, max_lines=None, max_bytes=None,
+                 max_age=None, max_buffered=None, spill_path=_SETTING,
+                 compress=None, grouped=None, _clock=reactor):
         """Initializes the PyCon site log target.
         """
         path = "/pycon_api/set_irc_logs/{key}/".format(key=auth_key)
         self._url = "https://" + host + path
+        self._clock = _clock
+
+        self.max_lines = max_lines or settings.LOG_BATCH_LINES
+        self.max_bytes = max_bytes or settings.LOG_BATCH_BYTES
+        self.max_age = max_age or settings.LOG_BATCH_SECONDS
+        self.max_buffered = max_buffered or settings.LOG_BUFFER_LINES
+        if spill_path is _SETTING:
+            spill_path = settings.LOG_SPILL_PATH
+        self.spill_path = spill_path or None
+        if compress is None:
+            compress = settings.LOG_COMPRESS
+        self.compress = compress
+        if grouped is None:
+            grouped = settings.LOG_GROUPED_UPLOADS
+        self.grouped = grouped
+
+        # Messages waiting to be sent, each already encoded as JSON; how
+        # many more are waiting in the spill file, and where in it the
+        # first of them is.
         self._buffer = []
-        self._encoder = JSONDateTimeEncoder()
+        self._buffered_bytes = 0
+        self._spilled = 0
+        self._spill_offset = 0
+        self.stats = LogStats()
+
+        # The batch being sent, if any; the Deferreds of anyone waiting
+        # for the buffer to be flushed; the call that sends a batch that
+        # has waited long enough; and, after a failure, the call that
+        # tries again.
+        self._sending = None
+        self._batch = None
+        self._waiting = []
+        self._age_call = None
+        self._retry_call = None
+        self._failures = 0
+        self._closed = False
+
+        # Pick up whatever was left in the spill file last time.
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            self._open_spill()
 
     def log(self, proposal, nickname, message):
         """Buffers a message for logging.
+
+        This is called for every line said in the channel, so it checks
+        on the batch in hand inline rather than through `_idle` and
+        `_batch_ready`.
+        """
+        line = encode_line(proposal, nickname, message, self._utcnow())
+        self.stats.logged += 1
+
+        # If the buffer is full, put the line aside until there's room (or,
+        # once we've closed, until next time).
+        buffer = self._buffer
+        if (self._closed or self._spilled or
+                len(buffer) >= self.max_buffered):
+            self._spill(line)
+            return
+
+        buffer.append(line)
+        self._buffered_bytes += len(line) + 1
+        if self._sending is None and self._retry_call is None:
+            if (len(buffer) >= self.max_lines or
+                    self._buffered_bytes >= self.max_bytes):
+                self._send()
+            elif self._age_call is None:
+                self._age_call = self._clock.callLater(self.max_age,
+                                                       self._aged)
+
+    def log_group(self, proposals, nickname, message):
+        """Buffers a message about several proposals for logging.
         """
-        self._buffer.append({
-            u"proposal": proposal,
-            u"user": nickname,
-            u"line": message,
-            u"timestamp": self._utcnow()
-        })
+        if self.grouped:
+            self.log(proposals, nickname, message)
+            return
+        for proposal in proposals:
+            self.log(proposal, nickname, message)
 
     def flush(self):
-        """Sends all buffered logs.
+        """Sends all buffered logs, a batch at a time.
+
+        If the site isn't taking them, the returned Deferred waits until
+        it does.
         """
-        if not self._buffer:
+        if not self._buffer and self._sending is None:
             return defer.succeed(None)
 
-        to_send, self._buffer = self._buffer, []
-        return self._post(self._url, self._encoder.encode(to_send))
+        d = defer.Deferred()
+        self._waiting.append(d)
+        if self._idle():
+            self._send()
+        return d
+
+    def close(self):
+        """Stops sending, and puts everything not yet sent (a batch on its
+        way included) at the front of the spill file, to go next time; or
+        drops it, if there is no spill file.
+
+        Unlike ``flush``, this doesn't wait for the site, so that it can't
+        hold up shutting down while the site is down.
+        """
+        self._closed = True
+        for call in (self._age_call, self._retry_call):
+            if call is not None and call.active():
+                call.cancel()
+        self._age_call = self._retry_call = None
+
+        pending = (self._batch or []) + self._buffer
+        self._batch = self._sending = None
+        self._buffer = []
+        self._buffered_bytes = 0
+        if pending and self.spill_path is None:
+            log.msg("Dropping %d transcript lines not yet sent to the PyCon "
+                    "site" % len(pending))
+            self.stats.dropped += len(pending)
+        elif pending:
+            rest = ""
+            if self._spilled:
+                with open(self.spill_path) as spill:
+                    spill.seek(self._spill_offset)
+                    rest = spill.read()
+            self._rewrite_spill("".join(line + "\n" for line in pending) +
+                                rest)
+            self._spilled += len(pending)
+
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+        return defer.succeed(None)
+
+    def _idle(self):
+        """Return True if no batch is being sent or waiting to be retried.
+        """
+        return self._sending is None and self._retry_call is None
+
+    def _batch_ready(self):
+        """Return True if there's a full batch to send."""
+        return (len(self._buffer) >= self.max_lines or
+                self._buffered_bytes >= self.max_bytes)
+
+    def _aged(self):
+        self._age_call = None
+        if self._idle() and self._buffer:
+            self._send()
+
+    def _retry(self):
+        self._retry_call = None
+        if self._sending is None and self._buffer:
+            self._send()
+
+    def _send(self):
+        """Send a batch from the front of the buffer."""
+        if self._age_call is not None and self._age_call.active():
+            self._age_call.cancel()
+        self._age_call = None
+
+        # Take as many lines as fit, but always at least one.
+        size, count = 2, 0
+        for line in self._buffer[:self.max_lines]:
+            if count and size + len(line) + 1 > self.max_bytes:
+                break
+            size += len(line) + 1
+            count += 1
+        batch, self._buffer = self._buffer[:count], self._buffer[count:]
+        self._buffered_bytes -= size - 2
+        self._unspill()
+
+        self._batch = batch
+        self._sending = self._post(self._url, self._body(batch),
+                                   headers=self._headers())
+        self._sending.addBoth(self._sent)
+
+    def _body(self, batch):
+        """Return the request body for a batch of encoded lines: a JSON
+        list of them, written a chunk of lines at a time into a gzip
+        stream if we're compressing.
+        """
+        if not self.compress:
+            return "[" + ",".join(batch) + "]"
+
+        gzip = zlib.compressobj(settings.LOG_COMPRESS_LEVEL, zlib.DEFLATED,
+                                16 + zlib.MAX_WBITS)
+        chunks = [gzip.compress("[")]
+        for start in range(0, len(batch), COMPRESS_CHUNK_LINES):
+            if start:
+                chunks.append(gzip.compress(","))
+            chunk = batch[start:start + COMPRESS_CHUNK_LINES]
+            chunks.append(gzip.compress(",".join(chunk)))
+        chunks.append(gzip.compress("]"))
+        chunks.append(gzip.flush())
+        return "".join(chunks)
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        return headers
+
+    def _sent(self, result):
+        """A batch is done with. If it failed, put it back to be tried
+        again in a while. Otherwise send the next, if there's a full one
+        or someone is waiting for a flush, or else tell whoever's waiting.
+        """
+        if self._closed:
+            # Whatever it was, it's in the spill file now.
+            return
+        batch, self._batch = self._batch, None
+        self._sending = None
+        code = getattr(result, "code", None) or 200
+        if isinstance(result, failure.Failure) or code >= 500:
+            return self._failed(result, batch)
+
+        self._failures = 0
+        if code >= 400:
+            # The site is up, it just won't take these; sending them
+            # again won't change its mind.
+            log.msg("The PyCon site refused %d transcript lines (%d)" % (
+                len(batch), code,
+            ))
+            self.stats.dropped += len(batch)
+        else:
+            self.stats.flushed += len(batch)
+
+        if self._buffer and (self._waiting or self._batch_ready()):
+            self._send()
+            return
+
+        if self._buffer and self._age_call is None:
+            self._age_call = self._clock.callLater(self.max_age, self._aged)
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+
+    def _failed(self, result, batch):
+        """Put a batch that couldn't be sent back at the front of the
+        buffer, and try again after a delay that doubles with every
+        failure in a row.
+        """
+        self._buffer[:0] = batch
+        self._buffered_bytes += sum(len(line) + 1 for line in batch)
+        self.stats.retried += len(batch)
+
+        delay = min(settings.LOG_RETRY_MAX_DELAY,
+                    settings.LOG_RETRY_DELAY * 2 ** self._failures)
+        self._failures += 1
+        if isinstance(result, failure.Failure):
+            reason = result.getErrorMessage()
+        else:
+            reason = "HTTP %d" % result.code
+        log.msg("Could not send %d transcript lines to the PyCon site (%s); "
+                "trying again in %ds" % (len(batch), reason, delay))
+        self._retry_call = self._clock.callLater(delay, self._retry)
+
+    def _spill(self, line):
+        """Put a line aside, in the spill file, until there's room in the
+        buffer; or drop it, if there is no spill file or it's full.
+        """
+        if self.spill_path is None or self._spilled >= settings.LOG_SPILL_LINES:
+            self.stats.dropped += 1
+            return
+        with open(self.spill_path, "a") as spill:
+            spill.write(line + "\n")
+        self._spilled += 1
+
+    def _unspill(self):
+        """Move lines back from the spill file into the buffer, as far as
+        there's room for them.
+
+        Only the lines moved are read. The file is emptied once they all
+        have been, and the lines already read are trimmed off the front
+        once they make up most of it. Until then, a crash would mean
+        sending them twice rather than not at all.
+        """
+        count = min(self.max_buffered - len(self._buffer), self._spilled)
+        if count <= 0:
+            return
+        rest = None
+        with open(self.spill_path) as spill:
+            spill.seek(self._spill_offset)
+            for _ in range(count):
+                line = spill.readline()[:-1]
+                self._buffer.append(line)
+                self._buffered_bytes += len(line) + 1
+            self._spill_offset = spill.tell()
+            self._spilled -= count
+            size = os.fstat(spill.fileno()).st_size
+            if self._spilled and self._spill_offset * 2 >= size:
+                rest = spill.read()
+        if not self._spilled:
+            open(self.spill_path, "w").close()
+            self._spill_offset = 0
+        elif rest is not None:
+            self._rewrite_spill(rest)
+
+    def _rewrite_spill(self, data):
+        """Replace the spill file's contents with `data`."""
+        temp = self.spill_path + ".tmp"
+        with open(temp, "w") as spill:
+            spill.write(data)
+        os.rename(temp, self.spill_path)
+        self._spill_offset = 0
+
+    def _open_spill(self):
+        """Count the lines left in the spill file by the last run (dropping
+        any cut short), and start sending them.
+        """
+        length = 0
+        with open(self.spill_path, "r+") as spill:
+            for line in iter(spill.readline, ""):
+                if not line.endswith("\n"):
+                    break
+                length += len(line)
+                self._spilled += 1
+            spill.truncate(length)
+        self._unspill()
+        if self._buffer:
+            self._age_call = self._clock.callLater(self.max_age, self._aged)
 
 
 DATETIME_FORMAT = u"%Y-%m-%d %H:%M:%S.%f"
 
 
+def format_datetime(value):
+    """Formats a (naive) datetime as ``DATETIME_FORMAT`` does.
+
+    ``strftime`` is slow, and would otherwise be called for every line
+    logged; ``str`` gives the same thing, done in C, except that it leaves
+    off the microseconds when there are none.
+    """
+    formatted = str(value)
+    if len(formatted) == 19:
+        formatted += ".000000"
+    return formatted
+
+
+def encode_line(proposal, nickname, message, timestamp):
+    """Encodes a logged line as a JSON object.
+    """
+    if type(proposal) is int:
+        proposal = str(proposal)
+    else:
+        proposal = _encoder.encode(proposal)
+    try:
+        nickname, message = encode_string(nickname), encode_string(message)
+    except UnicodeDecodeError:
+        nickname, message = _encode_text(nickname), _encode_text(message)
+    return LINE_TEMPLATE % (proposal, nickname, message,
+                            format_datetime(timestamp))
+
+
+def _encode_text(value):
+    """Encodes a string as JSON. What people say on IRC is just bytes, and
+    needn't be UTF-8; anything that isn't is decoded as best we can.
+    """
+    try:
+        return encode_string(value)
+    except UnicodeDecodeError:
+        return encode_string(value.decode('utf-8', 'replace'))
+
+
 class JSONDateTimeEncoder(JSONEncoder):
     """JSON encoder that also encodes datetime objects.
     """
     def default(self, obj):
         if isinstance(obj, datetime):
-            return obj.strftime(DATETIME_FORMAT)
+            return format_datetime(obj)
         else:
-            return JSONEncoder.encode(self, obj)
+            return JSONEncoder.default(self, obj)
+
+
+_encoder = JSONDateTimeEncoder()
 
 
+@interface.implementer(IGroupLogTarget)
 class AutoFlushingLogTarget(object):
     """A log target that takes a log target and flushes it periodically.
     """
@@ -92,6 +505,12 @@ class AutoFlushingLogTarget(object):
         """
         self.log_target.log(proposal, nickname, message)
 
+    def log_group(self, proposals, nickname, message):
+        """
+        Logs using the underlying target, grouped if it can be.
+        """
+        log_for(self.log_target, proposals, nickname, message)
+
     def flush(self):
         """
         Flushes the underlying log target.
@@ -99,3 +518,36 @@ class AutoFlushingLogTarget(object):
         This is called automatically every several seconds.
         """
         return self.log_target.flush()
+
+
+@interface.implementer(IGroupLogTarget)
+class FanOutLogTarget(object):
+    """A log target that logs to several log targets at once.
+
+    Lines about a group of proposals are passed on as a group to the
+    targets that can take them that way, and once for each proposal to
+    the rest. If any of the targets can read transcripts back, so can
+    this.
+    """
+    def __init__(self, *log_targets):
+        self.log_targets = log_targets
+        for log_target in log_targets:
+            if hasattr(log_target, "transcript"):
+                self.transcript = log_target.transcript
+                self.has_transcript = log_target.has_transcript
+                break
+
+    def log(self, proposal, nickname, message):
+        for log_target in self.log_targets:
+            log_target.log(proposal, nickname, message)
+
+    def log_group(self, proposals, nickname, message):
+        for log_target in self.log_targets:
+            log_for(log_target, proposals, nickname, message)
+
+    def flush(self):
+        """Flushes every target; fires once they all have.
+        """
+        return defer.gatherResults([log_target.flush()
+                                    for log_target in self.log_targets],
+                                   consumeErrors=True)
@@ -1,60 +1,191 @@
 from __future__ import division
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
 from pycon_bot import settings
-from pycon_bot.utils.api import API
-from pycon_bot.utils.exceptions import NotFound
+from pycon_bot.utils.api import API, AsyncAPI
+from pycon_bot.utils.exceptions import (APIError, InternalServerError,
+                                        MethodNotAllowed, NotFound)
+from twisted.internet import defer
+import time
+
+# The statuses a proposal can be given on the PyCon site.
+STATUSES = ('accepted', 'standby', 'rejected', 'undecided')
+
+
+def _repeated(page, previous):
+    """Return True if a page of proposals is the same as the one before it:
+    the site ignored our paging, and there was exactly a page of results.
+    """
+    return (previous is not None and len(page) > 0 and
+            page[0].id == previous[0].id)
+
+
+def _chain(result, callback, *args):
+    """Apply `callback` to the result of an API call.
+
+    A blocking `API` hands back the result itself, in which case the callback
+    is applied immediately; an `AsyncAPI` hands back a Deferred, in which
+    case the callback is added to it and the Deferred is returned.
+    """
+    if isinstance(result, defer.Deferred):
+        return result.addCallback(callback, *args)
+    return callback(result, *args)
 
 
 class ProposalManager(object):
     """Class that understands how to retrieve and filter proposals,
     acquired from the PyCon website.
+
+    If the manager is given an `AsyncAPI`, every method returns a Deferred
+    rather than the result itself.
+
+    Proposals are cached for `ttl` seconds, both by ID and by the filter
+    that fetched them. Each proposal is held as a single object, so changes
+    written through `Proposal.write` show up everywhere, and cached filter
+    results are kept in step with them.
     """
-    def __init__(self):
-        self.api = API()
+    _time = staticmethod(time.time)
+
+    def __init__(self, api=None, ttl=None):
+        self.api = api or API()
+        self.ttl = settings.PROPOSAL_CACHE_TTL if ttl is None else ttl
+        self.invalidate()
+
+        # We assume the site can take status changes in bulk until it
+        # tells us otherwise.
+        self._bulk_supported = True
 
     def filter(self, **kwargs):
         """Return a list of proposals."""
         kwargs.setdefault('type', 'talk')
-        response = self.api.get('proposals', **kwargs)
-        return [Proposal(**i) for i in response['data']]
+
+        # If we fetched this exact filter recently, answer from memory.
+        key = frozenset(kwargs.items())
+        if self._fresh(self._filters.get(key)):
+            ids = self._filters[key][0]
+            return self._result([self._proposals[i][0] for i in ids])
+
+        return _chain(self.api.get('proposals', **kwargs),
+                      self._remember_filter, key)
+
+    def iter_filter(self, page_size=None, **kwargs):
+        """Yield proposals one at a time, fetching them from the site a page
+        at a time as they are needed. Stop iterating, and we stop fetching.
+
+        This needs a blocking API; with an `AsyncAPI`, use `take`.
+        """
+        if self.api.returns_deferreds:
+            raise TypeError('iter_filter needs a blocking API; use take().')
+        kwargs.setdefault('type', 'talk')
+        page_size = page_size or settings.PROPOSAL_PAGE_SIZE
+
+        offset = 0
+        previous = None
+        while True:
+            page = self._page(kwargs, offset, page_size)
+            if _repeated(page, previous):
+                return
+            for proposal in page:
+                yield proposal
+
+            # A short page is the last one. So is a long one: the site
+            # ignored our paging and sent everything.
+            if len(page) != page_size:
+                return
+            offset += page_size
+            previous = page
+
+    def take(self, count, after=None, page_size=None, **kwargs):
+        """Return a list of at most `count` proposals matching the filter,
+        optionally only those with an ID greater than `after`. Only as many
+        pages as are needed are fetched; a cached result for the same filter
+        is used without going to the site at all.
+        """
+        kwargs.setdefault('type', 'talk')
+        after = after or 0
+
+        key = frozenset(kwargs.items())
+        if self._fresh(self._filters.get(key)):
+            ids = [i for i in self._filters[key][0] if i > after][:count]
+            return self._result([self._proposals[i][0] for i in ids])
+
+        if not self.api.returns_deferreds:
+            return list(islice(
+                (p for p in self.iter_filter(page_size, **kwargs)
+                   if p.id > after),
+                count,
+            ))
+        return self._take_pages(count, after,
+                                page_size or settings.PROPOSAL_PAGE_SIZE,
+                                kwargs)
+
+    @defer.inlineCallbacks
+    def _take_pages(self, count, after, page_size, kwargs):
+        """The `AsyncAPI` version of `take`: fetch pages one after another
+        until we have enough proposals or run out of them.
+        """
+        answer = []
+        offset = 0
+        previous = None
+        while True:
+            page = yield self._page(kwargs, offset, page_size)
+            if _repeated(page, previous):
+                defer.returnValue(answer[:count])
+            answer.extend(p for p in page if p.id > after)
+            if len(answer) >= count or len(page) != page_size:
+                defer.returnValue(answer[:count])
+            offset += page_size
+            previous = page
+
+    def _page(self, kwargs, offset, page_size):
+        """Fetch a single page of proposals matching the filter."""
+        response = self.api.get('proposals', limit=page_size, offset=offset,
+                                **kwargs)
+        return _chain(response, lambda r: [self._build(i) for i in r['data']])
 
     def get(self, id):
         """Return back a single proposal given the following ID.
         We do not filter on anything other than ID here.
         """
+        if self._fresh(self._proposals.get(int(id))):
+            return self._result(self._proposals[int(id)][0])
+
+        def not_found(failure):
+            failure.trap(NotFound)
+            raise Proposal.DoesNotExist('No proposal with ID %d.' % int(id))
+
         try:
             response = self.api.get('proposals/%d' % int(id))
         except NotFound:
             raise Proposal.DoesNotExist('No proposal with ID %d.' % int(id))
-        return Proposal(**response['data'])
+        if isinstance(response, defer.Deferred):
+            response.addErrback(not_found)
+        return _chain(response, lambda r: self._build(r['data']))
 
     def next(self, type=None, status=None, after=None):
         """Return the next talk that should be reviewed.
 
-        Right now the API has some limitations, so this is super bonus janky.
-        It basically gets all the talks and then iterates until it finds
-        the right one.
+        The manager keeps every proposal it knows about in an index sorted
+        by (type, status, id), so this is a bisect rather than a scan. The
+        index is topped up from the (cached) list of proposals with the
+        given type and status, which the site filters for us.
         """
-        # First, what kind of talk are we looking at?
-        manager_method = 'all'
-        if type:
-            manager_method = type + 's'
-
-        # Get the list of talks.
-        proposals = getattr(self, manager_method)()
-
-        # Iterate over the proposals we got back until we get
-        # the one we want.
-        for proposal in proposals:
-            # If the status isn't what I expect, keep going.
-            if proposal.status != status:
-                continue
-
-            # If the proposal ID is too low, keep going.
-            if proposal.id <= after:
-                continue
-
-            # Return this talk!
-            return proposal
+        # Like `filter`, we default to talks.
+        type = type or 'talk'
+
+        kwargs = {'type': type}
+        if status is not None:
+            kwargs['status'] = status
+        return _chain(self.filter(**kwargs), self._next_after,
+                      type, status, after)
+
+    def _next_after(self, proposals, type, status, after):
+        """Return the first indexed proposal with the given type and status,
+        and an ID greater than `after`.
+        """
+        i = bisect_right(self._index, (type, status, after or 0))
+        if i < len(self._index) and self._index[i][:2] == (type, status):
+            return self._proposals[self._index[i][2]][0]
 
         # Whups, we didn't find what we wanted; complain.
         raise Proposal.DoesNotExist('No more talks!')
@@ -74,36 +205,275 @@ class ProposalManager(object):
     def posters(self):
         return self.filter(type='poster')
 
+    def bulk_set_status(self, statuses):
+        """Set the status of many proposals at once, given a dictionary
+        of {id: status}.
+
+        The changes go to the site in batches of PROPOSAL_BULK_SIZE. If the
+        site has no batch endpoint, we send one request per proposal
+        instead, all at once. Returns (or, with an `AsyncAPI`, fires with)
+        a dictionary of {id: result}, where the result is True if the site
+        took the change and the exception it raised if not.
+        """
+        statuses = dict((int(id), status) for id, status in statuses.items())
+
+        # Sanity check: Are these all valid statuses?
+        for status in statuses.values():
+            if status not in STATUSES:
+                raise ValueError('Bad status: %s.' % status)
+
+        ids = sorted(statuses)
+        size = settings.PROPOSAL_BULK_SIZE
+        batches = [ids[i:i + size] for i in range(0, len(ids), size)]
+
+        if self.api.returns_deferreds:
+            return self._bulk_set_status_deferred(batches, statuses)
+
+        results = {}
+        for batch in batches:
+            if self._bulk_supported:
+                try:
+                    self.api.post('proposals/bulk', self._bulk_body(
+                        batch, statuses,
+                    ))
+                except (APIError, InternalServerError) as ex:
+                    if not self._no_bulk_endpoint(ex):
+                        results.update((id, ex) for id in batch)
+                        continue
+                else:
+                    results.update(self._set_statuses(batch, statuses))
+                    continue
+
+            # No batch endpoint; one at a time it is.
+            for id in batch:
+                try:
+                    self.api.post('proposals/%d' % id,
+                                  {'status': statuses[id]}, idempotent=True)
+                except (APIError, InternalServerError) as ex:
+                    results[id] = ex
+                else:
+                    results.update(self._set_statuses([id], statuses))
+        return results
+
+    @defer.inlineCallbacks
+    def _bulk_set_status_deferred(self, batches, statuses):
+        """The `AsyncAPI` version of `bulk_set_status`."""
+        results = {}
+        for batch in batches:
+            if self._bulk_supported:
+                try:
+                    yield self.api.post('proposals/bulk', self._bulk_body(
+                        batch, statuses,
+                    ))
+                except (APIError, InternalServerError) as ex:
+                    if not self._no_bulk_endpoint(ex):
+                        results.update((id, ex) for id in batch)
+                        continue
+                else:
+                    results.update(self._set_statuses(batch, statuses))
+                    continue
+
+            # No batch endpoint; send every request in the batch at once,
+            # and let the connection pool pipeline them.
+            outcomes = yield defer.DeferredList([
+                self.api.post('proposals/%d' % id, {'status': statuses[id]},
+                              idempotent=True)
+                for id in batch
+            ], consumeErrors=True)
+            for id, (succeeded, value) in zip(batch, outcomes):
+                if succeeded:
+                    results.update(self._set_statuses([id], statuses))
+                else:
+                    results[id] = value.value
+        defer.returnValue(results)
+
+    def _bulk_body(self, batch, statuses):
+        return {'talks': [[id, statuses[id]] for id in batch]}
+
+    def _no_bulk_endpoint(self, ex):
+        """Return True (and remember it) if an error from the batch endpoint
+        means the site doesn't have one: a 404 or 405, whether or not it
+        came with an error message we could read."""
+        status_code = getattr(ex, 'status_code', None)
+        if (isinstance(ex, (NotFound, MethodNotAllowed)) or
+                status_code in (404, 405)):
+            self._bulk_supported = False
+        return not self._bulk_supported
+
+    def _set_statuses(self, ids, statuses):
+        """Mirror statuses the site has accepted onto any cached proposals,
+        and return a result for each."""
+        for id in ids:
+            if id in self._proposals:
+                proposal = self._proposals[id][0]
+                proposal._update({'status': statuses[id], 'decided': True})
+                self._written(proposal)
+        return dict.fromkeys(ids, True)
+
+    def invalidate(self, id=None):
+        """Forget a cached proposal, or, if no ID is given, everything
+        that has been cached.
+        """
+        if id is None:
+            self._proposals = {}
+            self._filters = {}
+            self._index = []
+            self._index_keys = {}
+            return
+
+        # Forget the proposal, and every filter result it was part of.
+        self._proposals.pop(int(id), None)
+        self._unindex(int(id))
+        for key, (ids, fetched) in self._filters.items():
+            if int(id) in ids:
+                del self._filters[key]
+
+    def _build(self, data):
+        """Return a proposal bound to this manager from API data.
+
+        If the proposal is already cached, the cached object is refreshed
+        in place and returned, so there is only ever one of it.
+        """
+        id = int(data['id'])
+        if id in self._proposals:
+            proposal = self._proposals[id][0]
+            proposal._update(dict(data, id=id))
+        else:
+            proposal = Proposal(_manager=self, **data)
+        self._proposals[id] = (proposal, self._time())
+        self._reindex(proposal)
+        return proposal
+
+    def _remember_filter(self, response, key):
+        proposals = [self._build(i) for i in response['data']]
+        ids = [p.id for p in proposals]
+
+        # Anything this filter used to return but no longer does has
+        # changed on the site in a way we can't see; drop it from the index
+        # until we hear about it again.
+        if key in self._filters:
+            for id in set(self._filters[key][0]).difference(ids):
+                self._unindex(id)
+
+        self._filters[key] = (ids, self._time())
+        return proposals
+
+    def _reindex(self, proposal):
+        """Move a proposal to the right place in the sorted index."""
+        key = (proposal.type, proposal.status, proposal.id)
+        if self._index_keys.get(proposal.id) != key:
+            self._unindex(proposal.id)
+            insort(self._index, key)
+            self._index_keys[proposal.id] = key
+
+    def _unindex(self, id):
+        """Remove a proposal from the sorted index, if it is there."""
+        key = self._index_keys.pop(id, None)
+        if key is not None:
+            del self._index[bisect_left(self._index, key)]
+
+    def _written(self, proposal):
+        """Bring the cached filter results in line with a proposal
+        that has just been written to the site.
+        """
+        self._proposals.setdefault(proposal.id, (proposal, self._time()))
+        self._reindex(proposal)
+        data = proposal.data
+        for key, (ids, fetched) in self._filters.items():
+            # If the filter is on something that isn't a proposal field,
+            # we can't tell whether this proposal still belongs.
+            criteria = dict(key)
+            if any(k not in data for k in criteria):
+                if proposal.id in ids:
+                    del self._filters[key]
+                continue
+
+            matches = all(data[k] == v for k, v in criteria.items())
+            if matches and proposal.id not in ids:
+                insort(ids, proposal.id)
+            elif not matches and proposal.id in ids:
+                ids.remove(proposal.id)
+
+    def _fresh(self, entry):
+        """Return True if a cache entry exists and has not expired."""
+        return bool(entry) and self._time() - entry[1] < self.ttl
+
+    def _result(self, value):
+        """Return a cached value the way this manager's API would."""
+        if self.api.returns_deferreds:
+            return defer.succeed(value)
+        return value
+
+
+def _hot_field(name):
+    """Return a property that reads one of a proposal's hot fields from
+    its slot, as ASCII."""
+    return property(lambda self: self._ascii_value(name))
+
 
 class Proposal(object):
     """Object to represent proposal objects, which can be acted upon
     and saved back to the PyCon website.
+
+    We hold a lot of these, so the fields we use all the time live in
+    slots; everything else the API sends stays in a single dictionary
+    that is only looked at when asked for. Either way, text comes back
+    as ASCII, converted once per field.
     """
+    HOT_FIELDS = ('id', 'title', 'status', 'type', 'speakers',
+                  'thunderdome_votes', 'decided')
+    __slots__ = ('manager', '_cold', '_ascii') + tuple(
+        '_' + name for name in HOT_FIELDS
+    )
+
     objects = ProposalManager()
+    async_objects = ProposalManager(AsyncAPI())
 
     class DoesNotExist(Exception):
         pass
 
-    def __init__(self, id, **kwargs):
+    def __init__(self, id, _manager=None, **kwargs):
         """Create a new proposal instance. This MUST have an ID
         to be valid; we do not create new proposals from nowhere
         for our purposes.
         """
+        setattr_ = super(Proposal, self).__setattr__
+        setattr_('manager', _manager or self.objects)
+        setattr_('_cold', {})
+        setattr_('_ascii', None)
+        for name in self.HOT_FIELDS:
+            setattr_('_' + name, None)
+
         kwargs['id'] = int(id)
         kwargs['thunderdome_votes'] = None
         kwargs['decided'] = False
-        self.__dict__.update({
-            'api': API(),
-            'data': kwargs,
-        })
+        self._update(kwargs)
+
+    id = _hot_field('id')
+    title = _hot_field('title')
+    status = _hot_field('status')
+    type = _hot_field('type')
+    speakers = _hot_field('speakers')
+    thunderdome_votes = _hot_field('thunderdome_votes')
+    decided = _hot_field('decided')
+
+    @property
+    def api(self):
+        return self.manager.api
+
+    @property
+    def data(self):
+        """Return all of this proposal's fields, as the API sent them."""
+        answer = dict(self._cold)
+        for name in self.HOT_FIELDS:
+            answer[name] = getattr(self, '_' + name)
+        return answer
 
     def __getattr__(self, key):
-        if key in self.data:
-            value = self.data[key]
-            if isinstance(value, unicode):
-                value = value.encode('ascii', 'ignore')
-            return value
-        raise KeyError('No key %s in proposal #%d.' % (key, self.id))
+        # Only fields that aren't hot (or aren't fields at all) get here.
+        if key.startswith('_') or key not in self._cold:
+            raise KeyError('No key %s in proposal #%d.' % (key, self.id))
+        return self._ascii_value(key)
 
     def __setattr__(self, key, value):
         raise AttributeError('Attribute setting is not allowed.')
@@ -111,6 +481,38 @@ class Proposal(object):
     def __repr__(self):
         return repr(self.data)
 
+    def _update(self, data):
+        """Merge the given fields into this proposal."""
+        for key, value in data.items():
+            if key in self.HOT_FIELDS:
+                # Statuses and types come from a handful of values;
+                # share one copy of each.
+                if key in ('status', 'type') and isinstance(value, unicode):
+                    value = intern(value.encode('ascii', 'ignore'))
+                super(Proposal, self).__setattr__('_' + key, value)
+            else:
+                self._cold[key] = value
+
+            # Anything we converted for the old value is now wrong.
+            if self._ascii:
+                self._ascii.pop(key, None)
+
+    def _ascii_value(self, key):
+        """Return the value of a field, with unicode converted to ASCII
+        the first time it is asked for."""
+        if key in self.HOT_FIELDS:
+            value = getattr(self, '_' + key)
+        else:
+            value = self._cold[key]
+        if not isinstance(value, unicode):
+            return value
+
+        if self._ascii is None:
+            super(Proposal, self).__setattr__('_ascii', {})
+        if key not in self._ascii:
+            self._ascii[key] = value.encode('ascii', 'ignore')
+        return self._ascii[key]
+
     @property
     def agenda_format(self):
         return u'#{id} - {title} - {author}\n{review_url}\n'.format(
@@ -136,23 +538,50 @@ class Proposal(object):
         answer['speaker'] = self.speakers[0]['name']
         return answer
 
+    def write(self, data, journal=None):
+        """Save the given fields to the PyCon site, and mirror them
+        locally. Returns whatever the API returns (a Deferred, for
+        proposals retrieved through `async_objects`).
+
+        If a `pycon_bot.journal.Journal` is given, the write goes through
+        it instead, and the Deferred returned fires as soon as the write
+        is safely on disk.
+        """
+        # Writes set fields outright, so sending one twice is harmless.
+        endpoint = 'proposals/%d' % self.id
+        if journal is not None:
+            result = journal.post(endpoint, data)
+        else:
+            result = self.api.post(endpoint, data, idempotent=True)
+        self._update(data)
+        self.manager._written(self)
+
+        # If the site turns out not to have taken the write, our copy is
+        # no longer to be trusted.
+        if isinstance(result, defer.Deferred):
+            def forget(failure):
+                self.manager.invalidate(self.id)
+                return failure
+            result.addErrback(forget)
+        return result
+
     def set_status(self, status):
         # Sanity check: Is this a valid status?
-        if status not in ('accepted', 'standby', 'rejected', 'undecided'):
+        if status not in STATUSES:
             raise ValueError('Bad status: %s.' % status)
 
         # Set the status on the PyCon site.
-        self.api.post('proposals/%d' % self.id, {'status': status})
+        result = self.write({'status': status})
 
         # Denote that this talk has been decided.
-        self.data['status'] = status
-        self.data['decided'] = True
+        self._update({'decided': True})
+        return result
 
     def set_thunderdome_votes(self, supporters, total_voters):
-        self.data['thunderdome_votes'] = ThunderdomeVotes(
+        self._update({'thunderdome_votes': ThunderdomeVotes(
             supporters=supporters,
             total_voters=total_voters,
-        )
+        )})
 
     def accept(self):
         return self.set_status('accepted')
@@ -171,8 +600,9 @@ class ThunderdomeGroupManager(object):
     """Class that understands how to retrieve and filter thunderdome groups,
     acquired from the PyCon website.
     """
-    def __init__(self):
-        self.api = API()
+    def __init__(self, proposals):
+        self.proposals = proposals
+        self.api = proposals.api
 
     def all(self):
         return self.filter()
@@ -185,47 +615,63 @@ class ThunderdomeGroupManager(object):
         if undecided:
             kwargs['undecided'] = undecided
 
-        response = self.api.get('thunderdome_groups', **kwargs)
-        return [ThunderdomeGroup(**i) for i in response['data']]
+        return _chain(self.api.get('thunderdome_groups', **kwargs),
+                      lambda r: [self._build(i) for i in r['data']])
 
     def get(self, code):
         """Return back a single proposal given the following code.
         We do not filter on anything other than code here.
         """
+        def not_found(failure):
+            failure.trap(NotFound)
+            raise ThunderdomeGroup.DoesNotExist('No group with code %s.'
+                                                % code)
+
         try:
             response = self.api.get('thunderdome_groups/%s' % code)
         except NotFound:
             raise ThunderdomeGroup.DoesNotExist('No group with code %s.'
                                                 % code)
-        return ThunderdomeGroup(**response['data'])
+        if isinstance(response, defer.Deferred):
+            response.addErrback(not_found)
+        return _chain(response, lambda r: self._build(r['data']))
 
     def next(self, undecided=True):
         """Return the next thunderdome group that should be decided."""
 
-        try:
-            return self.filter(undecided=True)[1]
-        except KeyError:
-            return None
+        def second(groups):
+            try:
+                return groups[1]
+            except IndexError:
+                return None
+        return _chain(self.filter(undecided=True), second)
+
+    def _build(self, data):
+        """Return a group bound to this manager from API data."""
+        return ThunderdomeGroup(_manager=self, **data)
 
 
 class ThunderdomeGroup(object):
     """Object to represent proposal objects, which can be acted upon
     and saved back to the PyCon website.
     """
-    objects = ThunderdomeGroupManager()
+    objects = ThunderdomeGroupManager(Proposal.objects)
+    async_objects = ThunderdomeGroupManager(Proposal.async_objects)
 
     class DoesNotExist(Exception):
         pass
 
-    def __init__(self, code, talks=(), **kwargs):
+    def __init__(self, code, talks=(), _manager=None, **kwargs):
         """Create a new thunderdome group instance. This MUST have a code
         to be valid; we do not create new groups or proposals from nowhere
         for our purposes.
         """
+        _manager = _manager or self.objects
+
         # Iterate over the talks and make Proposal objects from each.
         talks_ = []
         for t in talks:
-            talks_.append(Proposal(**t))
+            talks_.append(_manager.proposals._build(t))
         kwargs['talks'] = talks_
 
         # Set the code.
@@ -236,7 +682,7 @@ class ThunderdomeGroup(object):
 
         # Write the things to the object.
         self.__dict__.update({
-            'api': API(),
+            'api': _manager.api,
             'data': kwargs,
         })
 
@@ -267,12 +713,17 @@ class ThunderdomeGroup(object):
         decided_talks = set(self.decision.keys())
         return set(self.talk_ids).difference(decided_talks)
 
-    def certify(self):
-        """Send the results to the PyCon server."""
-        self.api.post('thunderdome_groups/%s' % self.code, {
+    def certify(self, journal=None):
+        """Send the results to the PyCon server, through `journal` if
+        one is given."""
+        endpoint = 'thunderdome_groups/%s' % self.code
+        body = {
             'talks': [[id, status.replace('damaged', 'standby')]
                       for id, status in self.decision.items()],
-        })
+        }
+        if journal is not None:
+            return journal.post(endpoint, body)
+        return self.api.post(endpoint, body, idempotent=True)
 
     def decide_talk(self, talk_id, status):
         """Record a decision for a particular talk within this
@@ -1,8 +1,187 @@
 from __future__ import division
+from pycon_bot import settings
+from pycon_bot.stats import format_seconds
+from pycon_bot.utils.text import seconds_to_text
+from twisted.python import log
 import importlib
+import inspect
+import os
+import pkgutil
 import re
 import time
 
+# Modules in this package that aren't modes.
+NOT_MODES = ('base',)
+
+# How many of the slowest things ,stats reports on.
+STATS_REPORTED = 5
+
+
+class Command(object):
+    """A chair or private command understood by a mode.
+
+    Everything needed to dispatch the command and to describe it is worked
+    out once, when the mode class is created.
+    """
+
+    def __init__(self, command_type, name, function):
+        self.type = command_type
+        self.name = name
+        self.function = function
+
+        # Work out how many arguments the command takes. The user (and,
+        # for chair commands, the channel) are supplied by the bot, and
+        # arguments starting with an underscore are only for internal use.
+        spec = inspect.getargspec(function)
+        args = spec.args[3 if command_type == 'chair' else 2:]
+        split = len(args) - len(spec.defaults or ())
+        required = args[:split]
+        optional = [arg for arg in args[split:] if not arg.startswith('_')]
+        self.min_args = len(required)
+        self.max_args = None
+        if not spec.varargs:
+            self.max_args = len(required) + len(optional)
+
+        # Describe how the command is used.
+        usage = [(',' if command_type == 'chair' else '') + name]
+        usage += ['<%s>' % arg for arg in required]
+        usage += ['[%s]' % arg for arg in optional]
+        if spec.varargs:
+            usage.append('[%s...]' % spec.varargs)
+        self.usage = ' '.join(usage)
+
+        # Take the docstring and present it as help; however we need to
+        # reformat docstrings to be more IRC friendly -- specifically:
+        #   - change single `\n` to just spaces
+        #   - change double `\n` to single `\n`
+        help_text = function.__doc__ or 'No help is available for %s.' % (
+            usage[0],
+        )
+        help_text = re.sub(r'\n[ ]*\n', '|---|', help_text.strip())
+        help_text = re.sub(r'\s+', ' ', help_text)
+        self.help = re.sub(r' ?\|---\| ?', '\n', help_text)
+
+    def __repr__(self):
+        return '<Command: %s>' % self.usage
+
+    def accepts(self, count):
+        """Return True if the command can be given `count` arguments."""
+        if count < self.min_args:
+            return False
+        return self.max_args is None or count <= self.max_args
+
+
+def message_filter(pattern=None, prefixes=()):
+    """Declare which channel messages a state handler cares about.
+
+    While a state handler is set, the bot hands it every line said in the
+    channel, most of which is chatter the handler will ignore. A handler
+    decorated with this is only called for (lowercased, stripped) lines
+    that match `pattern`, a regular expression, or that begin with one of
+    `prefixes`; the bot rejects the rest with a single compiled match,
+    without calling into the mode at all.
+    """
+    alternatives = []
+    if pattern is not None:
+        alternatives.append('(?:%s)' % pattern)
+    alternatives.extend(re.escape(prefix) for prefix in prefixes)
+    matcher = re.compile('|'.join(alternatives)).match
+
+    def decorator(function):
+        function.message_filter = matcher
+        return function
+    return decorator
+
+
+class ModeType(type):
+    """Metaclass for modes, which collects each mode's chair and private
+    commands into a registry when the class is created, so that finding
+    a command (or listing them all) is a dictionary lookup.
+    """
+    COMMAND_TYPES = ('chair', 'private')
+
+    def __init__(cls, name, bases, attrs):
+        super(ModeType, cls).__init__(name, bases, attrs)
+        cls.commands = dict((command_type, {})
+                            for command_type in cls.COMMAND_TYPES)
+        for attr in dir(cls):
+            command_type, _, command = attr.partition('_')
+            if command_type not in cls.commands or not command:
+                continue
+            method = getattr(cls, attr)
+            if inspect.ismethod(method):
+                cls.commands[command_type][command] = Command(
+                    command_type, command, method.__func__,
+                )
+
+        cls.command_listings = dict(
+            (command_type, cls._list_commands(command_type))
+            for command_type in cls.COMMAND_TYPES
+        )
+
+    def _list_commands(cls, command_type):
+        """Return the lines listing this mode's commands of the given
+        type, three to a line.
+        """
+        commands = sorted(cmd.usage.split()[0]
+                          for cmd in cls.commands[command_type].values())
+        lines = []
+        msg_queue = '   '
+        for i in range(0, len(commands)):
+            command = commands[i]
+            msg_queue += command
+            if i % 3 != 2 and i != len(commands) - 1:
+                msg_queue += (' ' * (20 - (len(command) * 2)))
+            else:
+                lines.append(msg_queue)
+                msg_queue = '   '
+        return lines
+
+
+def load_mode(name, fresh=False):
+    """Import the named mode's module, or re-import it if `fresh` is
+    true, and return the module. Raise ImportError if there is no such
+    mode, or if its module doesn't define a mode.
+    """
+    if name in NOT_MODES:
+        raise ImportError('%s is not a mode' % name)
+    module = importlib.import_module('pycon_bot.modes.%s' % name)
+    if fresh:
+        module = reload(module)
+    mode = getattr(module, 'Mode', None)
+    if not (isinstance(mode, type) and issubclass(mode, SkeletonMode)):
+        raise ImportError('pycon_bot.modes.%s has no Mode class' % name)
+    return module
+
+
+def preload_modes():
+    """Import and check every mode up front, so that switching to one
+    mid-meeting doesn't wait on the import, and a broken one shows up
+    in the log at startup rather than when the chair asks for it.
+    Return the names of the modes that loaded.
+    """
+    loaded = []
+    path = [os.path.dirname(os.path.abspath(__file__))]
+    for _, name, is_package in pkgutil.iter_modules(path):
+        if is_package or name in NOT_MODES:
+            continue
+        try:
+            load_mode(name)
+        except Exception:
+            log.err(None, 'Unable to load mode %s' % name)
+        else:
+            loaded.append(name)
+    return loaded
+
+
+def _rebind(value, old, new):
+    """If `value` is a method bound to the `old` mode, return the same
+    method of the `new` one; otherwise, return it as it is.
+    """
+    if getattr(value, '__self__', None) is old:
+        return getattr(new, value.__name__)
+    return value
+
 
 class SkeletonMode(object):
     """Skeleton (base) mode.
@@ -15,6 +194,7 @@ class SkeletonMode(object):
     
     This mode must superclass all other modes, or you
     will likely get undesired behavior."""
+    __metaclass__ = ModeType
     
     def __init__(self, bot):
         self.bot = bot
@@ -27,6 +207,15 @@ class SkeletonMode(object):
         
         # Unicode makes Twisted (or SOMETHING) sad. ASCII.
         self.bot.msg(channel, (msg % args).encode('ascii', 'ignore'))
+
+    def _api_failed(self, failure, channel):
+        """Errback for calls to the PyCon website: log the failure and
+        let the channel know, rather than leaving the chair hanging."""
+
+        log.err(failure, 'Call to the PyCon website failed')
+        self.msg(channel, 'Sorry, I could not talk to the PyCon website '
+                          '(%s). Please try again.',
+                 failure.getErrorMessage())
         
     def exec_command(self, command, command_type, user, channel, *args):
         """Execute an arbitrary command, provided it is found on the mode."""
@@ -39,20 +228,22 @@ class SkeletonMode(object):
             return
         
         # find the correct command and execute it
-        method = '%s_%s' % (command_type, command)
-        if hasattr(self, method):
+        target = channel if command_type == 'chair' else user
+        cmd = self.commands[command_type].get(command)
+        if cmd:
+            if not cmd.accepts(len(args)):
+                self.msg(target, 'Usage: %s', cmd.usage)
+                return
             if command_type == 'chair':
-                return getattr(self, method)(user, channel, *args)
+                return cmd.function(self, user, channel, *args)
             else:
-                return getattr(self, method)(user, *args)
+                return cmd.function(self, user, *args)
                 
         # whups, we clearly weren't able to find the command...bork out
         help_command = 'help'
         if command_type == 'chair':
             help_command = ',' + help_command
-            self.msg(channel, "Sorry, I don't recognize that command. Issue `%s` for a command list." % help_command)
-        else:
-            self.msg(user, "Sorry, I don't recognize that command. Issue `%s` for a command list." % help_command)
+        self.msg(target, "Sorry, I don't recognize that command. Issue `%s` for a command list." % help_command)
 
     def chair_mode(self, user, channel, new_mode=None, _silent=False):
         """Set the channel's mode. If no mode is provided,
@@ -64,10 +255,10 @@ class SkeletonMode(object):
         # if no argument is given, print out the mode that
         # we are in now
         if not new_mode:
-            mode_name = self.bot.mode.__class__.__module__.__name__.lower()
+            mode_name = self._mode_name()
             if mode_name == 'base':
                 mode_name = '(none)'
-            self.msg(channel, "Current mode: %s" % mode_name[:-4])
+            self.msg(channel, "Current mode: %s" % mode_name)
             return
     
         # okay, we were asked to *set* the mode -- do that now
@@ -80,11 +271,93 @@ class SkeletonMode(object):
             return
             
         try:
-            mod = importlib.import_module('pycon_bot.modes.%s' % new_mode)
+            mod = load_mode(new_mode)
             self.bot.mode = mod.Mode(self.bot)
             self.msg(channel, 'Activated %s mode.' % new_mode)
         except (ImportError, AttributeError) as e:
             self.msg(channel, 'Unable to load mode `%s`: %s' % (new_mode, e))
+
+    def chair_reload(self, user, channel, mode=None):
+        """Reload a mode's code, without restarting the bot. If no mode
+        is given, reload the one running.
+
+        If the running mode is reloaded, the meeting carries on where it
+        was, under the new code."""
+
+        name = mode or self._mode_name()
+        if name in NOT_MODES:
+            self.msg(channel, 'There is no mode running to reload.')
+            return
+
+        # A mistake in the new code shouldn't take the meeting down with it.
+        try:
+            module = load_mode(name, fresh=True)
+        except Exception as e:
+            log.err(None, 'Unable to reload mode %s' % name)
+            self.msg(channel, 'Unable to reload mode `%s`: %s' % (name, e))
+            return
+
+        if self.__class__.__module__ != module.__name__:
+            self.msg(channel, 'Reloaded %s mode.' % name)
+            return
+
+        new = module.Mode(self.bot)
+        new.take_over(self)
+        self.bot.mode = new
+        self.msg(channel, 'Reloaded %s mode; carrying on.' % name)
+
+    def chair_stats(self, user, channel):
+        """Report what has been keeping the bot busy: the commands and
+        state handlers that take longest to run (median and 99th
+        percentile), time spent waiting on the PyCon website, and how
+        often the bot has stalled."""
+
+        timings = self.bot.timings
+        slowest = timings.slowest(STATS_REPORTED)
+        if not slowest:
+            self.msg(channel, 'Nothing has been timed yet.')
+        for name, histogram in slowest:
+            self.msg(channel, '%s: %d run%s, p50 %s, p99 %s, max %s' % (
+                name, histogram.count, '' if histogram.count == 1 else 's',
+                format_seconds(histogram.percentile(50)),
+                format_seconds(histogram.percentile(99)),
+                format_seconds(histogram.max),
+            ))
+
+        api = [histogram for _, histogram in timings.slowest(None, 'api ')]
+        if api:
+            self.msg(channel, 'Blocked on the PyCon website for %s, over '
+                              '%d calls.' % (
+                format_seconds(sum(h.total for h in api)),
+                sum(h.count for h in api),
+            ))
+
+        watchdog = self.bot.watchdog
+        if watchdog is not None:
+            self.msg(channel, 'Stalls over %s: %d (longest %s).' % (
+                format_seconds(watchdog.threshold), watchdog.stalls,
+                format_seconds(watchdog.longest),
+            ))
+
+    def take_over(self, old):
+        """Take over the live state of a mode being replaced by this one
+        (the current talk, votes, champions and so on), and anything that
+        would otherwise call back into it: the state handler, and timers.
+        """
+        self.__dict__.update(
+            (attr, value) for attr, value in old.__dict__.items()
+            if attr != 'bot'
+        )
+        self.bot.state_handler = _rebind(self.bot.state_handler, old, self)
+        for timer in self.bot.timers:
+            timer.callback = _rebind(timer.callback, old, self)
+            timer.args = tuple(_rebind(arg, old, self) for arg in timer.args)
+            timer.kwargs = dict((key, _rebind(value, old, self))
+                                for key, value in timer.kwargs.items())
+
+    def _mode_name(self):
+        """The name this mode goes by in `,mode`."""
+        return self.__class__.__module__.rsplit('.', 1)[-1]
             
     def chair_help(self, user, channel, command=None):
         """Return a list of chair commands that we currently understand.
@@ -99,50 +372,23 @@ class SkeletonMode(object):
     def _help(self, user, channel, command_type, command=None):        
         # if an argument is given, print help about that specific command
         if command:
-            command = command.replace(',', '')
-            method = getattr(self, '%s_%s' % (command_type, command), None)
+            cmd = self.commands[command_type].get(command.replace(',', ''))
             
             # sanity check: does this method actually exist?
-            if not method:
+            if not cmd:
                 help_command = 'help'
                 if command_type == 'chair':
                     help_command = ',%s' % help_command
                 self.msg(channel, 'This command does not exist. Issue `%s` by itself for a command list.' % help_command)
                 return
                 
-            # okay, now take the docstring and present it as help; however
-            # we need to reformat my docstrings to be more IRC friendly -- specifically:
-            #   - change single `\n` to just spaces
-            #   - change double `\n` to single `\n`
-            help_text = method.__doc__
-            help_text = re.sub(r'\\n[ ]+\\n', '|---|', help_text)
-            help_text = re.sub(r'\s+', ' ', help_text)
-            help_text = help_text.replace('|---|', '\n')
-            self.msg(channel, help_text)
+            self.msg(channel, cmd.help)
             return
         
         # okay, give a list of the commands available
-        commands = []
-        for attr in dir(self):
-            if callable(getattr(self, attr)) and attr.startswith('%s_' % command_type):
-                if command_type == 'chair':
-                    command_name = ',%s' % attr[len(command_type) + 1:]
-                else:
-                    command_name = attr[len(command_type) + 1:]
-                commands.append(command_name)
-        commands.sort()
-        
-        # now print out the list of commands to the channel
         self.msg(channel, 'I recognize the following %s commands:' % command_type)
-        msg_queue = '   '
-        for i in range(0, len(commands)):
-            command = commands[i]
-            msg_queue += command
-            if i % 3 != 2 and i != len(commands) - 1:
-                msg_queue += (' ' * (20 - (len(command) * 2)))
-            else:
-                self.msg(channel, msg_queue)
-                msg_queue = '   '
+        for line in self.command_listings[command_type]:
+            self.msg(channel, line)
                 
 
 class BaseMode(SkeletonMode):
@@ -238,6 +484,42 @@ class BaseMode(SkeletonMode):
         # actually do the pestering
         self.bot.names(channel).addCallback(_)
         
+    def private_transcript(self, user, talk_id):
+        """Send the transcript of a talk's debate, as far as it was logged
+        here: `transcript 5` (or `transcript #5`) for talk #5."""
+
+        read = getattr(self.bot.log_target, 'transcript', None)
+        if read is None:
+            self.msg(user, 'Sorry, I am not keeping transcripts.')
+            return
+        try:
+            talk_id = int(talk_id.lstrip('#'))
+        except ValueError:
+            self.msg(user, 'Usage: transcript <talk_id>')
+            return
+
+        lines = read(talk_id)
+        if not lines:
+            self.msg(user, 'There is no transcript for #%d.' % talk_id)
+            return
+        shown = lines[-settings.TRANSCRIPT_LINES:]
+        if len(shown) < len(lines):
+            self.msg(user, 'The last %d of %d lines of the transcript for '
+                           '#%d:' % (len(shown), len(lines), talk_id))
+        else:
+            self.msg(user, 'Transcript for #%d:' % talk_id)
+        for line in shown:
+            self.msg(user, '[%s] <%s> %s', line['timestamp'][:16],
+                     line['user'], line['line'])
+
+    def _transcript_pointer(self, talk_id):
+        """Tell people where to find a talk's transcript, if there is one.
+        """
+        has_transcript = getattr(self.bot.log_target, 'has_transcript', None)
+        if has_transcript is None or not has_transcript(talk_id):
+            return 'none on record'
+        return '/msg %s transcript %d' % (self.bot.nickname, talk_id)
+
     def handler_user_names(self, user, channel, message):
         """As users write their names, note that they've reported in,
         so we can see who isn't here and set them as non-voters."""
@@ -252,30 +534,8 @@ class BaseMode(SkeletonMode):
     def _seconds_to_text(self, seconds):
         """Convert a number of seconds, specified as an int or string,
         to a pretty string."""
-        
-        # let's get started
-        seconds = int(seconds)
-        time_text = ''
+        return seconds_to_text(seconds)
 
-        # sanity check: 0 seconds is a corner case; just return it back statically
-        if seconds == 0:
-            return '0 seconds'
-            
-        # deal with the minutes portion
-        if seconds // 60 > 0:
-            time_text += '%d minute' % (seconds // 60)
-            if seconds // 60 != 1:
-                time_text += 's'
-            if seconds % 60:
-                time_text += ', '
-                
-        # deal with the seconds portion
-        if seconds % 60:
-            time_text += '%d second' % (seconds % 60)
-            if seconds % 60 != 1:
-                time_text += 's'
-        return time_text
-            
     def _minutes_to_text(self, minutes):
         """Convert a number of minutes, specified as a float, int, or string,
         to a pretty string."""
@@ -1,13 +1,15 @@
 from __future__ import division
 from datetime import datetime, timedelta
 from pycon_bot.models import Proposal # , KittendomeVotes, Meeting
-from pycon_bot.modes.base import BaseMode
-from twisted.internet import reactor
+from pycon_bot.modes.base import BaseMode, message_filter
+from twisted.internet import defer
 
 # Constants for time-related things.
 CHAMPION_CALL_SECONDS = 30
 CHAMPION_MINUTES = 2
 DEBATE_MINUTES = 3
+DEBATE_WARNING_SECONDS = 30
+VOTING_SOON = 'Voting in %d seconds unless someone objects (type "wait").'
 
 # Votes we understand and can parse.
 AYE_VOTES = ('yes', 'yay', 'yea', 'aye', '+1')
@@ -34,23 +36,27 @@ class Mode(BaseMode):
         self.segment = None
         self.champions = []
 
-        # Some private things
-        self._delayed_vote_timer = None
-
     def chair_start(self, user, channel, meeting_num=None):
         """Start a meeting. If a meeting number is given, resume the
         meeting instead."""
 
         # Get the next talk in queue.
-        try:
-            self.next = Proposal.objects.next(
-                status='undecided',
-                type='talk',
-            )
-            self._in_meeting = True
-        except IndexError:
-            self.msg(channel, "Out of talks!")
-            return
+        d = Proposal.async_objects.next(
+            status='undecided',
+            type='talk',
+        )
+        d.addCallbacks(self._started, self._out_of_talks,
+                       callbackArgs=(channel, meeting_num),
+                       errbackArgs=(channel,))
+        d.addErrback(self._api_failed, channel)
+        return d
+
+    def _started(self, next_talk, channel, meeting_num=None):
+        """Announce the start of the meeting, once we know which talk
+        will come first."""
+
+        self.next = next_talk
+        self._in_meeting = True
 
         # now pull up the meeting itself
         # try:
@@ -91,18 +97,25 @@ class Mode(BaseMode):
 
     def chair_goto(self, user, channel, talk_id):
         """Cause the next talk to be the talk with the given `talk_id`."""
-        try:
-            self.next = Proposal.objects.get(id=talk_id)
-        except Proposal.DoesNotExist as ex:
-            self.msg(channel, str(ex))
-            return
-        msg = 'OK, the next talk will be {id} (status: {status}).'.format(
-            id=self.next.id,
-            status=self.next.status,
-        )
-        # if self.next.kittendome_votes:
-        #     msg += " Previous vote was %s." % self.next.kittendome_votes
-        self.msg(channel, msg)
+
+        def goto(talk):
+            self.next = talk
+            msg = 'OK, the next talk will be {id} (status: {status}).'.format(
+                id=self.next.id,
+                status=self.next.status,
+            )
+            # if self.next.kittendome_votes:
+            #     msg += " Previous vote was %s." % self.next.kittendome_votes
+            self.msg(channel, msg)
+
+        def does_not_exist(failure):
+            failure.trap(Proposal.DoesNotExist)
+            self.msg(channel, failure.getErrorMessage())
+
+        d = Proposal.async_objects.get(id=talk_id)
+        d.addCallbacks(goto, does_not_exist)
+        d.addErrback(self._api_failed, channel)
+        return d
 
     def chair_next(self, user, channel, talks_remaining=None):
         """Move to the next talk, and immediately shift into champion mode."""
@@ -132,17 +145,28 @@ class Mode(BaseMode):
 
         # Figure out which talk is up now.
         if self.next:
-            t = self.current = self.next
+            d = defer.succeed(self.next)
             self.next = None
         else:
-            try:
-                t = self.current = Proposal.objects.next(
-                    status='undecided',
-                    type='talk',
-                )
-            except IndexError:
-                self.msg(channel, 'Out of talks!')
-                return
+            d = Proposal.async_objects.next(
+                status='undecided',
+                type='talk',
+            )
+        d.addCallbacks(self._announce_talk, self._out_of_talks,
+                       callbackArgs=(user, channel),
+                       errbackArgs=(channel,))
+        d.addErrback(self._api_failed, channel)
+        return d
+
+    def _out_of_talks(self, failure, channel):
+        failure.trap(Proposal.DoesNotExist)
+        self.msg(channel, 'Out of talks!')
+
+    def _announce_talk(self, talk, user, channel):
+        """Announce the talk that is now up, look up the one after it,
+        and then begin championing."""
+
+        t = self.current = talk
 
         # this is a new talk; no champions have declared themselves
         self.champions = []
@@ -151,21 +175,34 @@ class Mode(BaseMode):
         self.msg(channel, "=== Talk %d: %s - %s ===",
                           t.id, t.title, t.review_url)
 
+        def next_talk(talk):
+            self.next = talk
+            self.msg(channel, '(%s will be next)', self.next.review_url)
+
+        def last_talk(failure):
+            failure.trap(Proposal.DoesNotExist)
+            self.msg(channel, 'This will be the last talk of kittendome!')
+
         if getattr(self, '_talks_remaining', 3.14159):  # something non-falsy
-            try:
-                self.next = Proposal.objects.next(
-                    after=t.id,
-                    status='undecided',
-                    type='talk',
-                )
-                self.msg(channel, '(%s will be next)', self.next.review_url)
-            except IndexError:
-                self.msg(channel, 'This will be the last talk of kittendome!')
+            d = Proposal.async_objects.next(
+                after=t.id,
+                status='undecided',
+                type='talk',
+            )
+            d.addCallbacks(next_talk, last_talk)
         else:
             self.msg(channel, 'This will be the last talk for today.')
+            d = defer.succeed(None)
+
+        # Whatever happens with the next talk, championing for this one
+        # goes ahead.
+        d.addErrback(self._api_failed, channel)
+        d.addCallback(lambda _: self._begin_championing(user, channel))
+        return d
+
+    def _begin_championing(self, user, channel):
+        """Begin the championing process for the current talk."""
 
-        # Begin the championing process.
-        #
         # Note: if this talk has *already* been debated and is, in fact,
         # on hold, we have a different process for it.
         if self.current.status == 'hold':
@@ -188,8 +225,7 @@ class Mode(BaseMode):
             self.msg(channel, msg_template.format(
                 talk_id=self.current.id,
                 time_text=self._seconds_to_text(CHAMPION_CALL_SECONDS * 2),
-                transcript='<COMING SOON>',
-                        # http://pyconbot.herokuapp.com/talks/%(talk_id)d
+                transcript=self._transcript_pointer(self.current.id),
             ))
         else:
             # This represents the "normal" championing process.
@@ -256,7 +292,8 @@ class Mode(BaseMode):
         self.bot.state_handler = None
 
         # Actually set the bot timer.
-        self.bot.set_timer(channel, float(debate_time) * 60)
+        self.bot.set_timer(channel, float(debate_time) * 60,
+                           warnings=(DEBATE_WARNING_SECONDS,))
 
         # Now report the shift to debate mode.
         self.segment = 'debate'
@@ -270,8 +307,8 @@ class Mode(BaseMode):
         useful management tool within meetings.
         """
         # If there's an active timer, just delay it.
-        if self.bot.timer and self.bot.timer.active():
-            self.bot.timer.delay(float(extend_time) * 60)
+        if self.bot.timers.active('main'):
+            self.bot.timers.delay('main', float(extend_time) * 60)
         else:
             # Clear the timer and set a new one.
             self.bot.clear_timer()
@@ -313,14 +350,11 @@ class Mode(BaseMode):
         if defer:
             defer = int(defer)
 
-            # First, delay the timer currently on the bot by the amount of
+            # First, stop the clock on the timer currently on the bot for
             # the deferral; do this in lieu of clearing the timer because
             # if we are asked to wait; we still need it
-            if self.bot.timer and self.bot.timer.active():
-                if defer >= _DOUBLE_MESSAGE_BOUNDARY:
-                    self.bot.timer.delay(defer)
-                else:
-                    self.bot.timer.delay(defer - _DOUBLE_MESSAGE_SECOND_CALL)
+            if self.bot.timers.active('main'):
+                self.bot.timers.pause('main')
             else:
                 # There is no timer; this is an odd case, but I don't know
                 # how to automate it; the chair will have to handle this as
@@ -331,31 +365,26 @@ class Mode(BaseMode):
                     'told, but am not sure what you are intending. FYI.',
                 )))
 
-            # Now set up our own timer for the vote delay; note that
-            # we need to *not* use `self.bot.set_timer` because it will
-            # wipe out the "main" timer that we need back.
-            # Therefore; set this one off to the side.
+            # Now set up a separate timer for the vote delay, so as not to
+            # wipe out the "main" timer that we need back. If there's
+            # long enough to go, warn everyone again just beforehand.
+            warnings = ()
             if defer >= _DOUBLE_MESSAGE_BOUNDARY:
-                self._delayed_vote_timer = reactor.callLater(
-                    defer - _DOUBLE_MESSAGE_SECOND_CALL,
-                    self.chair_vote, user, channel,
-                    defer=_DOUBLE_MESSAGE_SECOND_CALL,
-                )
-            else:
-                self._delayed_vote_timer = reactor.callLater(
-                    defer, self.chair_vote, user, channel,
-                )
-            self.msg(channel, ' '.join((
-                'Voting in {seconds} seconds unless someone objects',
-                '(type "wait").',
-            )).format(seconds=defer))
+                warnings = (_DOUBLE_MESSAGE_SECOND_CALL,)
+            self.bot.timers.start('vote', defer, self.chair_vote, user,
+                                  channel, warnings=warnings,
+                                  on_warning=lambda seconds: self.msg(
+                                      channel, VOTING_SOON, seconds))
+            self.msg(channel, VOTING_SOON, defer)
 
             # Set the state handler so the bot actually listens to wait calls.
             self.bot.state_handler = self.handler_voting_soon
 
         else:
-            # Clear any timer that may exist now.
+            # Clear any timer that may exist now, including any countdown
+            # to this very vote.
             self.bot.clear_timer()
+            self.bot.clear_timer('vote')
 
             # Clear out the votes.
             self.current_votes = {}
@@ -530,19 +559,18 @@ class Mode(BaseMode):
             time_left = meeting_end - datetime.now()
             talk_count = int(round(time_left.seconds / 300))
 
-        # Get the list of talks.
-        # Hodge-podge it together from the full list that
-        # the API provides.
-        talks_from_api = Proposal.objects.filter(status='undecided',
-                                                 type='talk')
-        talks = []
-        for talk in talks_from_api:
-            if talk.id <= (self.current.id if self.current else self.next.id):
-                continue
-            talks.append(talk)
-            if len(talks) >= talk_count:
-                break
+        # Get the list of talks; we only need as many as we expect to
+        # get through.
+        d = Proposal.async_objects.take(talk_count,
+            after=self.current.id if self.current else self.next.id,
+            status='undecided',
+            type='talk',
+        )
+        d.addCallback(self._report_agenda, user, talk_count)
+        d.addErrback(self._api_failed, user)
+        return d
 
+    def _report_agenda(self, talks, user, talk_count):
         # Sanity check: do we have any talks up to bat at all?
         if not talks:
             self.msg(user, ' '.join((
@@ -593,6 +621,7 @@ class Mode(BaseMode):
         else:
             self.msg(channel, "%s: Please vote aye, nay, or abstain.", user)
 
+    @message_filter(prefixes=('wait',))
     def handler_voting_soon(self, user, channel, message):
         """Handle the case where we're counting down to a premature vote.
         If anyone says "wait", call off the countdown.
@@ -600,9 +629,10 @@ class Mode(BaseMode):
         # If the message is (or even just begins with) "wait", that's our
         # signal to hold off.
         message = message.strip().lower()
-        if message.startswith('wait'):
-            self._delayed_vote_timer.cancel()
-            self._delayed_vote_timer = None
+        if message.startswith('wait') and self.bot.timers.active('vote'):
+            self.bot.timers.cancel('vote')
+            if self.bot.timers.active('main'):
+                self.bot.timers.resume('main')
 
             # Print that we're holding off.
             self.msg(channel, 'Request to wait acknowledged. Holding off.')
@@ -710,11 +740,7 @@ class Mode(BaseMode):
 
     def log_message(self, user, channel, message):
         """Save a transcript for debate along with each talk."""
-        return  # FIXME
-        if self.meeting:
-            self.meeting.add_to_transcript(datetime.now(), user, message)
-        if self.current:
-            self.current.add_to_transcript(datetime.now(), user, message)
+        if self.current and self.bot.log_target is not None:
             self.bot.log_target.log(self.current.id, user, message)
 
     def _make_decision(self, user, channel, decision, message,
@@ -735,12 +761,14 @@ class Mode(BaseMode):
         # if decision == 'rejected' and alternative:
             # self.current.alternative = alternative
 
-        # Save the new status for this talk on the PyCon website.
-        # FIXME: Make this better.
-        self.current.write({
+        # Save the new status for this talk on the PyCon website. This
+        # goes through the bot's journal, if it has one, so that we need
+        # not wait on the site (or lose the decision if it is down).
+        d = self.current.write({
             'status': decision,
             'alternative': alternative,
-        })
+        }, journal=self.bot.journal)
+        d.addErrback(self._api_failed, channel)
 
         # Place the talk into the meeting's `talks_decided` list.
         if self.meeting:
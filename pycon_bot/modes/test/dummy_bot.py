@@ -1,3 +1,4 @@
 class Bot(object):
     def __init__(self, log_target):
         self.log_target = log_target
+        self.journal = None
@@ -0,0 +1,245 @@
+from pycon_bot.driver import PyConBotFactory
+from pycon_bot.modes import base, kitten
+from pycon_bot.stats import Timings
+from pycon_bot.transcripts import TranscriptStore
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class CommandRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot()
+        self.mode = Mode(self.bot)
+
+    def test_registry(self):
+        """Chair and private commands, including inherited ones, are
+        collected when the class is created.
+        """
+        self.assertEqual(sorted(Mode.commands['chair']),
+                         ['help', 'mode', 'move', 'pick', 'reload',
+                          'stats'])
+        self.assertEqual(sorted(Mode.commands['private']), ['help', 'whisper'])
+        self.assertNotIn('move', base.SkeletonMode.commands['chair'])
+
+    def test_arity(self):
+        """The registry knows how many arguments each command takes,
+        ignoring internal ones.
+        """
+        move = Mode.commands['chair']['move']
+        self.assertEqual((move.min_args, move.max_args), (1, 2))
+        self.assertEqual(move.usage, ',move <square> [piece]')
+        pick = Mode.commands['chair']['pick']
+        self.assertEqual((pick.min_args, pick.max_args), (0, None))
+        self.assertEqual(pick.usage, ',pick [names...]')
+
+    def test_dispatch(self):
+        """Commands are dispatched with the user, channel and arguments.
+        """
+        self.mode.exec_command('move', 'chair', 'alice', '#pc', 'e4')
+        self.mode.exec_command('whisper', 'private', 'bob', 'bot', 'hi')
+        self.assertEqual(self.mode.calls, [
+            ('move', 'alice', '#pc', 'e4', None, False),
+            ('whisper', 'bob', ('hi',)),
+        ])
+
+    def test_wrong_arity(self):
+        """A command given the wrong number of arguments is not run; the
+        caller is told how to use it instead.
+        """
+        self.mode.exec_command('move', 'chair', 'alice', '#pc')
+        self.mode.exec_command('move', 'chair', 'alice', '#pc', 'a', 'b', 'c')
+        self.assertEqual(self.mode.calls, [])
+        self.assertEqual(self.bot.messages,
+                         [('#pc', 'Usage: ,move <square> [piece]')] * 2)
+
+    def test_unknown(self):
+        """Unknown commands get a pointer to the help.
+        """
+        self.mode.exec_command('fly', 'private', 'bob', 'bot')
+        self.assertEqual(self.bot.messages, [('bob', "Sorry, I don't "
+            "recognize that command. Issue `help` for a command list.")])
+
+    def test_help(self):
+        """Help for a command is its docstring, reflowed for IRC.
+        """
+        self.mode.exec_command('help', 'chair', 'alice', '#pc', ',move')
+        self.assertEqual(self.bot.messages, [
+            ('#pc', 'Move a piece to the given square.\nDefaults to a pawn.'),
+        ])
+
+    def test_help_list(self):
+        """Without a command, help lists every command.
+        """
+        self.mode.exec_command('help', 'chair', 'alice', '#pc')
+        self.assertEqual(self.bot.messages[0],
+                         ('#pc', 'I recognize the following chair commands:'))
+        listed = ' '.join(line for _, line in self.bot.messages[1:]).split()
+        self.assertEqual(listed, [',help', ',mode', ',move', ',pick',
+                                  ',reload', ',stats'])
+
+
+class StatsTests(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot()
+        self.bot.timings = Timings(timer=lambda: 0)
+        self.bot.watchdog = None
+        self.mode = Mode(self.bot)
+
+    def test_nothing(self):
+        self.mode.exec_command('stats', 'chair', 'alice', '#pc')
+        self.assertEqual(self.bot.messages,
+                         [('#pc', 'Nothing has been timed yet.')])
+
+    def test_stats(self):
+        """The slowest things are reported, along with time spent on the
+        PyCon website.
+        """
+        self.bot.timings.record('chair ,next', 0.002)
+        self.bot.timings.record('api GET', 1.5)
+        self.bot.timings.record('api GET', 0.5)
+        self.mode.exec_command('stats', 'chair', 'alice', '#pc')
+        self.assertEqual([message for _, message in self.bot.messages], [
+            'api GET: 2 runs, p50 819ms, p99 1.5s, max 1.5s',
+            'chair ,next: 1 run, p50 2ms, p99 2ms, max 2ms',
+            'Blocked on the PyCon website for 2.0s, over 2 calls.',
+        ])
+
+
+class TranscriptTests(unittest.TestCase):
+    def setUp(self):
+        self.bot = Bot()
+        self.bot.nickname = 'bot'
+        self.bot.log_target = TranscriptStore(self.mktemp())
+        self.addCleanup(self.bot.log_target.close)
+        self.mode = base.BaseMode(self.bot)
+
+    def test_transcript(self):
+        """A talk's transcript is sent to whoever asks for it.
+        """
+        self.bot.log_target.log(5, 'alice', 'I like it, 100%')
+        self.mode.exec_command('transcript', 'private', 'bob', 'bot', '#5')
+        self.assertEqual(self.bot.messages[0],
+                         ('bob', 'Transcript for #5:'))
+        self.assertTrue(self.bot.messages[1][1].endswith(
+            '<alice> I like it, 100%'))
+        self.assertEqual(self.mode._transcript_pointer(5),
+                         '/msg bot transcript 5')
+
+    def test_pointer_uses_index(self):
+        """Pointing people at a transcript doesn't read it.
+        """
+        self.bot.log_target.log(5, 'alice', 'I like it')
+        self.bot.log_target.transcript = None
+        self.assertEqual(self.mode._transcript_pointer(5),
+                         '/msg bot transcript 5')
+
+    def test_through_driver(self):
+        """Asking the bot privately works, with or without a '#' before
+        the talk number.
+        """
+        factory = PyConBotFactory(['#pc'], 'bot',
+                                  log_target=self.bot.log_target)
+        bot = factory.buildProtocol(None)
+        said = []
+        bot.msg = lambda user, message: said.append((user, message))
+        context = bot.context('#pc')
+        context.mode = base.BaseMode(context)
+        self.bot.log_target.log(5, 'alice', 'I like it')
+
+        bot.privmsg('bob!b@host', 'bot', 'transcript 5')
+        bot.privmsg('bob!b@host', 'bot', 'transcript #5')
+        self.assertEqual([message for _, message in said][0::2],
+                         ['Transcript for #5:'] * 2)
+        self.assertEqual(sorted(bot.contexts), ['#pc'])
+
+    def test_no_transcript(self):
+        self.mode.exec_command('transcript', 'private', 'bob', 'bot', '6')
+        self.assertEqual(self.bot.messages,
+                         [('bob', 'There is no transcript for #6.')])
+        self.assertEqual(self.mode._transcript_pointer(6), 'none on record')
+
+
+class ReloadTests(unittest.TestCase):
+    def setUp(self):
+        bot = PyConBotFactory(['#pc'], 'bot').buildProtocol(None)
+        bot.clock = self.clock = task.Clock()
+        self.said = []
+        bot.msg = lambda channel, message: self.said.append(message)
+        self.context = bot.context('#pc')
+        self.context.mode = kitten.Mode(self.context)
+
+    def test_preload(self):
+        """Every mode is loaded up front.
+        """
+        self.assertEqual(sorted(base.preload_modes()), ['kitten', 'thunder'])
+
+    def test_not_a_mode(self):
+        """Only modules with a Mode class are modes.
+        """
+        self.assertRaises(ImportError, base.load_mode, 'base')
+        self.assertRaises(ImportError, base.load_mode, 'nonesuch')
+
+    def test_reload(self):
+        """Reloading the running mode carries its meeting over to the new
+        code, along with its state handler and timers.
+        """
+        old = self.context.mode
+        old.segment = 'voting'
+        old.champions = ['alice']
+        old.current_votes = {'bob': 'aye'}
+        self.context.state_handler = old.handler_user_vote
+        self.context.timers.start('vote', 30, old.chair_vote, 'alice', '#pc')
+        self.context.set_timer('#pc', 60, callback=old.chair_report,
+                               callback_kwargs={'user': 'alice',
+                                                'channel': '#pc'})
+
+        old.exec_command('reload', 'chair', 'alice', '#pc')
+        new = self.context.mode
+        self.assertNotIdentical(new, old)
+        self.assertIsInstance(new, kitten.Mode)
+        self.assertNotIsInstance(old, kitten.Mode)
+        self.assertEqual(self.said, ['Reloaded kitten mode; carrying on.'])
+        self.assertEqual((new.segment, new.champions, new.current_votes),
+                         ('voting', ['alice'], {'bob': 'aye'}))
+        self.assertIdentical(new.bot, self.context)
+
+        self.assertIdentical(self.context.state_handler.__self__, new)
+        for timer in self.context.timers:
+            for value in (timer.callback,) + timer.args:
+                self.assertNotIdentical(getattr(value, '__self__', None), old)
+
+    def test_reload_failed(self):
+        """A mode that won't load says so, and leaves the meeting be.
+        """
+        mode = self.context.mode
+        mode.exec_command('reload', 'chair', 'alice', '#pc', 'nonesuch')
+        self.assertIdentical(self.context.mode, mode)
+        self.assertEqual(len(self.flushLoggedErrors(ImportError)), 1)
+        self.assertTrue(self.said[0].startswith('Unable to reload mode'))
+
+
+class Mode(base.SkeletonMode):
+    def __init__(self, bot):
+        super(Mode, self).__init__(bot)
+        self.calls = []
+
+    def chair_move(self, user, channel, square, piece=None, _quiet=False):
+        """Move a piece to the given
+        square.
+
+        Defaults to a pawn."""
+        self.calls.append(('move', user, channel, square, piece, _quiet))
+
+    def chair_pick(self, user, channel, *names):
+        self.calls.append(('pick', user, channel, names))
+
+    def private_whisper(self, user, *words):
+        self.calls.append(('whisper', user, words))
+
+
+class Bot(object):
+    def __init__(self):
+        self.messages = []
+
+    def msg(self, channel, message):
+        self.messages.append((channel, message))
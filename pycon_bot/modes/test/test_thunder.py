@@ -28,6 +28,18 @@ class ThunderdomeLogTests(unittest.TestCase):
         self.assertEqual(seen_ids, self.mode.current_group.talk_ids)
 
 
+class VoteFilterTests(unittest.TestCase):
+    def test_filter(self):
+        """Anything that might be a vote reaches the vote handler, so that
+        malformed ones are answered; chatter doesn't.
+        """
+        accept = thunder.Mode.handler_user_votes.message_filter
+        for message in ('1, 3', '-2', 'all -4', 'none', '#12', 'vote 1 2'):
+            self.assertTrue(accept(message), message)
+        for message in ('lol', 'allright then', 'what are we voting on?'):
+            self.assertFalse(accept(message), message)
+
+
 class Group(object):
     def __init__(self, talk_ids):
         self.talk_ids = talk_ids
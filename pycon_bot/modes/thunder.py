@@ -1,12 +1,22 @@
 from __future__ import division
-from .base import BaseMode
+from .base import BaseMode, message_filter
 from ..models import ThunderdomeGroup, ThunderdomeVotes
+from ..log import log_for
 from copy import copy
 from datetime import datetime
 from random import randint
-from twisted.internet import reactor
 import re
 
+# Constants for time-related things.
+DEBATE_WARNING_SECONDS = 30
+VOTING_SOON = 'Voting in %d seconds unless someone objects (type "wait").'
+
+# What might be a vote: anything with a talk number in it (however it's
+# written), or starting with "all" or "none". The vote handler tells
+# people when it can't make sense of one; anything else said during voting
+# is chatter, and isn't passed to it.
+VOTE_PATTERN = r'.*[\d#]|(?:all|none)\b'
+
 
 class Mode(BaseMode):
     """A mdoer for handling Thunderdome sessions."""
@@ -22,12 +32,17 @@ class Mode(BaseMode):
 
     @property
     def current_group(self):
-        return self.groups[0]
+        return self.groups[0] if self.groups else None
+
+    @current_group.setter
+    def current_group(self, group):
+        self.groups = (group,) + tuple(self.groups[1:])
 
     @property
     def next_group(self):
         return self.groups[1]
 
+    @message_filter(prefixes=('wait',))
     def handler_voting_soon(self, user, channel, message):
         """Handle the case where we're counting down to a premature vote.
         If anyone says "wait", call off the countdown.
@@ -35,9 +50,10 @@ class Mode(BaseMode):
         # If the message is (or even just begins with) "wait", that's our
         # signal to hold off.
         message = message.strip().lower()
-        if message.startswith('wait'):
-            self._delayed_vote_timer.cancel()
-            self._delayed_vote_timer = None
+        if message.startswith('wait') and self.bot.timers.active('vote'):
+            self.bot.timers.cancel('vote')
+            if self.bot.timers.active('main'):
+                self.bot.timers.resume('main')
 
             # Print that we're holding off.
             self.msg(channel, 'Request to wait acknowledged. Holding off.')
@@ -46,7 +62,15 @@ class Mode(BaseMode):
         """Begin a meeting. If a meeting number is given, then
         resume that meeting. Initializes the next group.
         """
-        self.groups = ThunderdomeGroup.objects.filter(undecided=True)
+        d = ThunderdomeGroup.async_objects.filter(undecided=True)
+        d.addCallback(self._started, user, channel)
+        d.addErrback(self._api_failed, channel)
+        return d
+
+    def _started(self, groups, user, channel):
+        """Open the meeting, once we have the undecided groups in hand."""
+
+        self.groups = groups
 
         # Sanity check: Are there any groups?
         if not self.groups:
@@ -58,18 +82,22 @@ class Mode(BaseMode):
         self.msg(channel, 'THIS. IS. THUNDERDOME!')
         self.msg(channel, "And the meeting has started. Let's do this thing!")
 
-        # Get some statistics.
-        self.msg(channel, '* - * - * - * - *')
-        self.msg(channel, 'First, some statistics thus far:')
-        self.chair_progress(user, channel)
-        self.msg(channel, '* - * - * - * - *')
-
         # Tell the mode that the meting has begun.
         self._in_meeting = True
         self.segment = 'intro'
 
-        # Ask folks for their names iff this is a new meeting.
-        self.names(channel)
+        # Get some statistics.
+        self.msg(channel, '* - * - * - * - *')
+        self.msg(channel, 'First, some statistics thus far:')
+        d = self.chair_progress(user, channel)
+
+        # Once the statistics are out, ask folks for their names iff this
+        # is a new meeting.
+        def ask_for_names(_):
+            self.msg(channel, '* - * - * - * - *')
+            self.names(channel)
+        d.addCallback(ask_for_names)
+        return d
 
     def chair_current(self, user, channel):
         """Dump information about the current group."""
@@ -164,7 +192,8 @@ class Mode(BaseMode):
         self.bot.state_handler = None
 
         # set the timer and status
-        self.bot.set_timer(channel, debate_minutes * 60)
+        self.bot.set_timer(channel, debate_minutes * 60,
+                           warnings=(DEBATE_WARNING_SECONDS,))
         self.segment = 'debate'
 
     def chair_vote(self, user, channel, defer=None):
@@ -200,14 +229,11 @@ class Mode(BaseMode):
         if defer:
             defer = int(defer)
 
-            # First, delay the timer currently on the bot by the amount of
+            # First, stop the clock on the timer currently on the bot for
             # the deferral; do this in lieu of clearing the timer because
             # if we are asked to wait; we still need it
-            if self.bot.timer and self.bot.timer.active():
-                if defer >= _DOUBLE_MESSAGE_BOUNDARY:
-                    self.bot.timer.delay(defer)
-                else:
-                    self.bot.timer.delay(defer - _DOUBLE_MESSAGE_SECOND_CALL)
+            if self.bot.timers.active('main'):
+                self.bot.timers.pause('main')
             else:
                 # There is no timer; this is an odd case, but I don't know
                 # how to automate it; the chair will have to handle this as
@@ -218,31 +244,26 @@ class Mode(BaseMode):
                     'told, but am not sure what you are intending. FYI.',
                 )))
 
-            # Now set up our own timer for the vote delay; note that
-            # we need to *not* use `self.bot.set_timer` because it will
-            # wipe out the "main" timer that we need back.
-            # Therefore; set this one off to the side.
+            # Now set up a separate timer for the vote delay, so as not to
+            # wipe out the "main" timer that we need back. If there's
+            # long enough to go, warn everyone again just beforehand.
+            warnings = ()
             if defer >= _DOUBLE_MESSAGE_BOUNDARY:
-                self._delayed_vote_timer = reactor.callLater(
-                    defer - _DOUBLE_MESSAGE_SECOND_CALL,
-                    self.chair_vote, user, channel,
-                    defer=_DOUBLE_MESSAGE_SECOND_CALL,
-                )
-            else:
-                self._delayed_vote_timer = reactor.callLater(
-                    defer, self.chair_vote, user, channel,
-                )
-            self.msg(channel, ' '.join((
-                'Voting in {seconds} seconds unless someone objects',
-                '(type "wait").',
-            )).format(seconds=defer))
+                warnings = (_DOUBLE_MESSAGE_SECOND_CALL,)
+            self.bot.timers.start('vote', defer, self.chair_vote, user,
+                                  channel, warnings=warnings,
+                                  on_warning=lambda seconds: self.msg(
+                                      channel, VOTING_SOON, seconds))
+            self.msg(channel, VOTING_SOON, defer)
 
             # Set the state handler so the bot actually listens to wait calls.
             self.bot.state_handler = self.handler_voting_soon
 
         else:
-            # Clear any timer that may exist now.
+            # Clear any timer that may exist now, including any countdown
+            # to this very vote.
             self.bot.clear_timer()
+            self.bot.clear_timer('vote')
 
             # Clear out the votes.
             self.current_votes = {}
@@ -266,8 +287,8 @@ class Mode(BaseMode):
         within meetings.
         """
         # If there's an active timer, just delay it.
-        if self.bot.timer and self.bot.timer.active():
-            self.bot.timer.delay(float(extend_time) * 60)
+        if self.bot.timers.active('main'):
+            self.bot.timers.delay('main', float(extend_time) * 60)
         else:
             # Clear the timer and set a new one.
             self.bot.clear_timer()
@@ -357,11 +378,14 @@ class Mode(BaseMode):
         self.chair_damage(user, channel, *damaged)
         self.chair_reject(user, channel, *rejected)
 
-        # Send the decisions to the PyCon server.
-        self.current_group.certify()
+        # Send the decisions to the PyCon server (by way of the journal,
+        # if the bot keeps one).
+        d = self.current_group.certify(journal=self.bot.journal)
+        d.addErrback(self._api_failed, channel)
 
         # Denote that certification is done.
         self.segment = 'post-certify'
+        return d
 
     def chair_accept(self, user, channel, *talk_ids):
         """Accept the talks provided as arguments."""
@@ -512,8 +536,13 @@ class Mode(BaseMode):
         """Report on the total progress of thunderdome."""
 
         # Get a full list of thunderdome groups.
-        # Iterate over it to determine how many have been decided.
-        td_groups = ThunderdomeGroup.objects.all()
+        d = ThunderdomeGroup.async_objects.all()
+        d.addCallback(self._report_progress, channel)
+        d.addErrback(self._api_failed, channel)
+        return d
+
+    def _report_progress(self, td_groups, channel):
+        # Iterate over the groups to determine how many have been decided.
         decided = 0
         total = len(td_groups)
 
@@ -640,6 +669,7 @@ class Mode(BaseMode):
         self.msg(channel, '{user}: We are currently in the silent review '
                           'period. Please be quiet.'.format(user=user))
 
+    @message_filter(VOTE_PATTERN)
     def handler_user_votes(self, user, channel, message):
         """Record a user's vote."""
 
@@ -823,3 +853,11 @@ class Mode(BaseMode):
         # now give a quick overview of bot abilities
         self.msg(user, 'You may issue me commands via. private message if '
                        'you like. Issue `help` at any time for a list.')
+
+    def log_message(self, user, channel, message):
+        """Save a transcript of debate along with every talk in the group;
+        once for the whole group, where the log target can manage it.
+        """
+        if self.current_group and self.bot.log_target is not None:
+            log_for(self.bot.log_target, sorted(self.current_group.talk_ids),
+                    user, message)
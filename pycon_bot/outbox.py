@@ -0,0 +1,168 @@
+"""
+Rate limiting for the lines the bot sends to IRC.
+
+IRC servers disconnect clients that send too much too fast, and some of
+what the bot says (reports, help listings, welcomes) comes out in bursts.
+The outbox queues outgoing lines per target and lets them out through
+a token bucket: a burst of lines can go straight away, and after that they
+go at a steady rate. Channels are served before private messages, and
+short lines still waiting to go to the same target are sent as one (unless
+the target is a service, such as NickServ, which takes one command a line).
+"""
+from collections import deque
+from pycon_bot import settings
+
+
+class OutboxStats(object):
+    """Counters for the lines that have passed through an outbox."""
+
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def latency_mean(self):
+        if not self.sent:
+            return 0.0
+        return self.latency_total / self.sent
+
+    def __repr__(self):
+        return '<OutboxStats: %d sent, %d coalesced, %.2fs mean wait>' % (
+            self.sent, self.coalesced, self.latency_mean,
+        )
+
+
+class Outbox(object):
+    """A token-bucket scheduler for outgoing IRC lines.
+
+    `send` is called with a target and a line whenever a line is let out.
+    The bucket holds up to `burst` tokens, and refills at `rate` tokens per
+    second; each line sent takes one.
+    """
+
+    def __init__(self, send, rate=None, burst=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.send = send
+        self.rate = rate or settings.IRC_SEND_RATE
+        self.burst = burst or settings.IRC_SEND_BURST
+        self.clock = clock
+        self.stats = OutboxStats()
+
+        self.tokens = float(self.burst)
+        self._refilled = self.clock.seconds()
+        self._queues = {}
+        self._order = deque()
+        self._call = None
+
+    def __repr__(self):
+        return '<Outbox: %d queued for %d targets>' % (self.depth,
+                                                       len(self._queues))
+
+    @property
+    def depth(self):
+        """The number of lines waiting to be sent."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def depths(self):
+        """Return a dictionary of the number of lines waiting for each
+        target.
+        """
+        return dict((target, len(queue))
+                    for target, queue in self._queues.items())
+
+    def put(self, target, line):
+        """Queue a line to be sent to the given target, and send whatever
+        the rate limit allows right now.
+        """
+        now = self.clock.seconds()
+        self.stats.queued += 1
+        queue = self._queues.get(target)
+        if queue is None:
+            queue = self._queues[target] = deque()
+            self._order.append(target)
+
+        # If the last line still waiting for this target is short, and
+        # this one is too, tack this one on rather than spend another
+        # token on it.
+        if queue and self._coalesce(target, queue[-1][0], line):
+            text, queued_at = queue.pop()
+            queue.append((text + settings.IRC_COALESCE_SEPARATOR + line,
+                          queued_at))
+            self.stats.coalesced += 1
+        else:
+            queue.append((line, now))
+
+        # If a send is already scheduled, the bucket is empty until then.
+        if self._call is None:
+            self._pump()
+
+    def clear(self):
+        """Drop everything still waiting to be sent."""
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._queues.clear()
+        self._order.clear()
+
+    def _coalesce(self, target, previous, line):
+        """Return True if `line` may be sent to `target` along with
+        `previous`."""
+        if target.lower() in settings.IRC_SERVICES:
+            return False
+        width = settings.IRC_COALESCE_WIDTH
+        if len(line) > width or len(previous) > width * 4:
+            return False
+        combined = len(previous) + len(settings.IRC_COALESCE_SEPARATOR)
+        return combined + len(line) <= settings.IRC_MAX_LINE
+
+    def _refill(self, now):
+        elapsed = now - self._refilled
+        self._refilled = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def _next_target(self):
+        """Return the target to send to next: the longest-waiting channel,
+        or failing that, the longest-waiting private target.
+        """
+        for target in self._order:
+            if target.startswith('#'):
+                break
+        else:
+            target = self._order[0]
+        self._order.remove(target)
+        return target
+
+    def _pump(self):
+        """Send as many lines as there are tokens for, then schedule
+        another go if anything is left.
+        """
+        self._call = None
+        now = self.clock.seconds()
+        self._refill(now)
+
+        while self._order and self.tokens >= 1:
+            target = self._next_target()
+            queue = self._queues[target]
+            line, queued_at = queue.popleft()
+
+            # Round-robin among targets: go to the back of the line.
+            if queue:
+                self._order.append(target)
+            else:
+                del self._queues[target]
+
+            self.tokens -= 1
+            wait = now - queued_at
+            self.stats.sent += 1
+            self.stats.latency_total += wait
+            self.stats.latency_max = max(self.stats.latency_max, wait)
+            self.send(target, line)
+
+        if self._order and self._call is None:
+            self._call = self.clock.callLater(
+                (1 - self.tokens) / self.rate, self._pump,
+            )
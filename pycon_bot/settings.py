@@ -4,8 +4,106 @@ import os
 WEBSITE_HOST = os.environ.get('PYCON_WEBSITE_HOST', 'us.pycon.org')
 API_KEY = os.environ.get('PYCON_API_KEY', '')
 API_SECRET = os.environ.get('PYCON_API_SECRET', '')
+API_POOL_SIZE = int(os.environ.get('PYCON_API_POOL_SIZE', 4))
+API_KEEPALIVE_SECONDS = int(os.environ.get('PYCON_API_KEEPALIVE_SECONDS', 240))
+
+# How many times to retry a request that can safely be repeated, and how
+# long (in seconds) to wait before the first retry; the wait doubles each
+# time, up to the maximum.
+API_RETRIES = int(os.environ.get('PYCON_API_RETRIES', 3))
+API_RETRY_DELAY = float(os.environ.get('PYCON_API_RETRY_DELAY', 0.5))
+API_RETRY_MAX_DELAY = float(os.environ.get('PYCON_API_RETRY_MAX_DELAY', 8))
+
+# After this many failures in a row, stop talking to the website for
+# a while (in seconds) and queue up writes instead.
+API_BREAKER_THRESHOLD = int(os.environ.get('PYCON_API_BREAKER_THRESHOLD', 5))
+API_BREAKER_RESET_SECONDS = int(os.environ.get('PYCON_API_BREAKER_RESET_SECONDS', 30))
+
+# How long (in seconds) proposals fetched from the website are trusted
+# before we ask for them again; 0 disables caching.
+PROPOSAL_CACHE_TTL = int(os.environ.get('PYCONBOT_PROPOSAL_CACHE_TTL', 300))
+
+# How many proposals to ask the website for at a time when paging.
+PROPOSAL_PAGE_SIZE = int(os.environ.get('PYCONBOT_PROPOSAL_PAGE_SIZE', 25))
+
+# How many status changes to send to the website in a single request.
+PROPOSAL_BULK_SIZE = int(os.environ.get('PYCONBOT_PROPOSAL_BULK_SIZE', 50))
+
+# Where decisions are journaled before being sent to the website (empty to
+# send them straight there), how long (in seconds) journaled writes may
+# wait to be synced to disk, and how long to wait before trying the
+# website again when it isn't taking them.
+JOURNAL_PATH = os.environ.get('PYCONBOT_JOURNAL_PATH', 'decisions.journal')
+JOURNAL_SYNC_SECONDS = float(os.environ.get('PYCONBOT_JOURNAL_SYNC_SECONDS', 0.05))
+JOURNAL_RETRY_SECONDS = int(os.environ.get('PYCONBOT_JOURNAL_RETRY_SECONDS', 15))
+
+# How long the reactor may be stuck (in seconds) before we log what it
+# was doing.
+STATS_STALL_SECONDS = float(os.environ.get('PYCONBOT_STALL_SECONDS', 0.25))
+
+# Transcripts sent to the PyCon website go in batches of at most this many
+# lines and bytes, and no line waits more than this many seconds to be
+# sent. At most this many lines are held in memory; past that, they are
+# spilled to the given file, up to its own limit, and are dropped after
+# that (or if there is no file).
+LOG_BATCH_LINES = int(os.environ.get('PYCONBOT_LOG_BATCH_LINES', 500))
+LOG_BATCH_BYTES = int(os.environ.get('PYCONBOT_LOG_BATCH_BYTES', 64 * 1024))
+LOG_BATCH_SECONDS = float(os.environ.get('PYCONBOT_LOG_BATCH_SECONDS', 10))
+LOG_BUFFER_LINES = int(os.environ.get('PYCONBOT_LOG_BUFFER_LINES', 5000))
+LOG_SPILL_PATH = os.environ.get('PYCONBOT_LOG_SPILL_PATH', 'transcript.spill')
+LOG_SPILL_LINES = int(os.environ.get('PYCONBOT_LOG_SPILL_LINES', 100000))
+
+# Whether to gzip transcripts sent to the website (which must then accept
+# gzipped request bodies), and how hard.
+LOG_COMPRESS = os.environ.get('PYCONBOT_LOG_COMPRESS', '0') == '1'
+LOG_COMPRESS_LEVEL = int(os.environ.get('PYCONBOT_LOG_COMPRESS_LEVEL', 6))
+
+# A batch the website wouldn't take is tried again after this many
+# seconds, doubling each time it fails, up to the maximum.
+LOG_RETRY_DELAY = float(os.environ.get('PYCONBOT_LOG_RETRY_DELAY', 1))
+LOG_RETRY_MAX_DELAY = float(os.environ.get('PYCONBOT_LOG_RETRY_MAX_DELAY', 60))
+
+# Whether to send transcripts to the website as well as keeping them
+# locally, and whether the website takes a line about a whole thunderdome
+# group at once (with a list of proposals), rather than once per talk.
+LOG_UPLOAD = os.environ.get('PYCONBOT_LOG_UPLOAD', '0') == '1'
+LOG_GROUPED_UPLOADS = os.environ.get('PYCONBOT_LOG_GROUPED_UPLOADS', '0') == '1'
+
+# Where transcripts are kept locally, and how big each file of them may
+# grow before the next is started.
+TRANSCRIPT_PATH = os.environ.get('PYCONBOT_TRANSCRIPT_PATH', 'transcripts')
+TRANSCRIPT_SEGMENT_BYTES = int(os.environ.get('PYCONBOT_TRANSCRIPT_SEGMENT_BYTES', 4 * 1024 * 1024))
+
+# How many lines of a talk's transcript to send to someone who asks.
+TRANSCRIPT_LINES = int(os.environ.get('PYCONBOT_TRANSCRIPT_LINES', 50))
 
 # Interaction with IRC
 IRC_SUPERUSERS = os.environ.get('PYCONBOT_SUPERUSERS', '').split(',')
 IRC_NICK = os.environ.get('PYCONBOT_NICK', 'pycon_bot')
 IRC_CHANNEL = os.environ.get('PYCONBOT_CHANNEL', '#pycon-pc')
+IRC_CHANNELS = IRC_CHANNEL.split(',')
+
+# How long (in seconds) to trust NickServ's word that a superuser is who
+# they say they are, and whether to ask the server to tell us about
+# services accounts itself (IRCv3 account-notify), where it can.
+IRC_AUTH_TTL = int(os.environ.get('PYCONBOT_AUTH_TTL', 3600))
+IRC_ACCOUNT_NOTIFY = os.environ.get('PYCONBOT_ACCOUNT_NOTIFY', '1') == '1'
+
+# How long (in seconds) to wait for NickServ to answer before asking again.
+IRC_ACC_TIMEOUT = int(os.environ.get('PYCONBOT_ACC_TIMEOUT', 30))
+
+# Flood control: how many lines may be sent to IRC in a burst, and how many
+# per second after that. Short lines waiting to go to the same place are
+# joined into one, up to the maximum line length; except for lines to
+# services, which are commands, and have to go one at a time.
+IRC_SEND_BURST = int(os.environ.get('PYCONBOT_SEND_BURST', 5))
+IRC_SEND_RATE = float(os.environ.get('PYCONBOT_SEND_RATE', 1.0))
+IRC_COALESCE_WIDTH = 80
+IRC_COALESCE_SEPARATOR = ' | '
+IRC_MAX_LINE = 400
+IRC_SERVICES = ('nickserv', 'chanserv', 'memoserv')
+
+# Reconnection: how long to wait before the first attempt to reconnect
+# after losing the server, and the most to wait between later attempts.
+IRC_RECONNECT_INITIAL_DELAY = float(os.environ.get('PYCONBOT_RECONNECT_INITIAL_DELAY', 1.0))
+IRC_RECONNECT_MAX_DELAY = float(os.environ.get('PYCONBOT_RECONNECT_MAX_DELAY', 300))
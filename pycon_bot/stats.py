@@ -0,0 +1,202 @@
+"""
+Measuring what keeps the bot busy.
+
+Everything the bot does happens on the reactor thread, so anything slow
+(a command doing too much work, a blocking call to the PyCon website)
+holds up everything else, and shows up in the channel as the bot lagging.
+The bot times its commands, state handlers and blocking API calls into
+latency histograms, and a watchdog thread notices when the reactor has
+been stuck for too long, and logs what it was stuck doing.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from pycon_bot import settings
+from twisted.python import log
+import sys
+import thread
+import threading
+import time
+import traceback
+
+# The upper bounds of the histogram buckets, in seconds: from a tenth of a
+# millisecond, doubling up to a couple of minutes. Anything longer than
+# that goes in one last bucket of its own.
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram(object):
+    """A latency histogram, with buckets that double in size; good for
+    percentiles to within a factor of two, which is plenty to tell
+    a millisecond from a second.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return '<Histogram: %d, p50 %s, p99 %s>' % (
+            self.count, format_seconds(self.percentile(50)),
+            format_seconds(self.percentile(99)),
+        )
+
+    def add(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """Return (the upper bound of the bucket holding) the given
+        percentile, or 0 if nothing has been recorded.
+        """
+        if not self.count:
+            return 0.0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max)
+        return self.max
+
+
+class Timings(object):
+    """Latency histograms, by name."""
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.histograms = {}
+
+    def __getitem__(self, name):
+        return self.histograms[name]
+
+    def __contains__(self, name):
+        return name in self.histograms
+
+    def record(self, name, seconds):
+        """Record that the named thing took `seconds` seconds."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        """Time the block run under this, as the named thing."""
+        start = self.timer()
+        try:
+            yield
+        finally:
+            self.record(name, self.timer() - start)
+
+    def slowest(self, count=5, prefix=''):
+        """Return the names and histograms of the `count` things (whose
+        names start with `prefix`) with the worst 99th percentile, or of
+        all of them if `count` is None.
+        """
+        items = [(name, histogram)
+                 for name, histogram in self.histograms.items()
+                 if name.startswith(prefix)]
+        items.sort(key=lambda item: item[1].percentile(99), reverse=True)
+        return items[:count]
+
+    def clear(self):
+        self.histograms.clear()
+
+
+class StallWatchdog(object):
+    """Notices when the reactor is stuck.
+
+    The reactor touches a heartbeat every so often; a thread of the
+    watchdog's own checks on it, and if it hasn't been touched for more
+    than `threshold` seconds, logs a sample of what the reactor thread is
+    doing (once per stall).
+    """
+
+    def __init__(self, threshold=None, clock=None, timer=time.time):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.threshold = threshold or settings.STATS_STALL_SECONDS
+        self.clock = clock
+        self.timer = timer
+        self.stalls = 0
+        self.longest = 0.0
+
+        self._beat = None
+        self._call = None
+        self._thread_id = None
+        self._stalled = False
+        self._running = False
+
+    def __repr__(self):
+        return '<StallWatchdog: %d stalls, longest %s>' % (
+            self.stalls, format_seconds(self.longest),
+        )
+
+    def start(self):
+        """Start watching the reactor; call this from the reactor thread.
+        """
+        self._thread_id = thread.get_ident()
+        self._running = True
+        self.beat()
+        watcher = threading.Thread(target=self._watch,
+                                   name='reactor watchdog')
+        watcher.daemon = True
+        watcher.start()
+
+    def stop(self):
+        self._running = False
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def beat(self):
+        """Touch the heartbeat. Called from the reactor, so only ever when
+        the reactor is free to call it.
+        """
+        now = self.timer()
+        if self._stalled:
+            # We're free again; note how long that took.
+            self.longest = max(self.longest, now - self._beat)
+            self._stalled = False
+        self._beat = now
+        if self._running:
+            self._call = self.clock.callLater(self.threshold / 4, self.beat)
+
+    def check(self):
+        """Log a stack sample if the reactor has been stuck since the last
+        heartbeat for longer than the threshold. Return True if so.
+        """
+        stuck = self.timer() - self._beat
+        if stuck <= self.threshold or self._stalled:
+            return False
+        self._stalled = True
+        self.stalls += 1
+        frame = sys._current_frames().get(self._thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else ''
+        log.msg('Reactor stalled for over %s; it was in:\n%s' % (
+            format_seconds(stuck), stack,
+        ))
+        return True
+
+    def _watch(self):
+        while self._running:
+            time.sleep(self.threshold / 2)
+            if self._running:
+                self.check()
+
+
+def format_seconds(seconds):
+    """Return a short, readable duration: '340us', '12ms', '1.5s'."""
+    if seconds < 0.001:
+        return '%dus' % round(seconds * 1000000)
+    if seconds < 1:
+        return '%dms' % round(seconds * 1000)
+    return '%.1fs' % seconds
+
+
+# The timings for the whole bot.
+timings = Timings()
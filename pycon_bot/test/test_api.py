@@ -0,0 +1,374 @@
+"""
+Tests for the PyCon website API clients.
+"""
+from hashlib import sha1
+from json import dumps, loads
+
+from pycon_bot import settings
+from pycon_bot.utils import api
+from pycon_bot.utils.exceptions import (InternalServerError,
+                                        MethodNotAllowed, NotFound,
+                                        SiteUnavailable)
+from twisted.internet import defer, error, task
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+from twisted.web.client import ResponseDone
+
+
+class AsyncAPITests(unittest.TestCase):
+    """
+    Tests for the Deferred-returning API client.
+    """
+    def setUp(self):
+        self.api = api.AsyncAPI('key', 'secret', 'example.com')
+        self.api._request = self._request
+        self.api._clock = self.clock = task.Clock()
+        self.api._random = lambda: 1.0
+        self.requests = []
+        self.response = FakeResponse(200, {'data': []})
+        api._breakers.clear()
+        self.addCleanup(api._breakers.clear)
+
+    def _request(self, method, url, data=None, headers=None, pool=None):
+        """A mock treq.request implementation for testing.
+
+        Records the request under ``self.requests`` and answers it with
+        ``self.response``.
+        """
+        self.assertIdentical(pool, api.get_pool())
+        self.requests.append((method, url, data, headers))
+        if isinstance(self.response, Exception):
+            return defer.fail(self.response)
+        return defer.succeed(self.response)
+
+    def test_get(self):
+        """GET requests fire with the decoded response body.
+        """
+        self.response = FakeResponse(200, {'data': [{'id': 1}]})
+        d = self.api.get('proposals', type='talk')
+        self.assertEqual(self.successResultOf(d), {'data': [{'id': 1}]})
+
+        method, url, data, headers = self.requests[-1]
+        self.assertEqual(method, 'GET')
+        self.assertEqual(
+            url, 'https://example.com/2015/pycon_api/proposals/?type=talk')
+        self.assertEqual(data, None)
+
+    def test_post(self):
+        """POST requests send a JSON body with a JSON content type.
+        """
+        self.api.post('proposals/1', {'status': 'accepted'})
+        method, url, data, headers = self.requests[-1]
+        self.assertEqual(method, 'POST')
+        self.assertEqual(loads(data), {'status': 'accepted'})
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_signed(self):
+        """Every request is signed, and every header value is a string.
+        """
+        self.api.get('proposals')
+        headers = self.requests[-1][3]
+        self.assertEqual(headers['X-API-Key'], 'key')
+        for key in ('X-API-Signature', 'X-API-Timestamp'):
+            self.assertIsInstance(headers[key], str)
+
+    def test_not_found(self):
+        """A 404 response errbacks with NotFound.
+        """
+        self.response = FakeResponse(404, {'error': 'Nope.'})
+        failure = self.failureResultOf(self.api.get('proposals/1'))
+        failure.trap(NotFound)
+        self.assertEqual(failure.value.args, ('Nope.',))
+
+    def test_method_not_allowed(self):
+        """A 405 response errbacks with MethodNotAllowed.
+        """
+        self.response = FakeResponse(405, {'error': 'No.'})
+        d = self.api.post('proposals/bulk', {})
+        self.failureResultOf(d).trap(MethodNotAllowed)
+
+    def test_server_error(self):
+        """A 5xx response errbacks with InternalServerError, once every
+        retry has been used up.
+        """
+        self.response = FakeResponse(503, 'Service Unavailable')
+        d = self.api.get('proposals')
+        self.clock.pump([settings.API_RETRY_MAX_DELAY] * settings.API_RETRIES)
+        self.failureResultOf(d).trap(InternalServerError)
+        self.assertEqual(len(self.requests), settings.API_RETRIES + 1)
+
+    def test_retry(self):
+        """A GET that fails is tried again after a growing delay.
+        """
+        self.response = error.ConnectionRefusedError()
+        d = self.api.get('proposals')
+        self.assertNoResult(d)
+        self.assertEqual(len(self.requests), 1)
+
+        self.clock.advance(settings.API_RETRY_DELAY)
+        self.assertEqual(len(self.requests), 2)
+        self.clock.advance(settings.API_RETRY_DELAY)
+        self.assertEqual(len(self.requests), 2)
+
+        self.response = FakeResponse(200, {'data': []})
+        self.clock.advance(settings.API_RETRY_DELAY)
+        self.assertEqual(self.successResultOf(d), {'data': []})
+        self.assertEqual(len(self.requests), 3)
+
+    def test_no_retry_post(self):
+        """A POST is only retried if the caller says it is idempotent.
+        """
+        self.response = FakeResponse(500, 'Oops')
+        d = self.api.post('proposals/1', {'status': 'accepted'})
+        self.failureResultOf(d).trap(InternalServerError)
+        self.assertEqual(len(self.requests), 1)
+
+        d = self.api.post('proposals/1', {'status': 'accepted'},
+                          idempotent=True)
+        self.assertNoResult(d)
+        self.response = FakeResponse(200, {})
+        self.clock.advance(settings.API_RETRY_DELAY)
+        self.assertEqual(self.successResultOf(d), {})
+
+    def test_no_retry_client_error(self):
+        """Client errors are not retried, and don't count against the site.
+        """
+        self.response = FakeResponse(404, {'error': 'Nope.'})
+        for i in range(settings.API_BREAKER_THRESHOLD):
+            self.failureResultOf(self.api.get('proposals/1')).trap(NotFound)
+        self.assertEqual(len(self.requests), settings.API_BREAKER_THRESHOLD)
+        self.assertEqual(api.get_breaker('example.com').state, 'closed')
+
+    def test_breaker_opens(self):
+        """Once the site has failed enough times, requests fail fast.
+        """
+        self.response = FakeResponse(502, 'Bad Gateway')
+        for i in range(settings.API_BREAKER_THRESHOLD):
+            self.failureResultOf(self.api.post('proposals/1', {}))
+        self.assertEqual(api.get_breaker('example.com').state, 'open')
+
+        sent = len(self.requests)
+        self.failureResultOf(self.api.get('proposals')).trap(SiteUnavailable)
+        self.assertEqual(len(self.requests), sent)
+
+    def test_breaker_stops_retries(self):
+        """Retries stop as soon as the breaker opens.
+        """
+        self.response = FakeResponse(503, 'Service Unavailable')
+        breaker = api.get_breaker('example.com')
+        breaker.failures = settings.API_BREAKER_THRESHOLD - 1
+        d = self.api.get('proposals')
+        self.failureResultOf(d).trap(InternalServerError)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_queued_writes(self):
+        """Writes refused while the breaker is open are replayed, in
+        order, once the site is back.
+        """
+        breaker = api.get_breaker('example.com')
+        breaker.clock = self.clock.seconds
+        self.response = FakeResponse(500, 'Oops')
+        for i in range(settings.API_BREAKER_THRESHOLD):
+            self.api.post('proposals/1', {}).addErrback(lambda f: None)
+        del self.requests[:]
+
+        first = self.api.post('proposals/1', {'status': 'accepted'})
+        second = self.api.post('proposals/2', {'status': 'rejected'})
+        self.assertNoResult(first)
+        self.assertEqual(self.requests, [])
+
+        # The first request after the reset period is let through; when
+        # it works, the queued writes follow it.
+        self.response = FakeResponse(200, {})
+        self.clock.advance(settings.API_BREAKER_RESET_SECONDS)
+        self.successResultOf(self.api.get('proposals'))
+        self.assertEqual(self.successResultOf(first), {})
+        self.assertEqual(self.successResultOf(second), {})
+        self.assertEqual(
+            [(method, loads(data or 'null')) for method, _, data, _ in
+             self.requests],
+            [('GET', None), ('POST', {'status': 'accepted'}),
+             ('POST', {'status': 'rejected'})],
+        )
+
+    def test_half_open_failure(self):
+        """If the trial request after the reset period fails, the breaker
+        opens again straight away.
+        """
+        breaker = api.get_breaker('example.com')
+        breaker.clock = self.clock.seconds
+        breaker.state, breaker.opened_at = 'open', 0
+        self.clock.advance(settings.API_BREAKER_RESET_SECONDS)
+
+        self.response = FakeResponse(503, 'Service Unavailable')
+        self.failureResultOf(self.api.get('proposals'))
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(breaker.state, 'open')
+        self.failureResultOf(self.api.get('proposals')).trap(SiteUnavailable)
+
+
+    def test_half_open_unexpected(self):
+        """If the trial request fails in a way we wouldn't retry (say, the
+        site sends a page that isn't JSON), the breaker opens again
+        rather than staying half-open.
+        """
+        breaker = api.get_breaker('example.com')
+        breaker.clock = self.clock.seconds
+        breaker.state, breaker.opened_at = 'open', 0
+        self.clock.advance(settings.API_BREAKER_RESET_SECONDS)
+
+        self.response = FakeResponse(200, '<html>Back soon</html>')
+        self.failureResultOf(self.api.get('proposals')).trap(ValueError)
+        self.assertEqual(breaker.state, 'open')
+
+        self.response = FakeResponse(200, {'data': []})
+        self.clock.advance(settings.API_BREAKER_RESET_SECONDS)
+        self.successResultOf(self.api.get('proposals'))
+        self.assertEqual(breaker.state, 'closed')
+
+
+class SigningTests(unittest.TestCase):
+    """
+    Tests for request signatures.
+    """
+    def setUp(self):
+        self.api = api.API('key', u'secret', 'example.com')
+        self.api._time = lambda: 1400000000.5
+
+    def test_signature(self):
+        """The signature is the SHA1 of the secret, timestamp, method, URI
+        and body.
+        """
+        headers = self.api._sign_request(u'/2015/pycon_api/proposals/',
+                                         'post', '{"a": 1}')
+        expected = sha1('secret1400000000POST/2015/pycon_api/proposals/'
+                        '{"a": 1}').hexdigest()
+        self.assertEqual(headers['X-API-Signature'], expected)
+        self.assertEqual(headers['X-API-Timestamp'], '1400000000')
+
+    def test_secret_changed(self):
+        """Changing the secret changes the signature.
+        """
+        before = self.api._sign_request('/', 'GET')
+        self.api.api_secret = 'other'
+        after = self.api._sign_request('/', 'GET')
+        self.assertNotEqual(before['X-API-Signature'],
+                            after['X-API-Signature'])
+        self.assertEqual(after['X-API-Signature'],
+                         sha1('other1400000000GET/').hexdigest())
+
+
+class BlockingRetryTests(unittest.TestCase):
+    """
+    Tests for retries in the blocking API client.
+    """
+    def setUp(self):
+        self.api = api.API('key', 'secret', 'example.com')
+        self.sleeps = []
+        self.api._send = self._send
+        self.api._sleep = self.sleeps.append
+        self.api._random = lambda: 1.0
+        self.outcomes = []
+        api._breakers.clear()
+        self.addCleanup(api._breakers.clear)
+
+    def _send(self, method, endpoint, body, params):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def test_backoff(self):
+        """Failed GETs are retried after exponentially growing sleeps.
+        """
+        self.outcomes = [InternalServerError(None)] * 3 + [{'data': []}]
+        self.assertEqual(self.api.get('proposals'), {'data': []})
+        delay = settings.API_RETRY_DELAY
+        self.assertEqual(self.sleeps, [delay, delay * 2, delay * 4])
+
+    def test_half_open_unexpected(self):
+        """A trial request that fails in a way we wouldn't retry opens
+        the breaker again.
+        """
+        breaker = api.get_breaker('example.com')
+        breaker.state = 'open'
+        breaker.opened_at = (breaker.clock() -
+                             settings.API_BREAKER_RESET_SECONDS)
+        self.outcomes = [ValueError('No JSON object could be decoded')]
+        self.assertRaises(ValueError, self.api.get, 'proposals')
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(self.sleeps, [])
+
+    def test_queued_write(self):
+        """A write refused by the open breaker raises, and is sent once
+        the site is back.
+        """
+        breaker = api.get_breaker('example.com')
+        breaker.state, breaker.opened_at = 'open', breaker.clock()
+        ex = self.assertRaises(SiteUnavailable, self.api.post,
+                               'proposals/1', {'status': 'accepted'})
+        self.assertTrue(ex.queued)
+
+        self.outcomes = [{'data': []}, {}]
+        breaker.opened_at -= settings.API_BREAKER_RESET_SECONDS
+        self.api.get('proposals')
+        self.assertEqual(self.outcomes, [])
+        self.assertEqual(breaker.pending, [])
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    """
+    Tests for the process-wide connection pools.
+    """
+    def test_shared(self):
+        """Every client shares one session and one Twisted pool.
+        """
+        self.assertIdentical(api.get_session(), api.get_session())
+        self.assertIdentical(api.get_pool(), api.get_pool())
+
+    def test_pool_counts(self):
+        """The Twisted pool counts connections opened and reused.
+        """
+        stats = api.ConnectionStats()
+        pool = api.CountingConnectionPool(None, stats)
+        endpoint = FakeEndpoint()
+        pool.getConnection('key', endpoint)
+        self.assertEqual((stats.opened, stats.reused), (1, 0))
+
+        connection = FakeConnection()
+        pool._connections['key'] = [connection]
+        pool._timeouts[connection] = FakeDelayedCall()
+        pool.getConnection('key', endpoint)
+        self.assertEqual((stats.opened, stats.reused), (1, 1))
+        self.assertEqual(endpoint.connects, 1)
+
+
+class FakeEndpoint(object):
+    def __init__(self):
+        self.connects = 0
+
+    def connect(self, factory):
+        self.connects += 1
+        return defer.Deferred()
+
+
+class FakeConnection(object):
+    state = 'QUIESCENT'
+
+
+class FakeDelayedCall(object):
+    def cancel(self):
+        pass
+
+
+class FakeResponse(object):
+    """Just enough of IResponse for treq.content to read a body."""
+
+    def __init__(self, code, body):
+        self.code = code
+        self._body = body if isinstance(body, str) else dumps(body)
+        self.length = len(self._body)
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self._body)
+        protocol.connectionLost(Failure(ResponseDone()))
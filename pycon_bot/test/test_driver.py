@@ -0,0 +1,462 @@
+"""
+Tests for the IRC bot driver.
+"""
+from pycon_bot import settings
+from pycon_bot.driver import PyConBotFactory
+from pycon_bot.modes.base import message_filter
+from pycon_bot.outbox import Outbox
+from pycon_bot.stats import Timings
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+
+class RosterTests(unittest.TestCase):
+    """
+    Tests for the bot's record of who is in each channel.
+    """
+    def setUp(self):
+        factory = PyConBotFactory(['#pc'], 'bot')
+        self.bot = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.bot.makeConnection(self.transport)
+        self.addCleanup(self.bot.outbox.clear)
+        self.receive(':bot!b@host JOIN #PC')
+        self.receive(':server 353 bot = #pc :bot @alice +bob')
+        self.receive(':server 366 bot #pc :End of /NAMES list.')
+        self.transport.clear()
+
+    def receive(self, line):
+        self.bot.lineReceived(line)
+
+    def names(self, channel='#pc'):
+        return self.successResultOf(self.bot.names(channel))
+
+    def test_seeded_on_join(self):
+        """The names sent when we join seed the roster, and asking for
+        names after that doesn't go to the server.
+        """
+        self.assertEqual(self.names(), ['alice', 'bob', 'bot'])
+        self.assertEqual(self.names('#PC'), ['alice', 'bob', 'bot'])
+        self.assertNotIn('NAMES', self.transport.value())
+
+    def test_not_seeded(self):
+        """For a channel we know nothing about, we ask the server, once.
+        """
+        first = self.bot.names('#other')
+        second = self.bot.names('#other')
+        self.assertEqual(self.transport.value(), 'NAMES #other\r\n')
+        self.assertNoResult(first)
+
+        self.receive(':server 353 bot = #other :carol')
+        self.receive(':server 366 bot #other :End of /NAMES list.')
+        self.assertEqual(self.successResultOf(first), ['carol'])
+        self.assertEqual(self.successResultOf(second), ['carol'])
+
+    def test_join_part(self):
+        """Users joining and leaving are added and removed.
+        """
+        self.receive(':carol!c@host JOIN #pc')
+        self.receive(':alice!a@host PART #pc :bye')
+        self.assertEqual(self.names(), ['bob', 'bot', 'carol'])
+
+    def test_quit(self):
+        """Users who quit are removed from every channel.
+        """
+        self.receive(':bob!b@host QUIT :gone')
+        self.assertEqual(self.names(), ['alice', 'bot'])
+
+    def test_kick(self):
+        """Users who are kicked are removed.
+        """
+        self.receive(':alice!a@host KICK #pc bob :out')
+        self.assertEqual(self.names(), ['alice', 'bot'])
+
+    def test_nick(self):
+        """Users who change nick are renamed, including the bot.
+        """
+        self.receive(':alice!a@host NICK alicia')
+        self.receive(':bot!b@host NICK pycon_bot')
+        self.assertEqual(self.names(), ['alicia', 'bob', 'pycon_bot'])
+        self.assertEqual(self.bot.nickname, 'pycon_bot')
+
+    def test_left(self):
+        """Once we leave a channel, we forget its roster.
+        """
+        self.receive(':bot!b@host PART #pc')
+        self.bot.names('#pc')
+        self.assertEqual(self.transport.value(), 'NAMES #pc\r\n')
+
+
+class AuthTests(unittest.TestCase):
+    """
+    Tests for checking superusers with NickServ.
+    """
+    def setUp(self):
+        factory = PyConBotFactory(['#pc'], 'bot')
+        self.bot = factory.buildProtocol(None)
+        self.bot.clock = self.clock = task.Clock()
+        self.bot.potential_superusers = ['alice', 'bob']
+        self.bot.context('#pc').mode = self.mode = FakeMode()
+        self.transport = StringTransport()
+        self.bot.makeConnection(self.transport)
+        self.addCleanup(self.bot.outbox.clear)
+        self.transport.clear()
+
+    def receive(self, line):
+        self.bot.lineReceived(line)
+
+    def acc(self, username, status='3'):
+        self.receive(':NickServ!ns@services NOTICE bot :%s ACC %s' % (
+            username, status,
+        ))
+
+    def sent(self):
+        lines = self.transport.value().splitlines()
+        self.transport.clear()
+        return lines
+
+    def test_check_auth(self):
+        """Every potential superuser is asked about, and those NickServ
+        vouches for become superusers.
+        """
+        self.bot.check_auth()
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC alice',
+                                       'PRIVMSG NickServ :ACC bob'])
+        self.acc('alice')
+        self.acc('bob', '1')
+        self.assertEqual(self.bot.superusers, set(['alice']))
+
+    def test_more_than_a_burst(self):
+        """Superusers past the outbox's burst are still asked about, each
+        in a command of their own.
+        """
+        names = ['alice', 'bob', 'carol', 'dave', 'eve', 'frank']
+        self.bot.potential_superusers = names
+        self.bot.outbox = Outbox(self.bot._send_line, rate=1.0, burst=2,
+                                 clock=self.clock)
+        self.bot.check_auth()
+        self.assertEqual(len(self.sent()), 2)
+        self.clock.pump([1] * 4)
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC %s' % name
+                                       for name in names[2:]])
+        for name in names:
+            self.acc(name)
+        self.assertEqual(self.bot.superusers, set(names))
+
+    def test_deduplicated(self):
+        """Nobody is asked about twice while we wait to hear back, nor
+        again once verified, until the verification expires.
+        """
+        self.bot.check_auth()
+        self.bot.check_auth()
+        self.assertEqual(len(self.sent()), 2)
+
+        self.acc('alice')
+        self.acc('bob')
+        self.bot.check_auth()
+        self.assertEqual(self.sent(), [])
+
+        self.clock.advance(settings.IRC_AUTH_TTL)
+        self.bot.check_auth()
+        self.assertEqual(len(self.sent()), 2)
+
+    def test_unanswered(self):
+        """If NickServ doesn't answer in time, we ask again, and commands
+        held in the meantime are forgotten.
+        """
+        self.bot.check_auth()
+        self.acc('alice')
+        self.clock.advance(settings.IRC_AUTH_TTL)
+        self.sent()
+
+        self.receive(':alice!a@host PRIVMSG #pc :,next 1')
+        self.bot.check_auth(['alice'])
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC alice'])
+
+        self.clock.advance(settings.IRC_ACC_TIMEOUT)
+        self.receive(':alice!a@host PRIVMSG #pc :,next 2')
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC alice'])
+        self.acc('alice')
+        self.assertEqual(self.mode.commands,
+                         [('next', 'chair', 'alice', '#pc', ('2',))])
+
+    def test_case(self):
+        """NickServ's answer counts even if it spells the nick in another
+        case.
+        """
+        self.bot.check_auth(['alice'])
+        self.acc('ALICE')
+        self.assertEqual(self.bot.superusers, set(['alice']))
+        self.assertEqual(self.bot._acc_pending, {})
+
+    def test_join(self):
+        """Only the superuser who joins is asked about.
+        """
+        self.receive(':bob!b@host JOIN #pc')
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC bob'])
+
+    def test_commands(self):
+        """Commands from verified superusers are run; others are ignored.
+        """
+        self.bot.check_auth()
+        self.acc('alice')
+        self.receive(':alice!a@host PRIVMSG #pc :,next 3')
+        self.receive(':bob!b@host PRIVMSG #pc :,next 4')
+        self.assertEqual(self.mode.commands,
+                         [('next', 'chair', 'alice', '#pc', ('3',))])
+
+    def test_expired(self):
+        """A command from a superuser whose verification has expired is
+        run once NickServ vouches for them again.
+        """
+        self.bot.check_auth()
+        self.acc('alice')
+        self.clock.advance(settings.IRC_AUTH_TTL)
+        self.sent()
+
+        self.receive(':alice!a@host PRIVMSG #pc :,next')
+        self.assertEqual(self.mode.commands, [])
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC alice'])
+        self.acc('alice')
+        self.assertEqual(self.mode.commands,
+                         [('next', 'chair', 'alice', '#pc', ())])
+
+    def test_quit_and_nick(self):
+        """Superusers who quit or change nick are no longer trusted, and
+        whoever takes a superuser's nick is checked.
+        """
+        self.bot.check_auth()
+        self.acc('alice')
+        self.acc('bob')
+        self.sent()
+        self.receive(':alice!a@host QUIT :bye')
+        self.receive(':bob!b@host NICK bobby')
+        self.assertEqual(self.bot.superusers, set())
+
+        self.receive(':mallory!m@host NICK alice')
+        self.assertEqual(self.sent(), ['PRIVMSG NickServ :ACC alice'])
+
+    def test_renamed(self):
+        """After the server renames us, NickServ's answers to our new nick
+        still count, and we're in the roster under it.
+        """
+        self.addCleanup(self.bot.stopHeartbeat)
+        self.receive(':server 001 bot :Welcome')
+        self.receive(':bot!b@host JOIN #pc')
+        self.receive(':server 353 bot = #pc :bot alice')
+        self.receive(':server 366 bot #pc :End of /NAMES list.')
+        self.receive(':bot!b@host NICK bot_')
+        self.assertEqual(self.bot.nickname, 'bot_')
+        self.assertEqual(self.successResultOf(self.bot.names('#pc')),
+                         ['alice', 'bot_'])
+
+        self.bot.check_auth(['alice'])
+        self.receive(':NickServ!ns@services NOTICE bot_ :alice ACC 3')
+        self.assertEqual(self.bot.superusers, set(['alice']))
+
+    def test_account_notify(self):
+        """Where the server tells us about accounts, we believe it, and
+        don't ask NickServ.
+        """
+        self.receive(':server CAP bot ACK :account-notify extended-join')
+        self.receive(':alice!a@host JOIN #pc alice :Alice')
+        self.receive(':carol!c@host JOIN #pc bob :Bob')
+        self.assertEqual(self.bot.superusers, set(['alice', 'carol']))
+        self.assertEqual(self.sent(), [])
+
+        self.receive(':carol!c@host ACCOUNT *')
+        self.clock.advance(settings.IRC_AUTH_TTL)
+        self.assertEqual(self.bot.superusers, set(['alice']))
+        self.assertTrue(self.bot.is_superuser('alice'))
+
+
+class ChannelContextTests(unittest.TestCase):
+    """
+    Tests for running a separate meeting in each channel.
+    """
+    def setUp(self):
+        factory = PyConBotFactory(['#pc', '#sub'], 'bot')
+        self.bot = factory.buildProtocol(None)
+        self.bot.clock = self.clock = task.Clock()
+        self.bot.makeConnection(StringTransport())
+        self.addCleanup(self.bot.outbox.clear)
+        self.bot.superusers.add('alice')
+        self.bot._verified['alice'] = float('inf')
+        self.pc = self.bot.context('#pc')
+        self.sub = self.bot.context('#SUB')
+        self.pc.mode, self.sub.mode = FakeMode(), FakeMode()
+
+    def receive(self, line):
+        self.bot.lineReceived(line)
+
+    def test_context(self):
+        """Each channel has one context, which passes anything it doesn't
+        hold itself through to the bot.
+        """
+        self.assertIdentical(self.bot.context('#Sub'), self.sub)
+        self.assertEqual(self.sub.channel, '#SUB')
+        self.assertEqual(self.sub.nickname, 'bot')
+        self.assertIdentical(self.sub.superusers, self.bot.superusers)
+
+    def test_commands(self):
+        """Chair commands go to the mode for their channel.
+        """
+        self.receive(':alice!a@host PRIVMSG #pc :,next')
+        self.receive(':alice!a@host PRIVMSG #sub :,vote')
+        self.assertEqual([c[0] for c in self.pc.mode.commands], ['next'])
+        self.assertEqual([c[0] for c in self.sub.mode.commands], ['vote'])
+
+    def test_state_handlers(self):
+        """Each channel has its own state handler.
+        """
+        seen = []
+        self.sub.state_handler = lambda *args: seen.append(args)
+        self.receive(':bob!b@host PRIVMSG #pc :Yes')
+        self.receive(':bob!b@host PRIVMSG #sub :No')
+        self.assertEqual(seen, [('bob', '#sub', 'no')])
+
+    def test_message_filter(self):
+        """Lines a state handler's message filter turns away never reach
+        it, and are counted apart from the ones that do.
+        """
+        seen = []
+
+        @message_filter(r'\d', prefixes=('all',))
+        def handler(*args):
+            seen.append(args)
+
+        self.pc.state_handler = handler
+        for line in ('3, 4', 'what is going on', 'ALL -4', 'me too'):
+            self.receive(':bob!b@host PRIVMSG #pc :' + line)
+        self.assertEqual([args[2] for args in seen], ['3, 4', 'all -4'])
+        self.assertEqual(self.bot.dispatch_stats,
+                         {'handled': 2, 'filtered': 2})
+
+    def test_timed(self):
+        """Commands and state handlers are timed.
+        """
+        self.bot.timings = Timings()
+        self.pc.state_handler = lambda *args: None
+        self.receive(':alice!a@host PRIVMSG #pc :,next')
+        self.receive(':alice!a@host PRIVMSG bot :agenda')
+        self.receive(':bob!b@host PRIVMSG #pc :aye')
+        self.assertEqual(sorted(self.bot.timings.histograms),
+                         ['chair ,next', 'handler <lambda>', 'private agenda'])
+
+    def test_timers(self):
+        """Setting a timer in one channel leaves the others' alone.
+        """
+        self.pc.set_timer('#pc', 60)
+        self.sub.set_timer('#sub', 60)
+        self.sub.clear_timer()
+        self.assertTrue(self.pc.timers.active('main'))
+        self.assertFalse(self.sub.timers.active('main'))
+
+    def test_timer_messages(self):
+        """Timers say how long is left when asked to, and when time is up.
+        """
+        said = []
+        self.bot.msg = lambda channel, message: said.append(message)
+        self.pc.set_timer('#pc', 120, warnings=(60, 30))
+        self.clock.pump([30] * 4)
+        self.assertEqual(said, ['=== 1 minute left ===',
+                                '=== 30 seconds left ===',
+                                '=== Time has ended. ==='])
+
+    def test_private(self):
+        """Private commands go to the channel named in them, or else the
+        first channel the user is in.
+        """
+        self.bot.rosters['#sub'] = set(['bob'])
+        self.receive(':bob!b@host PRIVMSG bot :agenda')
+        self.receive(':bob!b@host PRIVMSG bot :agenda #pc 5')
+        self.receive(':carol!c@host PRIVMSG bot :agenda')
+        self.receive(':carol!c@host PRIVMSG bot :transcript #5')
+        self.assertEqual(self.sub.mode.commands,
+                         [('agenda', 'private', 'bob', 'bot', ())])
+        self.assertEqual(self.pc.mode.commands, [
+            ('agenda', 'private', 'bob', 'bot', ('5',)),
+            ('agenda', 'private', 'carol', 'bot', ()),
+            ('transcript', 'private', 'carol', 'bot', ('#5',)),
+        ])
+        self.assertNotIn('#5', self.bot.contexts)
+
+
+class ReconnectTests(unittest.TestCase):
+    """
+    Tests for carrying on after the connection to the server is lost.
+    """
+    def setUp(self):
+        self.factory = PyConBotFactory(['#pc'], 'bot')
+        self.factory.clock = self.clock = task.Clock()
+        self.factory.jitter = 0
+        self.bot = self.connect()
+
+    def connect(self):
+        bot = self.factory.buildProtocol(None)
+        bot.clock = self.clock
+        bot.makeConnection(StringTransport())
+        self.addCleanup(bot.outbox.clear)
+        self.addCleanup(bot.stopHeartbeat)
+        return bot
+
+    def test_backoff(self):
+        """Failed attempts to connect are retried less and less often,
+        until we're back on.
+        """
+        connector = FakeConnector()
+        for _ in range(3):
+            self.factory.clientConnectionFailed(connector, None)
+            self.clock.advance(self.factory.delay)
+        self.assertEqual(connector.attempts, 3)
+        self.assertTrue(self.factory.delay >
+                        settings.IRC_RECONNECT_INITIAL_DELAY)
+
+        self.bot.lineReceived(':server 001 bot :Welcome')
+        self.assertEqual(self.factory.delay,
+                         settings.IRC_RECONNECT_INITIAL_DELAY)
+
+    def test_resume(self):
+        """The meeting in each channel carries on over a new connection,
+        with its timers stopped while we were away.
+        """
+        context = self.bot.context('#pc')
+        context.mode = FakeMode()
+        context.set_timer('#pc', 60)
+        context.set_timer('#pc', 60, name='vote')
+        context.timers.pause('vote')
+        self.bot.superusers.add('alice')
+        self.clock.advance(20)
+        self.bot.connectionLost(None)
+        self.clock.advance(300)
+
+        bot = self.connect()
+        self.assertIdentical(bot.context('#pc'), context)
+        self.assertIdentical(context.client, bot)
+        self.assertIn('alice', bot.superusers)
+        self.assertEqual(context.timers.remaining('main'), 40)
+
+        said = []
+        bot.msg = lambda channel, message: said.append(message)
+        bot.lineReceived(':bot!b@host JOIN #pc')
+        self.assertIn('Picking up where we left off', said[0])
+        self.clock.advance(40)
+        self.assertEqual(said[-1], '=== Time has ended. ===')
+        self.assertEqual(context.timers.remaining('vote'), 60)
+
+
+class FakeConnector(object):
+    def __init__(self):
+        self.attempts = 0
+
+    def connect(self):
+        self.attempts += 1
+
+
+class FakeMode(object):
+    def __init__(self):
+        self.commands = []
+
+    def exec_command(self, command, command_type, user, channel, *args):
+        self.commands.append((command, command_type, user, channel, args))
@@ -0,0 +1,163 @@
+"""
+Tests for the decision journal.
+"""
+from json import loads
+
+from pycon_bot import settings
+from pycon_bot.journal import Journal
+from pycon_bot.utils.exceptions import (AuthenticationError,
+                                        InternalServerError, NotFound,
+                                        SiteUnavailable)
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+
+
+class JournalTests(unittest.TestCase):
+    """
+    Tests for the write-ahead journal of writes to the PyCon site.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = task.Clock()
+        self.api = FakeAPI()
+        self.journal = self.open()
+
+    def open(self):
+        journal = Journal(self.path, self.api, self.clock)
+        self.addCleanup(lambda: journal._file.closed or journal.close())
+        return journal
+
+    def records(self):
+        """Return the records in the journal file."""
+        self.journal._file.flush()
+        with open(self.path) as journal:
+            return [loads(line) for line in journal]
+
+    def test_synced_in_batches(self):
+        """Writes are synced to disk together, after which their Deferreds
+        fire with their sequence numbers.
+        """
+        first = self.journal.post('proposals/1', {'status': 'accepted'})
+        second = self.journal.post('proposals/2', {'status': 'rejected'})
+        self.assertNoResult(first)
+        self.assertEqual(self.api.posts, [])
+
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.assertEqual(self.successResultOf(first), 1)
+        self.assertEqual(self.successResultOf(second), 2)
+        self.assertEqual([r['seq'] for r in self.records()], [1, 2])
+
+    def test_drained_in_order(self):
+        """Writes are sent to the site one at a time, oldest first, and
+        acknowledged in the journal once the site takes them.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.journal.post('proposals/2', {'status': 'rejected'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.assertEqual(self.api.posts, [('proposals/1', True)])
+
+        self.api.respond({})
+        self.assertEqual(self.api.posts, [('proposals/1', True),
+                                          ('proposals/2', True)])
+        self.assertIn({'ack': 1}, self.records())
+        self.assertEqual([r['seq'] for r in self.journal.pending], [2])
+
+    def test_compacted(self):
+        """Once everything has been sent, the journal file is emptied.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.api.respond({})
+        self.assertEqual(self.records(), [])
+
+        self.journal.post('proposals/2', {'status': 'accepted'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.assertEqual([r['seq'] for r in self.records()], [2])
+
+    def test_site_down(self):
+        """If the site is down, the write is kept and tried again later.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.api.fail(SiteUnavailable('example.com'))
+        self.assertEqual(len(self.journal.pending), 1)
+
+        self.clock.advance(settings.JOURNAL_RETRY_SECONDS)
+        self.assertEqual(len(self.api.posts), 2)
+        self.api.respond({})
+        self.assertEqual(self.journal.pending, [])
+
+    def test_refused(self):
+        """A write the site refuses outright is dropped, rather than
+        holding up everything behind it.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.journal.post('proposals/2', {'status': 'accepted'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.api.fail(NotFound('No such proposal.'))
+        self.assertEqual(len(self.flushLoggedErrors(NotFound)), 1)
+        self.assertEqual([r['seq'] for r in self.journal.pending], [2])
+
+    def test_not_authenticated(self):
+        """A write the site wouldn't authenticate, or failed on, is kept
+        and tried again later.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.api.fail(AuthenticationError('Bad signature.'))
+        self.clock.advance(settings.JOURNAL_RETRY_SECONDS)
+        self.api.fail(InternalServerError(None))
+        self.assertEqual(len(self.journal.pending), 1)
+
+        self.clock.advance(settings.JOURNAL_RETRY_SECONDS)
+        self.assertEqual(len(self.api.posts), 3)
+        self.api.respond({})
+        self.assertEqual(self.journal.pending, [])
+
+    def test_reopen(self):
+        """Writes not yet acknowledged when the bot went down are sent when
+        the journal is next opened; acknowledged ones are not.
+        """
+        self.journal.post('proposals/1', {'status': 'accepted'})
+        self.journal.post('proposals/2', {'status': 'rejected'})
+        self.clock.advance(settings.JOURNAL_SYNC_SECONDS)
+        self.api.respond({})
+        self.journal.close()
+
+        # The last line was cut short as we went down.
+        with open(self.path, 'a') as journal:
+            journal.write('{"seq": 3, "endp')
+
+        self.api = FakeAPI()
+        self.journal = self.open()
+        self.assertEqual([(r['seq'], r['endpoint'])
+                          for r in self.journal.pending],
+                         [(2, 'proposals/2')])
+        self.journal.drain()
+        self.assertEqual(self.api.posts, [('proposals/2', True)])
+
+        # New writes carry on from the highest sequence number seen.
+        self.journal.post('proposals/4', {'status': 'accepted'})
+        self.assertEqual(self.journal.pending[-1]['seq'], 3)
+
+
+class FakeAPI(object):
+    """An API whose posts are answered by hand."""
+    returns_deferreds = True
+
+    def __init__(self):
+        self.posts = []
+        self._deferreds = []
+
+    def post(self, endpoint, body, idempotent=False):
+        self.posts.append((endpoint, idempotent))
+        d = defer.Deferred()
+        self._deferreds.append(d)
+        return d
+
+    def respond(self, result):
+        self._deferreds.pop(0).callback(result)
+
+    def fail(self, exception):
+        self._deferreds.pop(0).errback(Failure(exception))
@@ -3,11 +3,14 @@ Tests for IRC bot logging.
 """
 from datetime import datetime, timedelta
 from json import dumps, loads
+import os
+import zlib
 
-from pycon_bot import log
+from pycon_bot import log, settings
 from treq import post
 from twisted.internet import defer, task
 from twisted.trial import unittest
+from zope import interface
 from zope.interface import verify
 
 class PyConSiteLogTargetTests(unittest.TestCase):
@@ -15,7 +18,8 @@ class PyConSiteLogTargetTests(unittest.TestCase):
     Tests for a log target that targets the PyCon site.
     """
     def setUp(self):
-        self.target = log.PyConSiteLogTarget("host", "key")
+        self.target = log.PyConSiteLogTarget("host", "key",
+                                             spill_path=self.mktemp())
 
         self.target._utcnow = self._utcnow
         self._dates = dates()
@@ -29,7 +33,7 @@ class PyConSiteLogTargetTests(unittest.TestCase):
         """
         return next(self._dates)
 
-    def _post(self, url, body):
+    def _post(self, url, body, headers=None):
         """A mock post implementation for testing.
 
         Asserts that the URL is the target's URL. Keeps track of the
@@ -48,6 +52,16 @@ class PyConSiteLogTargetTests(unittest.TestCase):
         self.assertEqual(log.PyConSiteLogTarget._utcnow, datetime.utcnow)
         self.assertIdentical(log.PyConSiteLogTarget._post, post)
 
+    def test_no_spill(self):
+        """Spilling can be turned off; by default, it's to the configured
+        file.
+        """
+        self.patch(settings, "LOG_SPILL_PATH", self.mktemp())
+        self.assertEqual(log.PyConSiteLogTarget("host", "key").spill_path,
+                         settings.LOG_SPILL_PATH)
+        target = log.PyConSiteLogTarget("host", "key", spill_path=None)
+        self.assertIdentical(target.spill_path, None)
+
     def test_url(self):
         """The log target determines the correct URL.
         """
@@ -105,6 +119,264 @@ class PyConSiteLogTargetTests(unittest.TestCase):
         self.assertEqual(self.successResultOf(d), None)
 
 
+class BatchingTests(unittest.TestCase):
+    """
+    Tests for how the PyCon site log target batches what it sends.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.spill_path = self.mktemp()
+        self.target = log.PyConSiteLogTarget(
+            "host", "key", max_lines=3, max_bytes=1000, max_age=10,
+            max_buffered=5, spill_path=self.spill_path, _clock=self.clock,
+        )
+        self.target._utcnow = lambda: EPOCH
+        self.target._post = self._post
+        self.posts = []
+
+    def _post(self, url, body, headers=None):
+        if headers.get("Content-Encoding") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        d = defer.Deferred()
+        self.posts.append((loads(body), d))
+        return d
+
+    def lines(self, index):
+        return [entry[u'line'] for entry in self.posts[index][0]]
+
+    def test_full_batch(self):
+        """A full batch is sent straight away, and only one batch is
+        sent at a time.
+        """
+        for i in range(7):
+            self.target.log(1, "user", str(i))
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.lines(0), ['0', '1', '2'])
+
+        self.posts[0][1].callback(None)
+        self.assertEqual(len(self.posts), 2)
+        self.assertEqual(self.lines(1), ['3', '4', '5'])
+
+        # What's left isn't a full batch, so it waits its turn.
+        self.posts[1][1].callback(None)
+        self.assertEqual(len(self.posts), 2)
+        self.clock.advance(10)
+        self.assertEqual(self.lines(2), ['6'])
+
+    def test_bytes(self):
+        """Batches are kept under the size limit.
+        """
+        self.target.log(1, "user", "x" * 600)
+        self.target.log(1, "user", "y" * 600)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.lines(0), ["x" * 600])
+        self.posts[0][1].callback(None)
+        self.clock.advance(10)
+        self.assertEqual(self.lines(1), ["y" * 600])
+
+    def test_age(self):
+        """Nothing waits longer than the maximum age to be sent.
+        """
+        self.target.log(1, "user", "hello")
+        self.clock.advance(9)
+        self.assertEqual(self.posts, [])
+        self.clock.advance(1)
+        self.assertEqual(self.lines(0), ['hello'])
+
+    def test_flush_in_flight(self):
+        """Flushing while a batch is being sent waits for it, then sends
+        the rest.
+        """
+        for i in range(4):
+            self.target.log(1, "user", str(i))
+        d = self.target.flush()
+        self.assertEqual(len(self.posts), 1)
+        self.posts[0][1].callback(None)
+        self.assertNoResult(d)
+        self.assertEqual(self.lines(1), ['3'])
+        self.posts[1][1].callback(None)
+        self.assertEqual(self.successResultOf(d), None)
+
+    def test_spill(self):
+        """Past the buffer limit, lines are spilled to disk, and sent, in
+        order, once there's room.
+        """
+        for i in range(12):
+            self.target.log(1, "user", str(i))
+        self.assertEqual(len(self.target._buffer), 5)
+        with open(self.spill_path) as spill:
+            self.assertEqual(len(spill.readlines()), 4)
+
+        d = self.target.flush()
+        for _ in range(4):
+            self.posts[-1][1].callback(None)
+        self.successResultOf(d)
+        sent = sum((self.lines(i) for i in range(len(self.posts))), [])
+        self.assertEqual(sent, [str(i) for i in range(12)])
+        self.assertEqual(self.target.stats.dropped, 0)
+
+    def test_compressed(self):
+        """Batches can be sent gzipped.
+        """
+        self.target.compress = True
+        self.patch(log, 'COMPRESS_CHUNK_LINES', 2)
+        for i in range(3):
+            self.target.log(1, "user", str(i))
+        self.assertEqual(self.lines(0), ['0', '1', '2'])
+        self.assertEqual(self.posts[0][0][0][u'timestamp'], ENCODED_EPOCH)
+
+    def test_grouped(self):
+        """A line about a group of proposals is sent once, with all of
+        them, if the site takes that; otherwise once for each.
+        """
+        self.target.log_group([1, 2], "user", "both")
+        self.clock.advance(10)
+        self.assertEqual([entry[u'proposal'] for entry in self.posts[0][0]],
+                         [1, 2])
+
+        self.target.grouped = True
+        self.posts[0][1].callback(None)
+        self.target.log_group([1, 2], "user", "both")
+        self.clock.advance(10)
+        self.assertEqual(self.posts[1][0][0][u'proposal'], [1, 2])
+
+    def test_retried(self):
+        """A batch that can't be sent is tried again later, backing off,
+        along with newer lines, in order.
+        """
+        self.patch(settings, 'LOG_RETRY_DELAY', 1)
+        for i in range(3):
+            self.target.log(1, "user", str(i))
+        d = self.target.flush()
+        self.posts[0][1].errback(ValueError())
+        self.target.log(1, "user", "3")
+        self.assertEqual(len(self.posts), 1)
+
+        self.clock.advance(1)
+        self.assertEqual(self.lines(1), ['0', '1', '2'])
+        self.posts[1][1].callback(FakeResponse(503))
+        self.clock.advance(1)
+        self.assertEqual(len(self.posts), 2)
+        self.clock.advance(1)
+        self.assertEqual(self.lines(2), ['0', '1', '2'])
+
+        self.posts[2][1].callback(None)
+        self.assertEqual(self.lines(3), ['3'])
+        self.posts[3][1].callback(None)
+        self.assertEqual(self.successResultOf(d), None)
+        stats = self.target.stats
+        self.assertEqual((stats.logged, stats.flushed, stats.retried,
+                          stats.dropped), (4, 4, 6, 0))
+
+    def test_refused(self):
+        """A batch the site refuses outright isn't tried again.
+        """
+        for i in range(3):
+            self.target.log(1, "user", str(i))
+        self.posts[0][1].callback(FakeResponse(400))
+        self.clock.advance(100)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.target.stats.dropped, 3)
+
+    def test_spill_limit(self):
+        """The spill file is bounded too.
+        """
+        self.patch(settings, 'LOG_SPILL_LINES', 2)
+        for i in range(12):
+            self.target.log(1, "user", str(i))
+        self.assertEqual(self.target._spilled, 2)
+        self.assertEqual(self.target.stats.dropped, 2)
+
+
+    def test_spill_trimmed(self):
+        """The spill file is read a batch at a time, trimmed once most of
+        it has been read, and emptied once all of it has.
+        """
+        for i in range(16):
+            self.target.log(1, "user", str(i))
+        self.assertEqual(self.target._spilled, 8)
+
+        # Three lines come back, and are only skipped over.
+        self.posts[-1][1].callback(None)
+        self.assertEqual(self.target._spilled, 5)
+        with open(self.spill_path) as spill:
+            self.assertEqual(len(spill.readlines()), 8)
+
+        # Three more, and most of the file has been read; it's trimmed.
+        self.posts[-1][1].callback(None)
+        with open(self.spill_path) as spill:
+            self.assertEqual([loads(line)[u"line"] for line in spill],
+                             ["14", "15"])
+        self.assertEqual(self.target._spill_offset, 0)
+
+        self.posts[-1][1].callback(None)
+        self.assertEqual(os.path.getsize(self.spill_path), 0)
+        self.assertEqual(self.target._spilled, 0)
+
+    def test_spill_restart(self):
+        """Lines left in the spill file are counted against the limit, and
+        sent, when the target starts again; a line cut short is dropped.
+        """
+        for i in range(12):
+            self.target.log(1, "user", str(i))
+        with open(self.spill_path, "a") as spill:
+            spill.write('{"proposal": 1, "us')
+
+        self.posts = []
+        target = log.PyConSiteLogTarget(
+            "host", "key", max_lines=3, max_buffered=2,
+            spill_path=self.spill_path, _clock=self.clock,
+        )
+        target._post = self._post
+        self.assertEqual(target._spilled, 2)
+        self.assertEqual(len(target._buffer), 2)
+        self.clock.advance(settings.LOG_BATCH_SECONDS)
+        self.assertEqual(self.lines(0), ["8", "9"])
+        self.posts[0][1].callback(None)
+        self.clock.advance(settings.LOG_BATCH_SECONDS)
+        self.assertEqual(self.lines(1), ["10", "11"])
+        self.assertEqual(target._spilled, 0)
+
+
+    def test_close(self):
+        """Closing puts everything not yet sent in the spill file, in
+        order, without waiting for the site; it's sent next time.
+        """
+        for i in range(10):
+            self.target.log(1, "user", str(i))
+        d = self.target.flush()
+        self.successResultOf(self.target.close())
+        self.successResultOf(d)
+        self.target.log(1, "user", "10")
+        self.posts[0][1].errback(ValueError())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        with open(self.spill_path) as spill:
+            self.assertEqual([loads(line)[u"line"] for line in spill],
+                             [str(i) for i in range(11)])
+
+        target = log.PyConSiteLogTarget(
+            "host", "key", max_lines=20, spill_path=self.spill_path,
+            _clock=self.clock,
+        )
+        target._post = self._post
+        target.flush()
+        self.assertEqual(self.lines(1), [str(i) for i in range(11)])
+
+    def test_close_without_spill(self):
+        """With no spill file, closing drops what hasn't been sent.
+        """
+        self.target.spill_path = None
+        for i in range(4):
+            self.target.log(1, "user", str(i))
+        self.successResultOf(self.target.close())
+        self.assertEqual(self.target.stats.dropped, 4)
+
+
+class FakeResponse(object):
+    def __init__(self, code):
+        self.code = code
+
+
 EPOCH = datetime(1989, 2, 7, 00, 30)
 ENCODED_EPOCH = u"1989-02-07 00:30:00.000000"
 ONE_SECOND = timedelta(seconds=1)
@@ -133,6 +405,30 @@ class JSONDateTimeEncoderTests(unittest.TestCase):
         expected = dumps({"datetime": ENCODED_EPOCH})
         self.assertEqual(encoded, expected)
 
+    def test_unknown(self):
+        """Objects the encoder doesn't know about can't be encoded.
+        """
+        self.assertRaises(TypeError, self.encoder.encode, object())
+
+    def test_encode_line(self):
+        """Lines are encoded as JSON objects, even if what was said isn't
+        UTF-8.
+        """
+        line = loads(log.encode_line(5, "caf\xc3\xa9", "caf\xe9", EPOCH))
+        self.assertEqual(line, {u"proposal": 5, u"user": u"caf\xe9",
+                                u"line": u"caf\ufffd",
+                                u"timestamp": ENCODED_EPOCH})
+
+    def test_format_datetime(self):
+        """Datetimes are formatted as strftime would, within a second and
+        across seconds.
+        """
+        date = EPOCH
+        for step in (0, 250000, 999999, 1, 1000000, 3600000000):
+            date += timedelta(microseconds=step)
+            self.assertEqual(log.format_datetime(date),
+                             date.strftime(log.DATETIME_FORMAT))
+
 
 class AutoFlushingLogTargetTests(unittest.TestCase):
     def setUp(self):
@@ -168,6 +464,53 @@ class AutoFlushingLogTargetTests(unittest.TestCase):
         self.assertEqual(self.wrapped_target.flushes, 2)
 
 
+class FanOutLogTargetTests(unittest.TestCase):
+    def setUp(self):
+        self.plain = FakeLogTarget()
+        self.grouped = FakeGroupLogTarget()
+        self.target = log.FanOutLogTarget(self.plain, self.grouped)
+
+    def test_interface(self):
+        verify.verifyObject(log.IGroupLogTarget, self.target)
+
+    def test_log(self):
+        """Lines are logged to every target.
+        """
+        self.target.log(1, "nickname", "message")
+        self.assertEqual(self.plain.logged_messages, [(1, "nickname",
+                                                       "message")])
+        self.assertEqual(self.grouped.logged_messages, [(1, "nickname",
+                                                         "message")])
+
+    def test_log_group(self):
+        """Lines about a group go once to targets that take groups, and
+        once per proposal to the rest.
+        """
+        self.target.log_group([1, 2], "nickname", "message")
+        self.assertEqual(self.plain.logged_messages,
+                         [(1, "nickname", "message"),
+                          (2, "nickname", "message")])
+        self.assertEqual(self.grouped.logged_messages,
+                         [([1, 2], "nickname", "message")])
+
+    def test_flush(self):
+        """Every target is flushed.
+        """
+        self.successResultOf(self.target.flush())
+        self.assertEqual((self.plain.flushes, self.grouped.flushes), (1, 1))
+
+    def test_transcript(self):
+        """Transcripts are read from the first target that keeps them.
+        """
+        self.assertFalse(hasattr(self.target, "transcript"))
+        self.grouped.transcript = lambda proposal: []
+        self.grouped.has_transcript = lambda proposal: False
+        target = log.FanOutLogTarget(self.plain, self.grouped)
+        self.assertIdentical(target.transcript, self.grouped.transcript)
+        self.assertIdentical(target.has_transcript,
+                             self.grouped.has_transcript)
+
+
 class FakeLogTarget(object):
     def __init__(self):
         self.logged_messages = []
@@ -179,3 +522,9 @@ class FakeLogTarget(object):
     def flush(self):
         self.flushes += 1
         return defer.succeed(None)
+
+
+@interface.implementer(log.IGroupLogTarget)
+class FakeGroupLogTarget(FakeLogTarget):
+    def log_group(self, proposals, nickname, message):
+        self.logged_messages.append((proposals, nickname, message))
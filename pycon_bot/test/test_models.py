@@ -0,0 +1,499 @@
+"""
+Tests for the PyCon website models.
+"""
+from pycon_bot import models
+from pycon_bot.utils.exceptions import APIError, MethodNotAllowed, NotFound
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class ProposalManagerTests(unittest.TestCase):
+    """
+    Tests for retrieving proposals through a Deferred-returning API.
+    """
+    def setUp(self):
+        self.api = FakeAPI({
+            1: {'id': 1, 'type': 'talk', 'status': 'undecided'},
+            2: {'id': 2, 'type': 'talk', 'status': 'accepted'},
+            3: {'id': 3, 'type': 'talk', 'status': 'undecided'},
+        })
+        self.manager = models.ProposalManager(self.api)
+
+    def test_filter(self):
+        """Filtering fires with proposals bound to the manager's API.
+        """
+        proposals = self.successResultOf(self.manager.filter())
+        self.assertEqual([p.id for p in proposals], [1, 2, 3])
+        for proposal in proposals:
+            self.assertIdentical(proposal.api, self.api)
+
+    def test_get(self):
+        """Getting a single proposal fires with that proposal.
+        """
+        proposal = self.successResultOf(self.manager.get(2))
+        self.assertEqual(proposal.status, 'accepted')
+
+    def test_get_missing(self):
+        """Getting a nonexistent proposal errbacks with DoesNotExist.
+        """
+        d = self.manager.get(42)
+        self.failureResultOf(d).trap(models.Proposal.DoesNotExist)
+
+    def test_next(self):
+        """The next proposal is the first one with the right status after
+        the given ID.
+        """
+        d = self.manager.next(type='talk', status='undecided', after=1)
+        self.assertEqual(self.successResultOf(d).id, 3)
+
+    def test_next_exhausted(self):
+        """Running off the end of the proposals errbacks with DoesNotExist.
+        """
+        d = self.manager.next(type='talk', status='undecided', after=3)
+        self.failureResultOf(d).trap(models.Proposal.DoesNotExist)
+
+    def test_set_status(self):
+        """Setting a status posts it to the site and mirrors it locally.
+        """
+        proposal = self.successResultOf(self.manager.get(1))
+        self.successResultOf(proposal.set_status('rejected'))
+        self.assertEqual(self.api.posts, [('proposals/1',
+                                           {'status': 'rejected'})])
+        self.assertEqual(proposal.status, 'rejected')
+        self.assertEqual(proposal.decided, True)
+
+
+class ProposalCacheTests(unittest.TestCase):
+    """
+    Tests for the proposal cache kept by the manager.
+    """
+    def setUp(self):
+        self.api = FakeAPI({
+            1: {'id': 1, 'type': 'talk', 'status': 'undecided'},
+            2: {'id': 2, 'type': 'talk', 'status': 'undecided'},
+        })
+        self.now = 0
+        self.manager = models.ProposalManager(self.api, ttl=60)
+        self.manager._time = lambda: self.now
+
+    def test_filter_cached(self):
+        """Filtering the same way twice only goes to the site once, and
+        returns the same proposal objects.
+        """
+        first = self.successResultOf(self.manager.filter(status='undecided'))
+        second = self.successResultOf(self.manager.filter(status='undecided'))
+        self.assertEqual(len(self.api.gets), 1)
+        self.assertEqual([id(p) for p in first], [id(p) for p in second])
+
+    def test_get_cached(self):
+        """A proposal fetched through a filter can be got without going
+        to the site.
+        """
+        self.successResultOf(self.manager.filter())
+        proposal = self.successResultOf(self.manager.get(2))
+        self.assertEqual(proposal.id, 2)
+        self.assertEqual(len(self.api.gets), 1)
+
+    def test_expiry(self):
+        """Once the TTL has passed, the site is asked again.
+        """
+        self.successResultOf(self.manager.filter())
+        self.now = 61
+        self.successResultOf(self.manager.filter())
+        self.assertEqual(len(self.api.gets), 2)
+
+    def test_no_ttl(self):
+        """A TTL of zero turns the cache off.
+        """
+        self.manager.ttl = 0
+        self.successResultOf(self.manager.filter())
+        self.successResultOf(self.manager.filter())
+        self.assertEqual(len(self.api.gets), 2)
+
+    def test_invalidate(self):
+        """Invalidating the cache sends the next request to the site.
+        """
+        self.successResultOf(self.manager.filter())
+        self.manager.invalidate()
+        self.successResultOf(self.manager.filter())
+        self.assertEqual(len(self.api.gets), 2)
+
+    def test_write_through(self):
+        """Writing a status updates cached filter results in place.
+        """
+        undecided = self.manager.filter(status='undecided')
+        proposal = self.successResultOf(undecided)[0]
+        self.successResultOf(proposal.set_status('rejected'))
+
+        d = self.manager.filter(status='undecided')
+        self.assertEqual([p.id for p in self.successResultOf(d)], [2])
+        d = self.manager.next(type='talk', status='undecided')
+        self.assertEqual(self.successResultOf(d).id, 2)
+        self.assertEqual(len(self.api.gets), 1)
+
+    def test_failed_write(self):
+        """A write that the site refuses drops the proposal from the cache.
+        """
+        proposal = self.successResultOf(self.manager.get(1))
+        self.api.post = lambda endpoint, body, **kwargs: defer.fail(
+            NotFound('Gone.'))
+        self.failureResultOf(proposal.set_status('rejected')).trap(NotFound)
+
+        self.successResultOf(self.manager.get(1))
+        self.assertEqual(len(self.api.gets), 2)
+
+
+class ProposalIndexTests(unittest.TestCase):
+    """
+    Tests for the sorted index behind `ProposalManager.next`.
+    """
+    def setUp(self):
+        self.api = FakeAPI({
+            1: {'id': 1, 'type': 'talk', 'status': 'undecided'},
+            2: {'id': 2, 'type': 'tutorial', 'status': 'undecided'},
+            3: {'id': 3, 'type': 'talk', 'status': 'rejected'},
+            4: {'id': 4, 'type': 'talk', 'status': 'undecided'},
+        })
+        self.now = 0
+        self.manager = models.ProposalManager(self.api, ttl=60)
+        self.manager._time = lambda: self.now
+
+    def next_id(self, **kwargs):
+        return self.successResultOf(self.manager.next(**kwargs)).id
+
+    def test_walk(self):
+        """Walking through the talks with `after` visits each matching talk
+        in ID order, and fetches them only once.
+        """
+        kw = {'type': 'talk', 'status': 'undecided'}
+        self.assertEqual(self.next_id(**kw), 1)
+        self.assertEqual(self.next_id(after=1, **kw), 4)
+        self.failureResultOf(self.manager.next(after=4, **kw)).trap(
+            models.Proposal.DoesNotExist)
+        self.assertEqual(self.api.gets, [
+            ('proposals', {'type': 'talk', 'status': 'undecided'}),
+        ])
+
+    def test_index_sorted(self):
+        """The index is kept sorted by type, status and ID.
+        """
+        self.successResultOf(self.manager.filter(type='talk'))
+        self.successResultOf(self.manager.filter(type='tutorial'))
+        self.assertEqual(self.manager._index, [
+            ('talk', 'rejected', 3),
+            ('talk', 'undecided', 1),
+            ('talk', 'undecided', 4),
+            ('tutorial', 'undecided', 2),
+        ])
+
+    def test_write_moves_entry(self):
+        """Writing a new status moves the proposal within the index.
+        """
+        self.next_id(type='talk', status='undecided')
+        proposal = self.successResultOf(self.manager.get(1))
+        self.successResultOf(proposal.set_status('accepted'))
+        self.assertEqual(self.next_id(type='talk', status='undecided'), 4)
+        self.assertIn(('talk', 'accepted', 1), self.manager._index)
+
+    def test_refresh_drops_stale(self):
+        """When a refresh no longer includes a proposal, it leaves the
+        index rather than lingering with its old status.
+        """
+        self.next_id(type='talk', status='undecided')
+        self.api.proposals[1]['status'] = 'accepted'
+        self.now = 61
+        self.assertEqual(self.next_id(type='talk', status='undecided'), 4)
+        self.assertNotIn(('talk', 'undecided', 1), self.manager._index)
+
+
+class ProposalTests(unittest.TestCase):
+    """
+    Tests for the compact proposal representation.
+    """
+    def setUp(self):
+        self.manager = models.ProposalManager(FakeAPI({}))
+        self.proposal = models.Proposal(
+            id=u'12',
+            title=u'Caf\xe9 Society',
+            status=u'undecided',
+            type=u'talk',
+            speakers=[{'name': u'Somebody'}],
+            abstract=u'Na\xefve \u2603',
+            _manager=self.manager,
+        )
+
+    def test_slots(self):
+        """Proposals have no per-instance dictionary.
+        """
+        self.assertFalse(hasattr(self.proposal, '__dict__'))
+
+    def test_hot_fields(self):
+        """Hot fields read back as ASCII.
+        """
+        self.assertEqual(self.proposal.id, 12)
+        self.assertEqual(self.proposal.title, 'Caf Society')
+        self.assertIsInstance(self.proposal.status, str)
+        self.assertEqual(self.proposal.decided, False)
+
+    def test_cold_fields(self):
+        """Other fields from the API are still there, also as ASCII.
+        """
+        self.assertEqual(self.proposal.abstract, 'Nave ')
+        self.assertRaises(KeyError, getattr, self.proposal, 'nonexistent')
+
+    def test_conversion_cached(self):
+        """Each field is only converted to ASCII once.
+        """
+        self.assertIdentical(self.proposal.title, self.proposal.title)
+        self.assertIdentical(self.proposal.abstract, self.proposal.abstract)
+
+    def test_update_clears_conversion(self):
+        """Updating a field replaces what we converted for it.
+        """
+        self.proposal.title
+        self.proposal._update({'title': u'New Title'})
+        self.assertEqual(self.proposal.title, 'New Title')
+
+    def test_data(self):
+        """The raw data is still available, for templates and the like.
+        """
+        self.assertEqual(self.proposal.data['title'], u'Caf\xe9 Society')
+        self.assertEqual(self.proposal.template_context['speaker'],
+                         u'Somebody')
+
+    def test_shared_api(self):
+        """Proposals use their manager's API rather than their own.
+        """
+        self.assertIdentical(self.proposal.api, self.manager.api)
+
+    def test_read_only(self):
+        """Setting attributes directly is not allowed.
+        """
+        self.assertRaises(AttributeError, setattr, self.proposal,
+                          'status', 'accepted')
+
+
+class PagingTests(unittest.TestCase):
+    """
+    Tests for fetching proposals a page at a time.
+    """
+    def setUp(self):
+        self.proposals = dict(
+            (i, {'id': i, 'type': 'talk', 'status': 'undecided'})
+            for i in range(1, 8)
+        )
+
+    def test_iter_filter(self):
+        """Iterating yields every proposal, a page at a time.
+        """
+        api = FakeBlockingAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        ids = [p.id for p in manager.iter_filter(page_size=3)]
+        self.assertEqual(ids, range(1, 8))
+        self.assertEqual([kw['offset'] for e, kw in api.gets], [0, 3, 6])
+
+    def test_iter_filter_lazy(self):
+        """Pages after the ones that were consumed are never fetched.
+        """
+        api = FakeBlockingAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        talks = manager.iter_filter(page_size=3)
+        self.assertEqual([next(talks).id for i in range(3)], [1, 2, 3])
+        self.assertEqual(len(api.gets), 1)
+
+    def test_iter_filter_needs_blocking(self):
+        """Iterating over a Deferred-returning API is refused.
+        """
+        manager = models.ProposalManager(FakeAPI(self.proposals))
+        self.assertRaises(TypeError, list, manager.iter_filter())
+
+    def test_paging_ignored(self):
+        """A site that ignores paging, with exactly a page of results,
+        isn't asked for the same page forever.
+        """
+        del self.proposals[7]
+        api = FakeBlockingAPI(self.proposals, paged=False)
+        manager = models.ProposalManager(api)
+        ids = [p.id for p in manager.iter_filter(page_size=6)]
+        self.assertEqual(ids, range(1, 7))
+        self.assertEqual(len(api.gets), 2)
+
+        api = FakeAPI(self.proposals, paged=False)
+        manager = models.ProposalManager(api)
+        d = manager.take(10, page_size=6)
+        self.assertEqual([p.id for p in self.successResultOf(d)],
+                         range(1, 7))
+        self.assertEqual(len(api.gets), 2)
+
+    def test_take(self):
+        """Taking proposals after an ID fetches only the pages needed.
+        """
+        api = FakeAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        d = manager.take(2, after=2, page_size=3)
+        self.assertEqual([p.id for p in self.successResultOf(d)], [3, 4])
+        self.assertEqual(len(api.gets), 2)
+
+    def test_take_blocking(self):
+        """Taking works the same way through a blocking API.
+        """
+        manager = models.ProposalManager(FakeBlockingAPI(self.proposals))
+        taken = manager.take(10, after=5, page_size=3)
+        self.assertEqual([p.id for p in taken], [6, 7])
+
+    def test_take_cached(self):
+        """Taking from a filter we have cached doesn't go to the site.
+        """
+        api = FakeAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        self.successResultOf(manager.filter(status='undecided'))
+        d = manager.take(2, after=5, status='undecided')
+        self.assertEqual([p.id for p in self.successResultOf(d)], [6, 7])
+        self.assertEqual(len(api.gets), 1)
+
+
+class BulkStatusTests(unittest.TestCase):
+    """
+    Tests for setting many proposals' statuses at once.
+    """
+    def setUp(self):
+        self.proposals = dict(
+            (i, {'id': i, 'type': 'talk', 'status': 'undecided'})
+            for i in range(1, 6)
+        )
+        self.patch(models.settings, 'PROPOSAL_BULK_SIZE', 2)
+
+    def test_batched(self):
+        """Status changes are sent in batches.
+        """
+        api = FakeAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        d = manager.bulk_set_status({1: 'accepted', 2: 'rejected',
+                                     3: 'standby'})
+        self.assertEqual(self.successResultOf(d),
+                         {1: True, 2: True, 3: True})
+        self.assertEqual(api.posts, [
+            ('proposals/bulk', {'talks': [[1, 'accepted'], [2, 'rejected']]}),
+            ('proposals/bulk', {'talks': [[3, 'standby']]}),
+        ])
+
+    def test_updates_cache(self):
+        """Cached proposals pick up their new statuses.
+        """
+        manager = models.ProposalManager(FakeAPI(self.proposals))
+        proposal = self.successResultOf(manager.get(4))
+        self.successResultOf(manager.bulk_set_status({4: 'accepted'}))
+        self.assertEqual(proposal.status, 'accepted')
+        self.assertEqual(proposal.decided, True)
+
+    def test_fallback(self):
+        """Without a batch endpoint, each proposal gets its own request,
+        and we don't try the batch endpoint again.
+        """
+        api = FakeAPI(self.proposals, bulk=False)
+        manager = models.ProposalManager(api)
+        d = manager.bulk_set_status({1: 'accepted', 2: 'rejected',
+                                     3: 'standby'})
+        self.assertEqual(self.successResultOf(d),
+                         {1: True, 2: True, 3: True})
+        self.assertEqual([e for e, body in api.posts], [
+            'proposals/bulk', 'proposals/1', 'proposals/2',
+            'proposals/3',
+        ])
+        self.assertEqual(api.unsafe, ['proposals/bulk'])
+
+    def test_fallback_not_allowed(self):
+        """A site that doesn't allow posting to the batch endpoint doesn't
+        have one either; writes are retried as safely as one at a time.
+        """
+        api = FakeBlockingAPI(self.proposals,
+                              bulk=MethodNotAllowed('Method not allowed.'))
+        manager = models.ProposalManager(api)
+        results = manager.bulk_set_status({1: 'accepted', 2: 'rejected'})
+        self.assertEqual(results, {1: True, 2: True})
+        self.assertEqual(api.unsafe, ['proposals/bulk'])
+
+    def test_per_id_results(self):
+        """A proposal the site refuses gets its error as its result.
+        """
+        api = FakeBlockingAPI(self.proposals, bulk=False)
+        api.broken.add(2)
+        manager = models.ProposalManager(api)
+        results = manager.bulk_set_status({1: 'accepted', 2: 'rejected'})
+        self.assertEqual(results[1], True)
+        self.assertIsInstance(results[2], APIError)
+
+    def test_bad_status(self):
+        """Invalid statuses are refused before anything is sent.
+        """
+        api = FakeAPI(self.proposals)
+        manager = models.ProposalManager(api)
+        self.assertRaises(ValueError, manager.bulk_set_status,
+                          {1: 'accepted', 2: 'maybe'})
+        self.assertEqual(api.posts, [])
+
+
+class FakeAPI(object):
+    """An in-memory stand-in for AsyncAPI, serving the given proposals."""
+    returns_deferreds = True
+
+    def __init__(self, proposals, bulk=True, paged=True):
+        self.proposals = proposals
+        self.bulk = bulk
+        self.paged = paged
+        self.broken = set()
+        self.gets = []
+        self.posts = []
+        self.unsafe = []
+
+    def get(self, endpoint, **kwargs):
+        self.gets.append((endpoint, dict(kwargs)))
+        if endpoint == 'proposals':
+            offset = kwargs.pop('offset', 0)
+            limit = kwargs.pop('limit', None)
+            matches = [p for id, p in sorted(self.proposals.items())
+                       if all(p.get(k) == v for k, v in kwargs.items())]
+            if limit is not None and self.paged:
+                matches = matches[offset:offset + limit]
+            return self._succeed({'data': [dict(p) for p in matches]})
+
+        id = int(endpoint.split('/')[1])
+        if id not in self.proposals:
+            return self._fail(NotFound('No proposal.'))
+        return self._succeed({'data': dict(self.proposals[id])})
+
+    def post(self, endpoint, body, idempotent=False):
+        self.posts.append((endpoint, body))
+        if not idempotent:
+            self.unsafe.append(endpoint)
+        if endpoint == 'proposals/bulk':
+            if isinstance(self.bulk, Exception):
+                return self._fail(self.bulk)
+            if not self.bulk:
+                return self._fail(NotFound('No such endpoint.'))
+            for id, status in body['talks']:
+                self.proposals[id]['status'] = status
+            return self._succeed({})
+
+        id = int(endpoint.split('/')[1])
+        if id in self.broken:
+            return self._fail(APIError('Cannot change #%d.' % id))
+        self.proposals[id].update(body)
+        return self._succeed({})
+
+    def _succeed(self, result):
+        return defer.succeed(result)
+
+    def _fail(self, exception):
+        return defer.fail(exception)
+
+
+class FakeBlockingAPI(FakeAPI):
+    """An in-memory stand-in for the blocking API."""
+    returns_deferreds = False
+
+    def _succeed(self, result):
+        return result
+
+    def _fail(self, exception):
+        raise exception
@@ -0,0 +1,115 @@
+"""
+Tests for flood control of outgoing IRC lines.
+"""
+from pycon_bot import settings
+from pycon_bot.outbox import Outbox
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class OutboxTests(unittest.TestCase):
+    """
+    Tests for the token-bucket outbox.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.outbox = Outbox(self._send, rate=1.0, burst=2, clock=self.clock)
+
+    def _send(self, target, line):
+        self.sent.append((target, line))
+
+    def lines(self, count, width=100):
+        return ['%d' % i + 'x' * width for i in range(count)]
+
+    def test_burst(self):
+        """A burst goes straight out; the rest goes at the steady rate.
+        """
+        for line in self.lines(4):
+            self.outbox.put('#pycon', line)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.outbox.depth, 2)
+
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 3)
+        self.clock.advance(1)
+        self.assertEqual([line for _, line in self.sent], self.lines(4))
+        self.assertEqual(self.outbox.depth, 0)
+
+    def test_refill(self):
+        """The bucket refills while the bot is quiet, up to the burst size.
+        """
+        for line in self.lines(2):
+            self.outbox.put('#pycon', line)
+        self.clock.advance(10)
+        for line in self.lines(3):
+            self.outbox.put('#pycon', line)
+        self.assertEqual(len(self.sent), 4)
+
+    def test_channels_first(self):
+        """Channels are served ahead of private messages.
+        """
+        for line in self.lines(2):
+            self.outbox.put('alice', line)
+        self.outbox.put('alice', 'p' * 100)
+        self.outbox.put('#pycon', 'c' * 100)
+        self.clock.advance(1)
+        self.assertEqual(self.sent[-1], ('#pycon', 'c' * 100))
+
+    def test_round_robin(self):
+        """Targets of the same kind take turns.
+        """
+        self.outbox.tokens = 0
+        for line in self.lines(2):
+            self.outbox.put('alice', line)
+            self.outbox.put('bob', line)
+        self.clock.pump([1] * 4)
+        self.assertEqual([target for target, _ in self.sent],
+                         ['alice', 'bob', 'alice', 'bob'])
+
+    def test_coalesce(self):
+        """Short lines waiting for the same target go as one.
+        """
+        self.outbox.tokens = 0
+        self.outbox.put('alice', 'one')
+        self.outbox.put('alice', 'two')
+        self.outbox.put('bob', 'three')
+        self.outbox.put('alice', 'x' * (settings.IRC_COALESCE_WIDTH + 1))
+        self.clock.pump([1] * 3)
+        self.assertEqual(self.sent, [
+            ('alice', 'one' + settings.IRC_COALESCE_SEPARATOR + 'two'),
+            ('bob', 'three'),
+            ('alice', 'x' * (settings.IRC_COALESCE_WIDTH + 1)),
+        ])
+        self.assertEqual(self.outbox.stats.coalesced, 1)
+
+    def test_services(self):
+        """Lines to services are commands, and are never joined.
+        """
+        self.outbox.tokens = 0
+        self.outbox.put('NickServ', 'ACC alice')
+        self.outbox.put('NickServ', 'ACC bob')
+        self.clock.pump([1] * 2)
+        self.assertEqual(self.sent, [('NickServ', 'ACC alice'),
+                                     ('NickServ', 'ACC bob')])
+
+    def test_stats(self):
+        """The outbox keeps count of how long lines waited.
+        """
+        for line in self.lines(3):
+            self.outbox.put('#pycon', line)
+        self.assertEqual(self.outbox.depths(), {'#pycon': 1})
+        self.clock.advance(1)
+        stats = self.outbox.stats
+        self.assertEqual((stats.queued, stats.sent), (3, 3))
+        self.assertEqual(stats.latency_max, 1)
+        self.assertAlmostEqual(stats.latency_mean, 1 / 3.0)
+
+    def test_clear(self):
+        """Clearing the outbox drops waiting lines and the scheduled send.
+        """
+        for line in self.lines(3):
+            self.outbox.put('#pycon', line)
+        self.outbox.clear()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.outbox.depth, 0)
@@ -0,0 +1,124 @@
+"""
+Tests for the bot's latency measurements.
+"""
+from pycon_bot.stats import Histogram, StallWatchdog, Timings, format_seconds
+from twisted.internet import task
+from twisted.python import log
+from twisted.trial import unittest
+import thread
+
+
+class HistogramTests(unittest.TestCase):
+    """
+    Tests for latency histograms.
+    """
+    def test_percentiles(self):
+        """Percentiles are good to within a bucket, and never more than
+        the slowest time recorded.
+        """
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.add(0.003)
+        histogram.add(0.5)
+        histogram.add(2)
+        self.assertTrue(0.003 <= histogram.percentile(50) < 0.006)
+        self.assertTrue(0.5 <= histogram.percentile(99) < 1)
+        self.assertEqual(histogram.percentile(100), 2)
+        self.assertEqual(histogram.count, 100)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().percentile(99), 0)
+
+    def test_overflow(self):
+        """Times longer than the last bucket are still counted.
+        """
+        histogram = Histogram()
+        histogram.add(1000)
+        self.assertEqual(histogram.percentile(50), 1000)
+
+
+class TimingsTests(unittest.TestCase):
+    """
+    Tests for the collection of histograms.
+    """
+    def setUp(self):
+        self.now = 0
+        self.timings = Timings(timer=lambda: self.now)
+
+    def test_timed(self):
+        """Blocks can be timed, even if they raise.
+        """
+        with self.timings.timed('chair ,next'):
+            self.now += 0.25
+
+        def fail():
+            with self.timings.timed('chair ,next'):
+                self.now += 0.5
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.timings['chair ,next'].count, 2)
+        self.assertEqual(self.timings['chair ,next'].total, 0.75)
+
+    def test_slowest(self):
+        """The slowest things come first, and can be picked out by name.
+        """
+        self.timings.record('chair ,next', 0.01)
+        self.timings.record('api GET', 2)
+        self.timings.record('api POST', 0.1)
+        self.assertEqual([name for name, _ in self.timings.slowest(2)],
+                         ['api GET', 'api POST'])
+        self.assertEqual([name for name, _ in self.timings.slowest(None,
+                                                                  'chair')],
+                         ['chair ,next'])
+
+
+class StallWatchdogTests(unittest.TestCase):
+    """
+    Tests for noticing when the reactor is stuck.
+    """
+    def setUp(self):
+        self.now = 0
+        self.clock = task.Clock()
+        self.watchdog = StallWatchdog(0.25, self.clock, lambda: self.now)
+        self.watchdog._running = True
+        self.watchdog.beat()
+        self.addCleanup(self.watchdog.stop)
+
+    def test_stall(self):
+        """A stall is logged once, with a sample of the stack, and its
+        length is known once the reactor gets free.
+        """
+        logged = []
+        self.watchdog._thread_id = thread.get_ident()
+        log.addObserver(logged.append)
+        self.addCleanup(log.removeObserver, logged.append)
+
+        self.now = 0.2
+        self.assertFalse(self.watchdog.check())
+        self.now = 1
+        self.assertTrue(self.watchdog.check())
+        self.now = 1.5
+        self.assertFalse(self.watchdog.check())
+        self.assertEqual(self.watchdog.stalls, 1)
+        message = ''.join(logged[0]['message'])
+        self.assertIn('Reactor stalled for over 1.0s', message)
+        self.assertIn('test_stall', message)
+
+        self.now = 2
+        self.clock.advance(0.0625)
+        self.assertEqual(self.watchdog.longest, 2)
+
+    def test_busy(self):
+        """A reactor that keeps beating isn't stalled.
+        """
+        for _ in range(20):
+            self.now += 0.0625
+            self.clock.advance(0.0625)
+            self.assertFalse(self.watchdog.check())
+
+
+class FormatTests(unittest.TestCase):
+    def test_format(self):
+        self.assertEqual(format_seconds(0.00034), '340us')
+        self.assertEqual(format_seconds(0.012), '12ms')
+        self.assertEqual(format_seconds(1.53), '1.5s')
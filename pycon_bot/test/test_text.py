@@ -0,0 +1,17 @@
+"""
+Tests for putting things into words.
+"""
+from __future__ import absolute_import
+
+from pycon_bot.utils.text import seconds_to_text
+from twisted.trial import unittest
+
+
+class SecondsToTextTests(unittest.TestCase):
+    def test_seconds_to_text(self):
+        self.assertEqual(seconds_to_text(0), '0 seconds')
+        self.assertEqual(seconds_to_text(1), '1 second')
+        self.assertEqual(seconds_to_text('30'), '30 seconds')
+        self.assertEqual(seconds_to_text(60), '1 minute')
+        self.assertEqual(seconds_to_text(90), '1 minute, 30 seconds')
+        self.assertEqual(seconds_to_text(121), '2 minutes, 1 second')
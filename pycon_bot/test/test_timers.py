@@ -0,0 +1,144 @@
+"""
+Tests for named meeting timers.
+"""
+from pycon_bot.timers import TimerService
+from twisted.internet import task
+from twisted.trial import unittest
+
+
+class TimerServiceTests(unittest.TestCase):
+    """
+    Tests for the heap-backed timer service.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.timers = TimerService(self.clock)
+        self.fired = []
+
+    def start(self, name, seconds, **kwargs):
+        return self.timers.start(name, seconds, self.fired.append, name,
+                                 **kwargs)
+
+    def test_fire(self):
+        """Timers fire in deadline order, with their arguments.
+        """
+        self.start('debate', 180)
+        self.start('vote', 15)
+        self.clock.advance(15)
+        self.assertEqual(self.fired, ['vote'])
+        self.assertFalse(self.timers.active('vote'))
+        self.clock.advance(165)
+        self.assertEqual(self.fired, ['vote', 'debate'])
+        self.assertEqual(len(self.timers), 0)
+
+    def test_one_call(self):
+        """However many timers there are, only one reactor call is pending.
+        """
+        for i in range(100):
+            self.start(i, 100 - i)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([1] * 100)
+        self.assertEqual(self.fired, range(99, -1, -1))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_replace(self):
+        """Starting a timer replaces another of the same name.
+        """
+        self.start('main', 10)
+        self.start('main', 20)
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(10)
+        self.assertEqual(self.fired, ['main'])
+
+    def test_cancel(self):
+        """Cancelled timers never fire.
+        """
+        self.start('main', 10)
+        self.assertEqual(self.timers.cancel('main').name, 'main')
+        self.assertIdentical(self.timers.cancel('main'), None)
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_remaining(self):
+        """The time left on a timer can be asked for.
+        """
+        self.start('main', 60)
+        self.clock.advance(15)
+        self.assertEqual(self.timers.remaining('main'), 45)
+        self.assertIdentical(self.timers.remaining('other'), None)
+
+    def test_delay(self):
+        """Timers can be extended.
+        """
+        self.start('main', 60)
+        self.clock.advance(50)
+        self.timers.delay('main', 60)
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.timers.remaining('main'), 60)
+        self.clock.advance(60)
+        self.assertEqual(self.fired, ['main'])
+
+    def test_pause(self):
+        """Paused timers keep the time they had left until resumed.
+        """
+        self.start('main', 60)
+        self.clock.advance(20)
+        self.timers.pause('main')
+        self.clock.advance(100)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.timers.remaining('main'), 40)
+
+        self.timers.delay('main', 5)
+        self.timers.resume('main')
+        self.clock.advance(44)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ['main'])
+
+    def test_warnings(self):
+        """Warnings are given the given number of seconds before the end.
+        """
+        warned = []
+        self.start('main', 120, warnings=(30, 60, 500),
+                   on_warning=warned.append)
+        self.clock.advance(60)
+        self.assertEqual(warned, [60])
+        self.clock.advance(30)
+        self.assertEqual(warned, [60, 30])
+        self.clock.advance(30)
+        self.assertEqual(self.fired, ['main'])
+
+    def test_warnings_after_delay(self):
+        """Extending a timer past a warning gives the warning again.
+        """
+        warned = []
+        self.start('main', 60, warnings=(30,), on_warning=warned.append)
+        self.clock.advance(40)
+        self.timers.delay('main', 60)
+        self.clock.advance(50)
+        self.assertEqual(warned, [30, 30])
+
+    def test_callback_starts_timer(self):
+        """A timer's callback may start other timers.
+        """
+        self.timers.start('first', 10, self.start, 'second', 5)
+        self.clock.advance(10)
+        self.clock.advance(5)
+        self.assertEqual(self.fired, ['second'])
+
+    def test_callback_fails(self):
+        """A callback that raises is logged, and the other timers still
+        fire.
+        """
+        def fail():
+            raise ValueError('oops')
+        self.timers.start('broken', 10, fail)
+        self.start('vote', 10)
+        self.start('main', 20)
+        self.clock.advance(10)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.clock.advance(10)
+        self.assertEqual(sorted(self.fired), ['main', 'vote'])
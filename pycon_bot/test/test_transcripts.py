@@ -0,0 +1,106 @@
+"""
+Tests for the local transcript store.
+"""
+import os
+
+from pycon_bot.log import IGroupLogTarget
+from pycon_bot.test.test_log import dates
+from pycon_bot.transcripts import TranscriptStore
+from twisted.trial import unittest
+from zope.interface import verify
+
+
+class TranscriptStoreTests(unittest.TestCase):
+    """
+    Tests for keeping transcripts in local files.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+        self._dates = dates()
+        self.store = self.open()
+
+    def open(self, segment_bytes=300):
+        store = TranscriptStore(self.path, segment_bytes=segment_bytes)
+        store._utcnow = lambda: next(self._dates)
+        self.addCleanup(store.close)
+        return store
+
+    def lines(self, proposal, store=None):
+        store = store or self.store
+        return [line['line'] for line in store.transcript(proposal)]
+
+    def test_interface(self):
+        verify.verifyObject(IGroupLogTarget, self.store)
+
+    def test_transcript(self):
+        """Each talk's lines can be read back, and lines about the same
+        talk one after another are indexed as one run.
+        """
+        self.store.log(1, 'alice', 'first')
+        self.store.log(1, 'bob', 'second')
+        self.store.log(2, 'alice', 'other')
+        self.store.log(1, 'alice', 'third')
+        self.assertEqual(self.lines(1), ['first', 'second', 'third'])
+        self.assertEqual(self.lines(2), ['other'])
+        self.assertEqual(self.lines(3), [])
+        self.assertEqual(len(self.store._index[1]), 2)
+        self.assertTrue(self.store.has_transcript(2))
+        self.assertFalse(self.store.has_transcript(3))
+
+        line = self.store.transcript(1)[0]
+        self.assertEqual((line['user'], line['timestamp']),
+                         ('alice', '1989-02-07 00:30:00.000000'))
+
+    def test_group(self):
+        """A line about a group of talks is written once, and read back
+        with each of them, even once the store is opened again.
+        """
+        self.store.log_group([1, 2], 'alice', 'both')
+        self.store.log(2, 'bob', 'just two')
+        self.assertEqual(self.lines(1), ['both'])
+        self.assertEqual(self.lines(2), ['both', 'just two'])
+        self.store.close()
+        with open(self.store._segment_path(1)) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+        store = self.open()
+        self.assertEqual(self.lines(2, store), ['both', 'just two'])
+
+    def test_segments(self):
+        """Full segments are set aside along with their index, and
+        transcripts are read across them.
+        """
+        for i in range(10):
+            self.store.log(1, 'alice', 'line %d' % i)
+        self.assertTrue(self.store._segment > 1)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.path, 'transcript-000001.idx')))
+        self.assertEqual(self.lines(1), ['line %d' % i for i in range(10)])
+
+    def test_reopen(self):
+        """The index is rebuilt when the store is opened again, from the
+        saved indexes of full segments and the last segment itself; a
+        line cut short is dropped.
+        """
+        for i in range(10):
+            self.store.log(i % 2, 'alice', 'line %d' % i)
+        self.store.close()
+        last = self.store._segment_path(self.store._segment)
+        with open(last, 'ab') as f:
+            f.write('{"proposal": 1, "us')
+
+        store = self.open()
+        self.assertEqual(self.lines(1, store),
+                         ['line %d' % i for i in range(1, 10, 2)])
+        store.log(1, 'bob', 'after')
+        self.assertEqual(self.lines(1, store)[-1], 'after')
+
+    def test_lost_index(self):
+        """A full segment whose index has gone missing is read through.
+        """
+        for i in range(10):
+            self.store.log(1, 'alice', 'line %d' % i)
+        self.store.close()
+        os.remove(os.path.join(self.path, 'transcript-000001.idx'))
+        store = self.open()
+        self.assertEqual(len(self.lines(1, store)), 10)
@@ -0,0 +1,212 @@
+"""
+Named countdowns for meetings.
+
+A meeting usually has a few clocks running at once: the debate clock, a
+deferred vote, maybe a reminder or two. The timer service keeps them all
+in one heap ordered by deadline, and keeps a single reactor call pending,
+for whichever of them is due first. Timers can be cancelled, paused,
+resumed and extended by name, and can give warnings ("30 seconds left")
+on the way down.
+"""
+from heapq import heapify, heappop, heappush
+from twisted.python import log
+import itertools
+
+
+class Timer(object):
+    """A single named countdown; see `TimerService.start`."""
+
+    def __init__(self, name, deadline, callback, args, kwargs, warnings,
+                 on_warning):
+        self.name = name
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.warnings = warnings
+        self.on_warning = on_warning
+
+        # While paused, how long was left on the clock.
+        self.paused = None
+
+        # Bumped whenever the timer is rescheduled, so that entries left in
+        # the heap from before can be recognized and skipped.
+        self.generation = 0
+
+    def __repr__(self):
+        state = ' (paused)' if self.paused is not None else ''
+        return '<Timer: %s%s>' % (self.name, state)
+
+
+class TimerService(object):
+    """A set of named timers, kept on a heap."""
+
+    def __init__(self, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self._timers = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._call = None
+
+    def __contains__(self, name):
+        return name in self._timers
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __iter__(self):
+        return iter(list(self._timers.values()))
+
+    def __repr__(self):
+        return '<TimerService: %s>' % ', '.join(sorted(
+            str(name) for name in self._timers
+        ))
+
+    def start(self, name, seconds, callback, *args, **kwargs):
+        """Start a timer that calls `callback(*args, **kwargs)` in `seconds`
+        seconds, replacing any timer of the same name.
+
+        Two keyword arguments are the timer's own rather than the
+        callback's: `warnings`, a sequence of numbers of seconds before the
+        end, and `on_warning`, which is called with the number of seconds
+        left at each of them.
+        """
+        warnings = sorted(kwargs.pop('warnings', ()), reverse=True)
+        on_warning = kwargs.pop('on_warning', None)
+        self.cancel(name)
+        timer = Timer(name, self.clock.seconds() + seconds, callback, args,
+                      kwargs, warnings, on_warning)
+        self._timers[name] = timer
+        self._schedule(timer)
+        return timer
+
+    def cancel(self, name):
+        """Stop the named timer, if there is one, and return it."""
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.generation += 1
+            self._reschedule()
+        return timer
+
+    def cancel_all(self):
+        """Stop every timer."""
+        for name in list(self._timers):
+            self.cancel(name)
+
+    def active(self, name):
+        """Return True if the named timer is running or paused."""
+        return name in self._timers
+
+    def remaining(self, name):
+        """Return how many seconds are left on the named timer, or None if
+        there is no such timer."""
+        timer = self._timers.get(name)
+        if timer is None:
+            return None
+        if timer.paused is not None:
+            return timer.paused
+        return max(0, timer.deadline - self.clock.seconds())
+
+    def delay(self, name, seconds):
+        """Put more time on the named timer."""
+        timer = self._timers[name]
+        if timer.paused is not None:
+            timer.paused += seconds
+        else:
+            timer.deadline += seconds
+            self._schedule(timer)
+
+    def pause(self, name):
+        """Stop the clock on the named timer, until it is resumed."""
+        timer = self._timers[name]
+        if timer.paused is None:
+            timer.paused = self.remaining(name)
+            timer.generation += 1
+            self._reschedule()
+
+    def pause_all(self):
+        """Pause every running timer, and return the names of those that
+        were paused (rather than already paused).
+        """
+        paused = []
+        for name, timer in self._timers.items():
+            if timer.paused is None:
+                self.pause(name)
+                paused.append(name)
+        return paused
+
+    def resume(self, name):
+        """Start the clock on a paused timer again."""
+        timer = self._timers[name]
+        if timer.paused is not None:
+            timer.deadline = self.clock.seconds() + timer.paused
+            timer.paused = None
+            self._schedule(timer)
+
+    def _schedule(self, timer):
+        """Put a timer's deadline, and any warnings still to come, on the
+        heap, in place of any it had there before.
+        """
+        timer.generation += 1
+        left = timer.deadline - self.clock.seconds()
+        for seconds in timer.warnings:
+            if seconds < left:
+                self._push(timer.deadline - seconds, timer, seconds)
+        self._push(timer.deadline, timer, None)
+        self._reschedule()
+
+    def _push(self, when, timer, warning):
+        heappush(self._heap, (when, next(self._sequence), timer.generation,
+                              timer, warning))
+
+    def _stale(self, entry):
+        when, _, generation, timer, _ = entry
+        return (self._timers.get(timer.name) is not timer or
+                generation != timer.generation)
+
+    def _reschedule(self):
+        """Make sure the reactor will call us when the first live entry on
+        the heap is due.
+        """
+        # Throw away stale entries; if most of the heap has gone stale
+        # (say, from a lot of extending), rebuild it.
+        while self._heap and self._stale(self._heap[0]):
+            heappop(self._heap)
+        if len(self._heap) > 2 * len(self._timers) + 16:
+            self._heap = [e for e in self._heap if not self._stale(e)]
+            heapify(self._heap)
+
+        when = self._heap[0][0] if self._heap else None
+        if self._call is not None and self._call.active():
+            if when is not None and self._call.getTime() == when:
+                return
+            self._call.cancel()
+        self._call = None
+        if when is not None:
+            self._call = self.clock.callLater(
+                max(0, when - self.clock.seconds()), self._run,
+            )
+
+    def _run(self):
+        """Fire everything that is due. A callback that fails is logged,
+        and doesn't keep the other timers from firing.
+        """
+        self._call = None
+        now = self.clock.seconds()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heappop(self._heap)
+            if self._stale(entry):
+                continue
+            _, _, _, timer, warning = entry
+            try:
+                if warning is not None:
+                    if timer.on_warning is not None:
+                        timer.on_warning(warning)
+                else:
+                    del self._timers[timer.name]
+                    timer.callback(*timer.args, **timer.kwargs)
+            except Exception:
+                log.err(None, 'Error in timer %r' % (timer.name,))
+        self._reschedule()
@@ -0,0 +1,203 @@
+"""
+A local store of meeting transcripts.
+
+Lines said in the channel are appended, one JSON object per line (as they
+are sent to the PyCon website), to a series of segment files in a
+directory. Alongside, the store keeps an index from each proposal to the
+stretches of the segments where it was discussed, so that one talk's
+debate can be read back (say, when a talk on hold comes up again) without
+reading through every meeting there has ever been.
+
+Lines about the same talk mostly come one after another, so the index
+holds runs of lines rather than every line. When a segment fills up, its
+part of the index is written out next to it, so that opening the store
+only needs to read the segment still being written.
+
+A line about several talks at once (in thunderdome, say, about the whole
+group) is written once, with the list of them as its proposal, and
+indexed under each.
+"""
+from datetime import datetime
+import json
+import os
+import re
+
+from pycon_bot import settings
+from pycon_bot.log import IGroupLogTarget, encode_line
+from twisted.internet import defer
+from zope import interface
+
+SEGMENT_NAME = 'transcript-%06d.log'
+SEGMENT_PATTERN = re.compile(r'^transcript-(\d+)\.log$')
+
+
+@interface.implementer(IGroupLogTarget)
+class TranscriptStore(object):
+    """A log target that keeps transcripts in local files, and can read
+    back any one talk's.
+    """
+    _utcnow = staticmethod(datetime.utcnow)
+
+    def __init__(self, path, segment_bytes=None):
+        self.path = path
+        self.segment_bytes = segment_bytes or settings.TRANSCRIPT_SEGMENT_BYTES
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # For each proposal, a list of [segment, start, end] runs of lines
+        # about it, in the order they were logged.
+        self._index = {}
+
+        segments = sorted(
+            int(match.group(1)) for match in
+            (SEGMENT_PATTERN.match(name) for name in os.listdir(path))
+            if match
+        )
+        for segment in segments[:-1]:
+            self._load_index(segment)
+
+        # Carry on writing the last segment, minus any line cut short when
+        # we last went down.
+        self._segment = segments[-1] if segments else 1
+        length = self._scan(self._segment)
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._file.truncate(length)
+        self._file.seek(0, os.SEEK_END)
+        self._offset = self._file.tell()
+
+    def __repr__(self):
+        return '<TranscriptStore: %s, %d talks>' % (self.path,
+                                                    len(self._index))
+
+    def log(self, proposal, nickname, message):
+        """Appends a line to the transcript of the given proposal.
+        """
+        self._write(proposal, [proposal], nickname, message)
+
+    def log_group(self, proposals, nickname, message):
+        """Appends one line to the transcripts of all the given proposals.
+        """
+        self._write(proposals, proposals, nickname, message)
+
+    def _write(self, proposal, proposals, nickname, message):
+        line = encode_line(proposal, nickname, message, self._utcnow()) + '\n'
+        if self._offset and self._offset + len(line) > self.segment_bytes:
+            self._roll()
+        start = self._offset
+        self._file.write(line)
+        self._offset += len(line)
+        for proposal in proposals:
+            self._add(proposal, self._segment, start, self._offset)
+
+    def flush(self):
+        """Writes out anything logged so far.
+        """
+        self._file.flush()
+        return defer.succeed(None)
+
+    def close(self):
+        self._file.close()
+
+    def has_transcript(self, proposal):
+        """Returns True if anything has been logged about the given
+        proposal, going by the index alone.
+        """
+        return bool(self._index.get(proposal))
+
+    def transcript(self, proposal):
+        """Returns every line logged about the given proposal, oldest
+        first, as dictionaries with the user, line and timestamp.
+        """
+        runs = self._index.get(proposal)
+        if not runs:
+            return []
+        self._file.flush()
+
+        lines = []
+        for segment, runs_in_segment in _by_segment(runs):
+            with open(self._segment_path(segment), 'rb') as f:
+                for _, start, end in runs_in_segment:
+                    f.seek(start)
+                    lines.extend(json.loads(line)
+                                 for line in f.read(end - start).splitlines())
+        return lines
+
+    def _add(self, proposal, segment, start, end):
+        """Index a line about the proposal, extending its last run if the
+        line follows straight on from it.
+        """
+        runs = self._index.setdefault(proposal, [])
+        if runs and runs[-1][0] == segment and runs[-1][2] == start:
+            runs[-1][2] = end
+        else:
+            runs.append([segment, start, end])
+
+    def _roll(self):
+        """Start a new segment, writing out the index of the full one."""
+        self._file.close()
+        self._write_index(self._segment)
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._offset = 0
+
+    def _scan(self, segment):
+        """Index a segment by reading through it, and return the length of
+        the whole lines in it.
+        """
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return 0
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # A line cut short when we last went down.
+                    break
+                start, offset = offset, offset + len(line)
+                proposals = json.loads(line)['proposal']
+                if not isinstance(proposals, list):
+                    proposals = [proposals]
+                for proposal in proposals:
+                    self._add(proposal, segment, start, offset)
+        return offset
+
+    def _load_index(self, segment):
+        """Load the index of a full segment, or rebuild it if it's gone
+        missing.
+        """
+        path = self._index_path(segment)
+        if not os.path.exists(path):
+            self._scan(segment)
+            self._write_index(segment)
+            return
+        with open(path) as f:
+            for proposal, start, end in json.load(f):
+                self._add(proposal, segment, start, end)
+
+    def _write_index(self, segment):
+        entries = [(proposal, start, end)
+                   for proposal, runs in self._index.items()
+                   for run_segment, start, end in runs
+                   if run_segment == segment]
+        entries.sort(key=lambda entry: entry[1])
+        temp = self._index_path(segment) + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(entries, f)
+        os.rename(temp, self._index_path(segment))
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, SEGMENT_NAME % segment)
+
+    def _index_path(self, segment):
+        return self._segment_path(segment)[:-len('.log')] + '.idx'
+
+
+def _by_segment(runs):
+    """Group runs by segment, in order."""
+    groups = []
+    for run in runs:
+        if groups and groups[-1][0] == run[0]:
+            groups[-1][1].append(run)
+        else:
+            groups.append((run[0], [run]))
+    return groups
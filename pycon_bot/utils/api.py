@@ -1,30 +1,309 @@
-from calendar import timegm
-from datetime import datetime
 from hashlib import sha1
-from pycon_bot import settings
+from pycon_bot import settings, stats
 from pycon_bot.utils.exceptions import (APIError, AuthenticationError,
-                                        InternalServerError)
+                                        InternalServerError,
+                                        MethodNotAllowed, NotFound,
+                                        SiteUnavailable)
+from requests.adapters import HTTPAdapter
 from requests.compat import quote
+from twisted.internet import defer, error, task
+from twisted.python import log
+from twisted.web.client import (HTTPConnectionPool, ResponseFailed,
+                                RequestTransmissionFailed)
 import json
 import os
-import pytz
+import random
 import requests
+import time
+import treq
+
+# Requests that can safely be sent more than once.
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD'))
+
+
+class ConnectionStats(object):
+    """Counters for the connections used to talk to the PyCon website."""
+
+    def __init__(self):
+        self.requests = 0
+        self.opened = 0
+
+    @property
+    def reused(self):
+        return self.requests - self.opened
+
+    def __repr__(self):
+        return '<ConnectionStats: %d opened, %d reused>' % (self.opened,
+                                                            self.reused)
+
+
+# Both the blocking and the Twisted clients keep a single pool of keep-alive
+# connections per process, so that we only pay for a TLS handshake when
+# a connection has actually gone away.
+connection_stats = ConnectionStats()
+_session = None
+_pool = None
+_limiter = None
+_breakers = {}
+
+
+def get_session():
+    """Return the process-wide `requests` session used by `API`."""
+    global _session
+    if _session is None:
+        adapter = HTTPAdapter(
+            pool_maxsize=settings.API_POOL_SIZE,
+            pool_block=True,
+        )
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+class CountingConnectionPool(HTTPConnectionPool):
+    """A Twisted connection pool that keeps count of the connections
+    it opens and hands out."""
+
+    def __init__(self, reactor, stats, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent=persistent)
+        self.stats = stats
+
+    def getConnection(self, key, endpoint):
+        self.stats.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.stats.opened += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+
+def get_pool():
+    """Return the process-wide Twisted connection pool used by `AsyncAPI`."""
+    global _pool
+    if _pool is None:
+        from twisted.internet import reactor
+        _pool = CountingConnectionPool(reactor, connection_stats)
+        _pool.maxPersistentPerHost = settings.API_POOL_SIZE
+        _pool.cachedConnectionTimeout = settings.API_KEEPALIVE_SECONDS
+    return _pool
+
+
+def get_limiter():
+    """Return the semaphore bounding concurrent `AsyncAPI` requests to the
+    size of the pool."""
+    global _limiter
+    if _limiter is None:
+        _limiter = defer.DeferredSemaphore(settings.API_POOL_SIZE)
+    return _limiter
+
+
+class CircuitBreaker(object):
+    """Keeps track of whether a host is up, so that we can stop asking it
+    for things once it clearly isn't.
+
+    The breaker starts out closed. After `threshold` failures in a row it
+    opens, and every request is refused without being sent. Once `reset`
+    seconds have passed, a single request is let through (half-open): if
+    it succeeds the breaker closes again, and if it fails the breaker
+    stays open for another `reset` seconds.
+
+    Writes refused while the breaker is open are queued, and replayed in
+    the order they were made as soon as the breaker closes.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, reset, clock=time.time):
+        self.threshold = threshold
+        self.reset = reset
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.pending = []
+
+    def __repr__(self):
+        return '<CircuitBreaker: %s, %d queued>' % (self.state,
+                                                    len(self.pending))
+
+    def allow(self):
+        """Return True if a request may be sent right now."""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset:
+                return False
+            self.state = self.HALF_OPEN
+            return True
+        return self.state == self.CLOSED
+
+    def failed(self):
+        """Record that a request to the host failed."""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+    def succeeded(self):
+        """Record that the host answered, and replay any queued writes
+        if it had been down.
+        """
+        self.failures = 0
+        self.state = self.CLOSED
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self._replay(pending)
+
+    def queue(self, call, waiter=None):
+        """Queue `call` to be made once the host is back up. If given,
+        `waiter` (a Deferred) is fired with its result.
+        """
+        self.pending.append((call, waiter))
+        return waiter
+
+    def _replay(self, pending):
+        """Make each of the queued calls in turn, stopping (and putting
+        the rest back) if the host goes down again part way through.
+        """
+        if not pending:
+            return
+        if self.state != self.CLOSED:
+            self.pending[:0] = pending
+            return
+
+        call, waiter = pending.pop(0)
+        d = defer.maybeDeferred(call)
+        if waiter is not None:
+            d.chainDeferred(waiter)
+        else:
+            d.addErrback(log.err, 'Replaying a queued write failed')
+        d.addCallback(lambda _: self._replay(pending))
+
+
+def get_breaker(host):
+    """Return the circuit breaker shared by every client of `host`."""
+    if host not in _breakers:
+        _breakers[host] = CircuitBreaker(
+            settings.API_BREAKER_THRESHOLD,
+            settings.API_BREAKER_RESET_SECONDS,
+        )
+    return _breakers[host]
 
 
 class API(object):
-    def __init__(self, api_key=None, api_secret=None, host=None):
+    """Blocking client for the PyCon website API. Every call waits for
+    the site to answer; use `AsyncAPI` from inside the reactor.
+    """
+    returns_deferreds = False
+
+    # The errors worth trying again for: the site fell over, or we never
+    # managed to talk to it at all.
+    retriable = (InternalServerError, requests.ConnectionError,
+                 requests.Timeout)
+    _sleep = staticmethod(time.sleep)
+    _random = staticmethod(random.random)
+    _time = staticmethod(time.time)
+    _secret_hashed = None
+
+    def __init__(self, api_key=None, api_secret=None, host=None,
+                 queue_writes=True):
         self.api_key = api_key or settings.API_KEY
         self.api_secret = api_secret or settings.API_SECRET
         self.host = host or settings.WEBSITE_HOST
+        self.queue_writes = queue_writes
 
     def get(self, endpoint, **kwargs):
         return self.request('GET', endpoint, **kwargs)
 
-    def post(self, endpoint, body):
-        return self.request('POST', endpoint, json.dumps(body))
+    def post(self, endpoint, body, idempotent=False):
+        return self.request('POST', endpoint, json.dumps(body),
+                            idempotent=idempotent)
+
+    def request(self, method, endpoint, body='', idempotent=None, **kwargs):
+        """Make a request to the PyCon website, and return the result.
+
+        GET requests (and any other request marked `idempotent`) that
+        fail because the site is having trouble are retried, after
+        a jittered, exponentially growing delay. If the site has failed
+        too often recently, raise `SiteUnavailable` without asking it;
+        writes refused this way are queued and sent once it recovers.
+        """
+        breaker = get_breaker(self.host)
+        if not breaker.allow():
+            return self._refuse(breaker, method, endpoint, body, kwargs)
+
+        # This blocks the reactor, retries and all, so keep track of how
+        # long it takes.
+        with stats.timings.timed('api %s' % method):
+            attempts = self._attempts(method, idempotent)
+            for attempt in range(attempts):
+                try:
+                    result = self._send(method, endpoint, body, kwargs)
+                except self.retriable:
+                    breaker.failed()
+                    if attempt + 1 >= attempts or not breaker.allow():
+                        raise
+                    self._sleep(self._backoff(attempt))
+                except APIError:
+                    # The site is up, it just didn't like what we asked.
+                    breaker.succeeded()
+                    raise
+                except Exception:
+                    # Something we can't retry (say, a page that isn't
+                    # JSON); count it against the site all the same, so
+                    # that a half-open breaker doesn't stay that way.
+                    breaker.failed()
+                    raise
+                else:
+                    breaker.succeeded()
+                    return result
+
+    def _refuse(self, breaker, method, endpoint, body, params):
+        """Fail a request without sending it, queueing it for later if it
+        was a write.
+        """
+        if method in IDEMPOTENT_METHODS or not self.queue_writes:
+            raise SiteUnavailable(self.host)
+        breaker.queue(lambda: self.request(method, endpoint, body, **params))
+        raise SiteUnavailable(self.host, queued=True)
+
+    def _attempts(self, method, idempotent=None):
+        """Return how many times a request may be sent."""
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if idempotent:
+            return settings.API_RETRIES + 1
+        return 1
+
+    def _backoff(self, attempt):
+        """Return how long to wait before retrying after the given
+        (zero-based) attempt: a random fraction of a delay that doubles
+        every time, so that clients don't all retry in lockstep.
+        """
+        ceiling = min(settings.API_RETRY_MAX_DELAY,
+                      settings.API_RETRY_DELAY * 2 ** attempt)
+        return self._random() * ceiling
+
+    def _send(self, method, endpoint, body, params):
+        """Send a single request to the PyCon website."""
+        url, headers = self._prepare_request(method, endpoint, body, params)
 
-    def request(self, method, endpoint, body='', **kwargs):
-        """Make a request to the PyCon website, and return the result."""
+        # Make the actual request to the PyCon website, over a pooled
+        # connection if one is available. The pool for this host tells us
+        # whether it had to open a new connection to do so.
+        session = get_session()
+        pool = session.get_adapter(url).poolmanager.connection_from_url(url)
+        opened = pool.num_connections
+        r = session.request(method, url, data=body, headers=headers,
+                                        verify=False)
+        connection_stats.requests += 1
+        connection_stats.opened += pool.num_connections - opened
+
+        # Raise on any error; otherwise return the decoded body.
+        return self._parse_response(r.status_code, r.content, r)
+
+    def _prepare_request(self, method, endpoint, body, params):
+        """Return the full URL and the signed headers for a request."""
         # The PyCon website runs using HTTPS, but localhost doesn't.
         # Determine the right thing.
         protocol = 'https'
@@ -36,9 +315,9 @@ class API(object):
 
         # If keyword arguments are provided, append them to
         # the URI.
-        if kwargs:
+        if params:
             uri += '?' + '&'.join(
-                ['%s=%s' % (k, quote(str(v))) for k, v in kwargs.items()],
+                ['%s=%s' % (k, quote(str(v))) for k, v in params.items()],
             )
 
         # Construct the full URL.
@@ -50,39 +329,43 @@ class API(object):
 
         # Generate the appropriate request signature to certify
         # that this is a valid request.
-        signature = self._sign_request(uri, method, body)
+        headers = self._sign_request(uri, method, body)
 
         # Add the appropriate content-type header.
         if method == 'POST':
-            signature['Content-Type'] = 'application/json'
+            headers['Content-Type'] = 'application/json'
 
-        # Make the actual request to the PyCon website.
-        r = requests.request(method, url, data=body, headers=signature,
-                                          verify=False)
+        return url, headers
 
+    def _parse_response(self, status_code, content, response):
+        """Raise the appropriate exception if the site returned an error;
+        otherwise, return the decoded JSON body.
+        """
         # Sanity check: Did we get a bad request of some kind?
-        if r.status_code >= 400:
+        if status_code >= 400:
             # If we got a 500 response, we can't really know what to do
-            if r.status_code >= 500:
-                raise InternalServerError(r)
+            if status_code >= 500:
+                raise InternalServerError(response)
 
             # What exception class shall I use?
             exc_class = APIError
-            if r.status_code == 403:
+            if status_code == 403:
                 exc_class = AuthenticationError
-            if r.status_code == 404:
+            if status_code == 404:
                 exc_class = NotFound
+            if status_code == 405:
+                exc_class = MethodNotAllowed
 
             # Create and raise the exception
             try:
-                ex = exc_class(r.json()['error'])
-            except ValueError:
-                raise InternalServerError(r)
-            ex.request = r
+                ex = exc_class(json.loads(content)['error'])
+            except (ValueError, KeyError):
+                raise InternalServerError(response)
+            ex.request = response
             raise ex
 
         # OK, all is well; return the response.
-        return r.json()
+        return json.loads(content)
 
     def _sign_request(self, uri, method, body=''):
         """Return a dictionary with the appropriate headers with which
@@ -90,20 +373,123 @@ class API(object):
         """
         # What time is it right now? We use the current timestamp
         # as part of the request signature.
-        timestamp = timegm(datetime.now(tz=pytz.UTC).timetuple())
+        timestamp = str(int(self._time()))
 
-        # Create the "base string", and then SHA1 hash it.
-        base_string = unicode(''.join((
-            self.api_secret,
-            unicode(timestamp),
-            method.upper(),
-            uri,
-            body,
-        )))
+        # The signature is the SHA1 of the secret, the timestamp, the
+        # method, the URI and the body, one after the other. The secret
+        # never changes, so start from a hash that has already seen it.
+        signature = self._secret_hash()
+        signature.update(timestamp)
+        signature.update(method.upper())
+        signature.update(_to_bytes(uri))
+        signature.update(_to_bytes(body))
 
         # Return a signature dictionary.
         return {
             'X-API-Key': self.api_key,
-            'X-API-Signature': sha1(base_string.encode('utf-8')).hexdigest(),
+            'X-API-Signature': signature.hexdigest(),
             'X-API-Timestamp': timestamp,
         }
+
+    def _secret_hash(self):
+        """Return a fresh copy of a SHA1 hash that has been fed the API
+        secret, and nothing else.
+        """
+        if self._secret_hashed != self.api_secret:
+            self._secret_sha1 = sha1(_to_bytes(self.api_secret))
+            self._secret_hashed = self.api_secret
+        return self._secret_sha1.copy()
+
+
+def _to_bytes(value):
+    """Return `value` as UTF-8 encoded bytes."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class AsyncAPI(API):
+    """Non-blocking client for the PyCon website API, for use inside the
+    Twisted reactor. Every call returns a Deferred that fires with the
+    decoded JSON body, or errbacks with the same exceptions `API` raises.
+    """
+    returns_deferreds = True
+    retriable = (InternalServerError, error.ConnectError,
+                 error.ConnectionClosed, ResponseFailed,
+                 RequestTransmissionFailed)
+    _request = staticmethod(treq.request)
+    _clock = None
+
+    def request(self, method, endpoint, body='', idempotent=None, **kwargs):
+        """Make a request to the PyCon website, and return a Deferred
+        that fires with the result.
+
+        Retries are scheduled on the reactor rather than slept through.
+        A write refused because the site is down fires once it has been
+        replayed.
+        """
+        breaker = get_breaker(self.host)
+        if not breaker.allow():
+            return self._refuse(breaker, method, endpoint, body, kwargs)
+        return self._attempt(breaker, method, endpoint, body, kwargs,
+                             self._attempts(method, idempotent), 0)
+
+    def _refuse(self, breaker, method, endpoint, body, params):
+        if method in IDEMPOTENT_METHODS or not self.queue_writes:
+            return defer.fail(SiteUnavailable(self.host))
+        return breaker.queue(
+            lambda: self.request(method, endpoint, body, **params),
+            defer.Deferred(),
+        )
+
+    def _attempt(self, breaker, method, endpoint, body, params, attempts,
+                 attempt):
+        """Send the request, and schedule another go if it fails and we
+        have any left.
+        """
+        def succeeded(result):
+            breaker.succeeded()
+            return result
+
+        def failed(failure):
+            if failure.check(APIError):
+                breaker.succeeded()
+                return failure
+            breaker.failed()
+            if not failure.check(*self.retriable):
+                # Count it against the site, but don't try again.
+                return failure
+            if attempt + 1 >= attempts or not breaker.allow():
+                return failure
+            clock = self._clock
+            if clock is None:
+                from twisted.internet import reactor as clock
+            return task.deferLater(
+                clock, self._backoff(attempt), self._attempt,
+                breaker, method, endpoint, body, params, attempts,
+                attempt + 1,
+            )
+
+        d = self._send(method, endpoint, body, params)
+        d.addCallbacks(succeeded, failed)
+        return d
+
+    def _send(self, method, endpoint, body, params):
+        url, headers = self._prepare_request(method, endpoint, body, params)
+
+        # Make the actual request to the PyCon website, waiting our turn
+        # if the pool is already busy.
+        def request():
+            d = self._request(method, url, data=body or None,
+                              headers=headers, pool=get_pool())
+            d.addCallback(self._read_response)
+            return d
+        return get_limiter().run(request)
+
+    def _read_response(self, response):
+        """Read the body of a response, then check it for errors."""
+        d = treq.content(response)
+        d.addCallback(lambda content: self._parse_response(
+            response.code, content, response,
+        ))
+        return d
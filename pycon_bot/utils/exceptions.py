@@ -7,6 +7,24 @@ class AuthenticationError(APIError):
 class NotFound(APIError):
     pass
 
+class MethodNotAllowed(APIError):
+    pass
+
 class InternalServerError(Exception):
     def __init__(self, r):
         self.r = r
+
+    @property
+    def status_code(self):
+        """The HTTP status of the response, from either API client."""
+        return getattr(self.r, 'status_code', getattr(self.r, 'code', None))
+
+
+class SiteUnavailable(Exception):
+    """The PyCon website has been failing, so the request was not sent.
+    If `queued` is set, it will be sent once the site recovers.
+    """
+    def __init__(self, host, queued=False):
+        Exception.__init__(self, host)
+        self.host = host
+        self.queued = queued
@@ -0,0 +1,22 @@
+"""
+Putting things into words for the channel.
+"""
+
+
+def seconds_to_text(seconds):
+    """Convert a number of seconds, specified as an int or string,
+    to a pretty string: '30 seconds', '2 minutes', '1 minute, 30 seconds'.
+    """
+    seconds = int(seconds)
+
+    # sanity check: 0 seconds is a corner case; just return it back statically
+    if seconds == 0:
+        return '0 seconds'
+
+    parts = []
+    minutes, seconds = divmod(seconds, 60)
+    if minutes:
+        parts.append('%d minute%s' % (minutes, '' if minutes == 1 else 's'))
+    if seconds:
+        parts.append('%d second%s' % (seconds, '' if seconds == 1 else 's'))
+    return ', '.join(parts)
@@ -14,12 +14,53 @@ from twisted.web.wsgi import WSGIResource
 import pycon_bot.driver
 
 from pycon_bot import settings
+from pycon_bot.journal import Journal
+from pycon_bot.log import FanOutLogTarget, PyConSiteLogTarget
+from pycon_bot.modes.base import preload_modes
+from pycon_bot.stats import StallWatchdog
+from pycon_bot.transcripts import TranscriptStore
 
 
-def run_bot(irc_server, irc_port, irc_channel, bot_name, logfile):
+def run_bot(irc_server, irc_port, irc_channels, bot_name, logfile,
+            journal_path=None, transcript_path=None, upload=False):
     log.startLogging(logfile)
+
+    # Load every mode now, so that the first `,mode` doesn't wait on it.
+    log.msg('Modes available: %s' % ', '.join(preload_modes()))
+
+    # Open the decision journal, and send on anything left over from
+    # the last run as soon as we're up.
+    journal = None
+    if journal_path:
+        journal = Journal(journal_path)
+        reactor.callWhenRunning(journal.drain)
+        reactor.addSystemEventTrigger('before', 'shutdown', journal.close)
+
+    # Keep the channel's transcripts, so that talks can be looked back on.
+    log_target = None
+    if transcript_path:
+        log_target = TranscriptStore(transcript_path)
+        reactor.addSystemEventTrigger('before', 'shutdown', log_target.close)
+
+    # Send them on to the PyCon website too, if asked.
+    if upload:
+        site = PyConSiteLogTarget(settings.WEBSITE_HOST, settings.API_KEY)
+        reactor.addSystemEventTrigger('before', 'shutdown', site.close)
+        if log_target is None:
+            log_target = site
+        else:
+            log_target = FanOutLogTarget(log_target, site)
+
+    # Keep an eye out for anything holding up the reactor.
+    watchdog = StallWatchdog()
+    reactor.callWhenRunning(watchdog.start)
+    reactor.addSystemEventTrigger('before', 'shutdown', watchdog.stop)
+
     if irc_server is not None:
-        bot = pycon_bot.driver.PyConBotFactory([irc_channel], bot_name)
+        bot = pycon_bot.driver.PyConBotFactory(irc_channels, bot_name,
+                                               journal=journal,
+                                               watchdog=watchdog,
+                                               log_target=log_target)
         reactor.connectTCP(irc_server, irc_port, bot)
     reactor.run()
 
@@ -28,15 +69,25 @@ if __name__ == '__main__':
     p = argparse.ArgumentParser()
     p.add_argument('--irc-server', default='irc.freenode.net')
     p.add_argument('--irc-port', type=int, default=6667)
-    p.add_argument('--irc-channel', default=settings.IRC_CHANNEL),
+    p.add_argument('--irc-channel', action='append', dest='irc_channels',
+                   help='A channel to join; may be given more than once, '
+                        'and every channel runs its own meeting.'),
     p.add_argument('--irc-nickname', default=settings.IRC_NICK),
+    p.add_argument('--journal', default=settings.JOURNAL_PATH),
+    p.add_argument('--transcripts', default=settings.TRANSCRIPT_PATH),
+    p.add_argument('--upload-transcripts', action='store_true',
+                   default=settings.LOG_UPLOAD,
+                   help='Send transcripts to the PyCon website as well.'),
     args = p.parse_args()
 
     # Run ze bot!
     run_bot(
         irc_server=args.irc_server,
         irc_port=args.irc_port,
-        irc_channel=args.irc_channel,
+        irc_channels=args.irc_channels or settings.IRC_CHANNELS,
         bot_name=args.irc_nickname,
         logfile=sys.stderr,
+        journal_path=args.journal,
+        transcript_path=args.transcripts,
+        upload=args.upload_transcripts,
     )
@@ -46,8 +46,9 @@ class Command(object):
     def handle_kitten(self):
         """Print out an agenda for a single kittendome meeting."""
 
-        # Get a list of talks.
-        talks = Proposal.objects.talks()
+        # Get the undecided talks, a page at a time; we stop asking for more
+        # as soon as we have enough.
+        talks = Proposal.objects.iter_filter(type='talk', status='undecided')
         counter = 0
 
         # Iterate over talks until we either run out of talks,
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Measure how long it takes to sign a request to the PyCon website API.
+
+Scripts that make a lot of requests (fetching context for bulk email, say)
+sign every one of them, so this should stay well below the cost of the
+request itself. The old way of signing (building a unicode base string and
+hashing the secret afresh every time) is timed alongside for comparison.
+"""
+import argparse
+import timeit
+from calendar import timegm
+from datetime import datetime
+from hashlib import sha1
+
+import pytz
+
+from pycon_bot.utils.api import API
+
+
+def legacy_sign(api, uri, method, body=''):
+    """Sign a request the way `API._sign_request` used to."""
+    timestamp = timegm(datetime.now(tz=pytz.UTC).timetuple())
+    base_string = unicode(''.join((
+        api.api_secret,
+        unicode(timestamp),
+        method.upper(),
+        uri,
+        body,
+    )))
+    return {
+        'X-API-Key': api.api_key,
+        'X-API-Signature': sha1(base_string.encode('utf-8')).hexdigest(),
+        'X-API-Timestamp': str(timestamp),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('-n', '--number', type=int, default=100000,
+                   help='How many requests to sign in each run')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='How many runs to take the best of')
+    args = p.parse_args()
+
+    api = API('key', 'x' * 40, 'us.pycon.org')
+    uri = '/2015/pycon_api/proposals/1234/'
+    body = '{"status": "accepted", "alternative": null}'
+    for name, sign in (('current', api._sign_request),
+                       ('legacy', lambda *a: legacy_sign(api, *a))):
+        for method, data in (('GET', ''), ('POST', body)):
+            best = min(timeit.repeat(lambda: sign(uri, method, data),
+                                     number=args.number, repeat=args.repeat))
+            print '%-8s %-5s %6.2f usec per request' % (
+                name, method, best / args.number * 1e6)
+
+
+if __name__ == '__main__':
+    main()
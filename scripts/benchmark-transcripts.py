@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Measure what it costs to upload meeting transcripts to the PyCon website.
+
+A busy meeting logs thousands of lines, each of which has to be encoded as
+JSON (timestamp and all) and sent to the website. This times encoding and
+building the request bodies for a run of lines, and counts the bytes that
+would be sent, both plain and gzipped. The old way (a dictionary buffered
+for every line, and the whole buffer encoded at once, with `strftime` for
+every timestamp) is measured alongside for comparison. All three are timed
+from logging the first line to having the last request body in hand.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from json import JSONEncoder
+
+from pycon_bot import log, settings
+
+
+class LegacyEncoder(JSONEncoder):
+    """Encode datetimes the way `JSONDateTimeEncoder` used to."""
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.strftime(log.DATETIME_FORMAT)
+        return JSONEncoder.default(self, obj)
+
+
+def chatter(count):
+    """Return `count` made-up lines of channel chatter, with the times
+    they were said: a few lines a second, with some longer gaps.
+    """
+    words = ('talk', 'proposal', 'champion', 'aye', 'nay', 'the', 'is',
+             'good', 'a', 'scope', 'reviewer', 'speaker', 'tutorial', 'I',
+             'think', 'this', 'maybe', 'beginner', 'audience', 'abstain')
+    rng = random.Random(2015)
+    when = datetime(2015, 1, 20, 19, 0)
+    lines = []
+    for _ in range(count):
+        when += timedelta(microseconds=rng.randint(0, 2000000))
+        text = ' '.join(rng.choice(words)
+                        for _ in range(rng.randint(1, 25)))
+        lines.append((rng.randint(1, 40), 'user%d' % rng.randint(1, 30),
+                      text, when))
+    return lines
+
+
+class LegacyTarget(object):
+    """`PyConSiteLogTarget` as it used to be: a dict buffered for every
+    line, and the whole buffer encoded when it's flushed."""
+
+    def __init__(self, utcnow):
+        self._utcnow = utcnow
+        self._buffer = []
+        self._encoder = LegacyEncoder()
+
+    def log(self, proposal, nickname, message):
+        self._buffer.append({
+            u"proposal": proposal,
+            u"user": nickname,
+            u"line": message,
+            u"timestamp": self._utcnow()
+        })
+
+    def flush(self):
+        to_send, self._buffer = self._buffer, []
+        return self._encoder.encode(to_send)
+
+
+def legacy(lines, batch_lines):
+    """Log and encode the lines the old way, flushing a batch's worth at a
+    time."""
+    times = iter(when for _, _, _, when in lines)
+    target = LegacyTarget(lambda: next(times))
+    bodies = []
+    for i, (proposal, user, text, _) in enumerate(lines):
+        target.log(proposal, user, text)
+        if (i + 1) % batch_lines == 0:
+            bodies.append(target.flush())
+    if target._buffer:
+        bodies.append(target.flush())
+    return bodies
+
+
+def current(lines, compress):
+    """Encode the lines the way `PyConSiteLogTarget` does now."""
+    bodies = []
+    target = log.PyConSiteLogTarget('example.com', 'key', compress=compress,
+                                    max_age=3600, spill_path=None,
+                                    _clock=FakeClock())
+    target._post = lambda url, body, headers: bodies.append(body) or Pending()
+    times = iter(when for _, _, _, when in lines)
+    target._utcnow = lambda: next(times)
+    for proposal, user, text, _ in lines:
+        target.log(proposal, user, text)
+        if target._sending is not None:
+            target._sending = None
+    if target._buffer:
+        target._send()
+    return bodies
+
+
+class FakeClock(object):
+    def callLater(self, *args):
+        return Pending()
+
+
+class Pending(object):
+    """A call, or a request, that never finishes."""
+    def addBoth(self, *args):
+        return self
+
+    def active(self):
+        return False
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('-n', '--number', type=int, default=10000,
+                   help='How many lines to encode in each run')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='How many runs to take the best of')
+    args = p.parse_args()
+
+    lines = chatter(args.number)
+    for name, encode in (
+        ('legacy', lambda: legacy(lines, settings.LOG_BATCH_LINES)),
+        ('current', lambda: current(lines, False)),
+        ('gzipped', lambda: current(lines, True)),
+    ):
+        best = None
+        for _ in range(args.repeat):
+            start = time.clock()
+            bodies = encode()
+            elapsed = time.clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+        sent = sum(len(body) for body in bodies)
+        print '%-8s %8.1f ms CPU %10d bytes in %3d requests' % (
+            name, best * 1000, sent, len(bodies))
+
+
+if __name__ == '__main__':
+    main()